@@ -1,28 +1,87 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 import motor.motor_asyncio
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
+from typing import Dict, Optional, List, Union
 import os
 from datetime import datetime, timezone, timedelta
 import uuid
 import base64
+import hashlib
+import csv
+import io
 import json
+import orjson
 import paypalrestsdk
+import requests
+import threading
+import functools
+import importlib.util
+import multiprocessing
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import warnings
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from email import encoders
 import pytz
 import secrets
+import time
+import asyncio
+import contextlib
+import logging
+import math
+from collections import OrderedDict, deque
+import contextvars
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+import gridfs
+import jinja2
+from PIL import Image, ImageOps, UnidentifiedImageError
+from starlette.datastructures import Headers
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+# Only this app's logger is configured; libraries keep their own (default WARNING) levels
+logger = logging.getLogger("psicoliz")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(levelname)s:     %(name)s - %(message)s"))
+    logger.addHandler(log_handler)
+    logger.propagate = False
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Warm up MongoDB and its indexes before anything else starts, then run the startup hooks.
+    
+    A worker that cannot reach MongoDB fails startup instead of serving and
+    reporting healthy; warm_up_mongo has already retried by then.
+    """
+    started = time.perf_counter()
+    try:
+        await warm_up_mongo()
+    except Exception:
+        logger.exception("MongoDB warm-up failed, aborting startup")
+        raise
+    logger.info("MongoDB warm-up finished in %.2fs", time.perf_counter() - started)
+    await ensure_indexes()
+    await app.router.startup()
+    try:
+        yield
+    finally:
+        await app.router.shutdown()
+
+# orjson renders responses; handlers with a response_model are serialized by pydantic-core
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Root route for health check
 @app.get("/")
@@ -54,16 +113,445 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
+)
+
+# Metrics, exposed in Prometheus text format on /api/metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+MONGO_COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+LOOP_LAG_WINDOW = 120  # samples kept for the health endpoint's recent maximum
+
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is safe to call from worker threads"""
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = format_labels(self.label_names + ("le",), label_values + (repr(float(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.label_names + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callable at scrape time"""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+class RequestMetrics:
+    """Work attributed to the current HTTP request.
+
+    Held in a context variable; Motor copies the context into its executor
+    threads, so the command listener sees the request that issued each command.
+    """
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.external_seconds = 0.0
+
+current_request_metrics = contextvars.ContextVar("current_request_metrics", default=None)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    LATENCY_BUCKETS, ("method", "route", "status")
+)
+http_request_mongo_commands = Histogram(
+    "http_request_mongo_commands", "MongoDB commands issued per HTTP request",
+    MONGO_COMMAND_COUNT_BUCKETS, ("method", "route")
+)
+http_request_mongo_duration = Histogram(
+    "http_request_mongo_duration_seconds", "Time spent in MongoDB commands per HTTP request",
+    LATENCY_BUCKETS, ("method", "route")
+)
+http_request_external_duration = Histogram(
+    "http_request_external_duration_seconds", "Time spent waiting on PayPal per HTTP request",
+    LATENCY_BUCKETS, ("method", "route")
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency",
+    MONGO_LATENCY_BUCKETS, ("command", "outcome")
 )
+external_call_duration = Histogram(
+    "external_call_duration_seconds", "PayPal and SMTP call latency",
+    LATENCY_BUCKETS, ("service", "operation", "outcome")
+)
+
+def observe_external_call(service, operation, started, outcome):
+    seconds = time.perf_counter() - started
+    external_call_duration.observe(seconds, service, operation, outcome)
+    request_metrics = current_request_metrics.get()
+    if request_metrics is not None:
+        request_metrics.external_seconds += seconds
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_duration.observe(seconds, event.command_name, outcome)
+        request_metrics = current_request_metrics.get()
+        if request_metrics is not None:
+            request_metrics.mongo_commands += 1
+            request_metrics.mongo_seconds += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks checked-out connections and checkout waiters per server"""
+
+    def __init__(self):
+        self.checked_out = {}
+        self.waiting = {}
+        self._lock = threading.Lock()
+
+    def _add(self, counts, address, delta):
+        with self._lock:
+            counts[address] = max(0, counts.get(address, 0) + delta)
+
+    def connection_check_out_started(self, event):
+        self._add(self.waiting, event.address, 1)
+
+    def connection_check_out_failed(self, event):
+        self._add(self.waiting, event.address, -1)
+
+    def connection_checked_out(self, event):
+        self._add(self.waiting, event.address, -1)
+        self._add(self.checked_out, event.address, 1)
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, event.address, -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self.checked_out.pop(event.address, None)
+            self.waiting.pop(event.address, None)
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def snapshot(self, max_pool_size):
+        with self._lock:
+            busiest = max(self.checked_out.values(), default=0)
+            return {
+                "checked_out": sum(self.checked_out.values()),
+                "waiting": sum(self.waiting.values()),
+                "max_pool_size": max_pool_size,
+                # Busiest server's pool; 1.0 means new operations queue for a connection
+                "saturation": round(busiest / max_pool_size, 3) if max_pool_size else 0.0
+            }
+
+class EventLoopLagMonitor:
+    """Measures how late a periodic sleep wakes up; large lag means the loop is blocked"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = deque(maxlen=LOOP_LAG_WINDOW)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    @property
+    def current(self):
+        return self.samples[-1] if self.samples else 0.0
+
+    @property
+    def recent_max(self):
+        return max(self.samples, default=0.0)
+
+mongo_command_metrics = MongoCommandMetrics()
+mongo_pool_metrics = MongoPoolMetrics()
+loop_lag_monitor = EventLoopLagMonitor(LOOP_LAG_INTERVAL_SECONDS)
+route_templates = {}
+
+def route_template(scope):
+    """Path template of the matched route, keeping label cardinality bounded"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not route_templates:
+        for route in app.routes:
+            if getattr(route, "endpoint", None) is not None:
+                route_templates[route.endpoint] = route.path
+    return route_templates.get(endpoint, "unmatched")
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    # Streaming responses are timed up to their first byte
+    request_metrics = RequestMetrics()
+    token = current_request_metrics.set(request_metrics)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        current_request_metrics.reset(token)
+        route = route_template(request.scope)
+        http_request_duration.observe(time.perf_counter() - started, request.method, route, str(status))
+        http_request_mongo_commands.observe(request_metrics.mongo_commands, request.method, route)
+        http_request_mongo_duration.observe(request_metrics.mongo_seconds, request.method, route)
+        if request_metrics.external_seconds:
+            http_request_external_duration.observe(request_metrics.external_seconds, request.method, route)
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_lag_monitor():
+    loop_lag_monitor.stop()
 
 # MongoDB connection
 MONGO_URL = os.getenv("MONGO_URL")
 if not MONGO_URL:
     raise ValueError("MONGO_URL environment variable is required")
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
+# Pool tuning; options left unset fall back to the driver defaults (or MONGO_URL's query string)
+MONGO_MAX_POOL_SIZE = os.getenv("MONGO_MAX_POOL_SIZE")
+MONGO_MIN_POOL_SIZE = os.getenv("MONGO_MIN_POOL_SIZE")
+MONGO_MAX_IDLE_TIME_MS = os.getenv("MONGO_MAX_IDLE_TIME_MS")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE")
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS")
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", "5"))
+MONGO_WARMUP_ATTEMPTS = int(os.getenv("MONGO_WARMUP_ATTEMPTS", "5"))
+
+READ_PREFERENCES = {"primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"}
+# Compressors need an optional package; zlib ships with Python
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+def available_compressors(requested, warn=True):
+    compressors = []
+    for name in [part.strip() for part in requested.split(",") if part.strip()]:
+        module = COMPRESSOR_MODULES.get(name)
+        if module is None:
+            if warn:
+                print(f"Warning: unknown MongoDB compressor {name!r} ignored")
+        elif importlib.util.find_spec(module) is None:
+            if warn:
+                print(f"Warning: MongoDB compressor {name!r} needs the {module!r} package, skipping it")
+        else:
+            compressors.append(name)
+    return compressors
+
+def mongo_client_options():
+    options = {"event_listeners": [mongo_command_metrics, mongo_pool_metrics]}
+    if MONGO_MAX_POOL_SIZE:
+        options["maxPoolSize"] = int(MONGO_MAX_POOL_SIZE)
+    if MONGO_MIN_POOL_SIZE:
+        options["minPoolSize"] = int(MONGO_MIN_POOL_SIZE)
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = int(MONGO_MAX_IDLE_TIME_MS)
+    if MONGO_READ_PREFERENCE:
+        if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+            raise ValueError(f"MONGO_READ_PREFERENCE must be one of {sorted(READ_PREFERENCES)}")
+        options["readPreference"] = MONGO_READ_PREFERENCE
+    # By default offer every compressor that is installed; the server picks the first it supports
+    compressors = available_compressors(MONGO_COMPRESSORS or "zstd,snappy,zlib", warn=bool(MONGO_COMPRESSORS))
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL, **mongo_client_options())
 db = client.psicoliz
 
+async def warm_up_mongo():
+    """Resolve, connect and authenticate before serving, then open a few pooled connections.
+    
+    Concurrent pings each check out their own connection, so the pool already
+    holds MONGO_WARMUP_CONNECTIONS sockets when the first request arrives.
+    """
+    for attempt in range(1, MONGO_WARMUP_ATTEMPTS + 1):
+        try:
+            await client.admin.command("ping")
+            break
+        except Exception as e:
+            if attempt == MONGO_WARMUP_ATTEMPTS:
+                raise
+            logger.warning("MongoDB ping failed (attempt %d/%d): %s", attempt, MONGO_WARMUP_ATTEMPTS, e)
+            await asyncio.sleep(min(2 ** attempt, 10))
+    if MONGO_WARMUP_CONNECTIONS > 1:
+        await asyncio.gather(*[client.admin.command("ping") for _ in range(MONGO_WARMUP_CONNECTIONS)])
+
+# Indexes backing the hot queries, created (idempotently) at startup
+INDEXES = {
+    "appointments": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("appointment_date", ASCENDING), ("status", ASCENDING)], name="date_status"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("status", ASCENDING), ("hold_expires_at", ASCENDING)], name="status_hold_expires_at"),
+        IndexModel([("start_at", ASCENDING), ("status", ASCENDING)], name="start_at_status"),
+    ],
+    "appointments_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("appointment_date", ASCENDING), ("status", ASCENDING)], name="date_status"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("start_at", ASCENDING), ("status", ASCENDING)], name="start_at_status"),
+    ],
+    "slot_holds": [
+        # At most one active hold per slot: the atomic claim relies on this
+        IndexModel(
+            [("date", ASCENDING), ("time", ASCENDING)],
+            name="active_slot_unique",
+            unique=True,
+            partialFilterExpression={"active": True}
+        ),
+        IndexModel([("appointment_id", ASCENDING)], name="appointment_id"),
+        # Expired holds are removed by MongoDB; confirmed holds have no expires_at
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "custom_schedules": [
+        IndexModel([("date", ASCENDING)], name="date_unique", unique=True),
+    ],
+    "settings": [
+        IndexModel([("type", ASCENDING)], name="type_unique", unique=True),
+    ],
+    "stats_counters": [
+        IndexModel([("date", ASCENDING)], name="date"),
+    ],
+    "email_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+    ],
+    "availability_events": [
+        # Only relayed live; nothing replays old events
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=3600),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Representative shapes of the hot queries, checked with explain()
+SAMPLE_NOW = datetime(2024, 7, 1, tzinfo=timezone.utc)
+# Availability and claim_slot read slot_holds; "active": True lets them use the partial index
+SAMPLE_ACTIVE_HOLD = {"active": True, "$or": [{"expires_at": {"$exists": False}}, {"expires_at": {"$gt": SAMPLE_NOW}}]}
+HOT_QUERIES = [
+    ("active holds by date", "slot_holds", {"date": "2024-07-31", **SAMPLE_ACTIVE_HOLD}, None),
+    ("active holds by range", "slot_holds", {"date": {"$gte": "2024-07-01", "$lte": "2024-08-31"}, **SAMPLE_ACTIVE_HOLD}, None),
+    ("lapsed holds of a claimed session", "slot_holds", {"date": "2024-07-31", "time": {"$in": ["09:00", "09:30"]}, "active": True, "expires_at": {"$lte": SAMPLE_NOW}}, None),
+    ("holds by appointment", "slot_holds", {"appointment_id": "00000000-0000-0000-0000-000000000000"}, None),
+    ("appointments by start range", "appointments", {"$or": [
+        {"start_at": {"$gte": datetime(2024, 7, 1, 4, tzinfo=timezone.utc), "$lt": datetime(2024, 9, 1, 4, tzinfo=timezone.utc)}},
+        {"start_at": None, "appointment_date": {"$gte": "2024-07-01", "$lte": "2024-08-31"}}
+    ]}, None),
+    ("appointment by id", "appointments", {"id": "00000000-0000-0000-0000-000000000000"}, None),
+    ("admin list newest first", "appointments", {}, [("created_at", -1), ("id", -1)]),
+    ("admin list by status", "appointments", {"status": {"$in": ["confirmed"]}}, [("created_at", -1), ("id", -1)]),
+    ("custom schedule by date", "custom_schedules", {"date": "2024-07-31"}, None),
+    ("upcoming custom schedules", "custom_schedules", {"date": {"$gte": "2024-07-31"}}, None),
+    ("settings by type", "settings", {"type": "zelle_config"}, None),
+]
+
+async def ensure_indexes():
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                # e.g. duplicate keys blocking a unique index; keep starting up
+                logger.warning("Could not create index %s.%s: %s", collection_name, index.document["name"], e)
+
+def plan_stages(plan):
+    """All stage names in a query plan tree"""
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        stages += plan_stages(child)
+    return [stage for stage in stages if stage]
+
+async def explain_hot_queries():
+    """Run explain() on every hot query and flag collection scans"""
+    report = []
+    for name, collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        stages = plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "query": name,
+            "collection": collection_name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return report
+
 # PayPal configuration
 PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
 PAYPAL_CLIENT_SECRET = os.getenv("PAYPAL_CLIENT_SECRET")
@@ -72,11 +560,78 @@ PAYPAL_MODE = os.getenv("PAYPAL_MODE", "sandbox")
 if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
     print("Warning: PayPal credentials not found. PayPal payments will not work.")
 
-paypalrestsdk.configure({
-    "mode": PAYPAL_MODE,
-    "client_id": PAYPAL_CLIENT_ID,
-    "client_secret": PAYPAL_CLIENT_SECRET
-})
+PAYPAL_API_BASE = os.getenv("PAYPAL_API_BASE")  # override the SDK endpoint, e.g. a local fake PayPal
+PAYPAL_MAX_CONCURRENCY = int(os.getenv("PAYPAL_MAX_CONCURRENCY", "16"))
+PAYPAL_TIMEOUT_SECONDS = float(os.getenv("PAYPAL_TIMEOUT_SECONDS", "30"))
+
+class PooledPayPalApi(paypalrestsdk.Api):
+    """paypalrestsdk Api that reuses keep-alive connections through one requests.Session.
+    
+    The SDK already caches the OAuth token on the Api object; the lock keeps
+    concurrent threads from fetching it more than once.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PAYPAL_MAX_CONCURRENCY)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._token_lock = threading.RLock()
+    
+    def get_token_hash(self, *args, **kwargs):
+        with self._token_lock:
+            return super().get_token_hash(*args, **kwargs)
+    
+    def http_call(self, url, method, **kwargs):
+        response = self.session.request(method, url, proxies=self.proxies, timeout=PAYPAL_TIMEOUT_SECONDS, **kwargs)
+        return self.handle_response(response, response.content.decode("utf-8"))
+
+class PayPalGateway:
+    """Async facade over the blocking SDK; calls run on a bounded thread pool"""
+    
+    def __init__(self, api, max_workers):
+        self.api = api
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="paypal")
+    
+    async def _run(self, operation, fn, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+            outcome = "ok" if result else "rejected"
+            return result
+        finally:
+            observe_external_call("paypal", operation, started, outcome)
+    
+    def _create_payment(self, payment_data):
+        payment = paypalrestsdk.Payment(payment_data, api=self.api)
+        return payment if payment.create() else None
+    
+    def _execute_payment(self, payment_id, payer_id):
+        payment = paypalrestsdk.Payment.find(payment_id, api=self.api)
+        return payment.execute({"payer_id": payer_id})
+    
+    async def create_payment(self, payment_data):
+        """Created payment, or None if PayPal rejected it"""
+        return await self._run("create_payment", self._create_payment, payment_data)
+    
+    async def execute_payment(self, payment_id, payer_id):
+        return await self._run("execute_payment", self._execute_payment, payment_id, payer_id)
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self.api.session.close()
+
+paypal_api_options = {"mode": PAYPAL_MODE, "client_id": PAYPAL_CLIENT_ID, "client_secret": PAYPAL_CLIENT_SECRET}
+if PAYPAL_API_BASE:
+    paypal_api_options["endpoint"] = PAYPAL_API_BASE
+paypal_gateway = PayPalGateway(PooledPayPalApi(paypal_api_options), PAYPAL_MAX_CONCURRENCY)
+
+@app.on_event("shutdown")
+async def stop_paypal_gateway():
+    paypal_gateway.shutdown()
 
 # SMTP configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER')
@@ -102,6 +657,73 @@ class AppointmentBooking(BaseModel):
     appointment_time: str
     payment_method: str  # "paypal" or "zelle"
     session_duration: str = "standard"  # "standard", "plus_30min", "plus_60min"
+    locale: str = "es"  # language of the emails sent to the client: "es" or "en"
+
+# Response models
+class AppointmentOut(BaseModel):
+    """An appointment as listed to the admin; internal bookkeeping fields are dropped"""
+    id: str
+    full_name: Optional[str] = None
+    email: Optional[str] = None
+    whatsapp: Optional[str] = None
+    appointment_date: str
+    appointment_time: str
+    start_at: Optional[datetime] = None
+    duration_min: Optional[int] = None
+    session_duration: Optional[str] = None
+    session_price: Optional[float] = None
+    payment_method: Optional[str] = None
+    status: str
+    locale: Optional[str] = None
+    created_at: Optional[Union[datetime, str]] = None  # a VET ISO string until migrated
+    hold_expires_at: Optional[datetime] = None
+    paypal_payment_id: Optional[str] = None
+    paypal_payer_id: Optional[str] = None
+    payment_confirmed_at: Optional[str] = None
+    admin_confirmed_at: Optional[str] = None
+    admin_confirmed_by: Optional[str] = None
+    expired_at: Optional[str] = None
+    slot_conflict: Optional[bool] = None
+    zelle_receipt_id: Optional[str] = None
+    zelle_receipt_thumbnail_id: Optional[str] = None
+    zelle_receipt_filename: Optional[str] = None
+    zelle_receipt_content_type: Optional[str] = None
+    zelle_receipt_size: Optional[int] = None
+    zelle_receipt_width: Optional[int] = None
+    zelle_receipt_height: Optional[int] = None
+    
+    @field_validator("start_at", "created_at", "hold_expires_at")
+    @classmethod
+    def mark_utc(cls, value):
+        # MongoDB returns naive UTC datetimes
+        if isinstance(value, datetime) and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+class SessionPricingOut(BaseModel):
+    duration: str
+    price: float
+    description: str
+
+class PricingOut(BaseModel):
+    standard: SessionPricingOut
+    plus_30min: SessionPricingOut
+    plus_60min: SessionPricingOut
+    currency: str = "USD"
+
+class SlotsOut(BaseModel):
+    available_times: List[str]
+
+class CustomScheduleOut(BaseModel):
+    date: str
+    available_times: List[str] = []
+    is_available: bool = True
+    updated_at: Optional[str] = None
+    updated_by: Optional[str] = None
+
+class AdminScheduleOut(BaseModel):
+    weekly_schedule: Dict[str, List[str]]
+    custom_schedules: List[CustomScheduleOut]
 
 class ZelleUpload(BaseModel):
     booking_id: str
@@ -122,6 +744,72 @@ class CustomSchedule(BaseModel):
     available_times: List[str]  # Override for specific date
     is_available: bool = True  # False for holidays/blocked days
 
+# Session types offered, with the settings field holding their extra price
+SESSION_OPTIONS = {
+    "standard": {
+        "duration": "1 hora",
+        "minutes": 60,
+        "description": "Sesión estándar de 60 minutos",
+        "paypal_label": "1 hora (sesión estándar)",
+        "extension_field": None
+    },
+    "plus_30min": {
+        "duration": "1.5 horas",
+        "minutes": 90,
+        "description": "Sesión estándar + 30 minutos adicionales",
+        "paypal_label": "1.5 horas (60min + 30min extra)",
+        "extension_field": "half_hour_extension"
+    },
+    "plus_60min": {
+        "duration": "2 horas",
+        "minutes": 120,
+        "description": "Sesión estándar + 60 minutos adicionales",
+        "paypal_label": "2 horas (60min + 60min extra)",
+        "extension_field": "full_hour_extension"
+    }
+}
+
+class SettingsSnapshot(BaseModel):
+    """Immutable copy of settings{type: "zelle_config"} shared by all pricing code"""
+    model_config = ConfigDict(frozen=True)
+    
+    version: int = 0
+    stored: bool = False  # False until the settings document exists in MongoDB
+    zelle_email: str = ZELLE_EMAIL
+    consultation_price: float = 50.00
+    half_hour_extension: float = 25.00
+    full_hour_extension: float = 45.00
+    
+    @classmethod
+    def from_document(cls, settings):
+        if not settings:
+            return cls()
+        return cls(
+            version=settings.get("version", 0),
+            stored=True,
+            zelle_email=settings.get("zelle_email", ZELLE_EMAIL),
+            consultation_price=settings.get("consultation_price", 50.00),
+            half_hour_extension=settings.get("half_hour_extension", 25.00),
+            full_hour_extension=settings.get("full_hour_extension", 45.00)
+        )
+    
+    def session_option(self, session_duration):
+        # Unknown durations are billed as a standard session
+        return SESSION_OPTIONS.get(session_duration, SESSION_OPTIONS["standard"])
+    
+    def session_price(self, session_duration):
+        extension_field = self.session_option(session_duration)["extension_field"]
+        extension = getattr(self, extension_field) if extension_field else 0.0
+        return self.consultation_price + extension
+    
+    def public_fields(self):
+        return {
+            "zelle_email": self.zelle_email,
+            "consultation_price": self.consultation_price,
+            "half_hour_extension": self.half_hour_extension,
+            "full_hour_extension": self.full_hour_extension
+        }
+
 # Available time slots
 DEFAULT_SCHEDULE = {
     "monday": ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"],
@@ -138,118 +826,1283 @@ WEEKDAY_NAMES = {
     4: "friday", 5: "saturday", 6: "sunday"
 }
 
-@app.get("/api/health")
-async def health_check():
-    return {"status": "healthy"}
+# Longest window the multi-day availability endpoint will answer in one call
+MAX_AVAILABILITY_RANGE_DAYS = 93
 
-@app.get("/api/zelle-config")
-async def get_zelle_config():
-    """Get Zelle payment configuration"""
-    # First check database for settings, then fall back to env
-    settings = await db.settings.find_one({"type": "zelle_config"})
-    if settings:
+def normalize_time_slots(times):
+    """Parse "HH:MM" strings and return them zero-padded, deduplicated and sorted"""
+    parsed = {datetime.strptime(time_slot, "%H:%M") for time_slot in times}
+    return tuple(slot.strftime("%H:%M") for slot in sorted(parsed))
+
+class CompiledSchedule:
+    """In-memory weekly template plus per-date overrides used by the public slot lookup.
+    
+    Loaded once at startup from settings{type: "weekly_schedule"} and the upcoming
+    custom_schedules, then kept current by the admin schedule endpoints so slot
+    lookup never touches MongoDB.
+    """
+    
+    def __init__(self):
+        self.loaded = False
+        self.version = 0
+        self._weekly = {}
+        self._overrides = {}
+        self.set_weekly(DEFAULT_SCHEDULE)
+    
+    async def load(self, database):
+        schedule_settings = await database.settings.find_one({"type": "weekly_schedule"}, {"_id": 0, "schedule": 1})
+        today = datetime.now(VET).date().isoformat()
+        custom_schedules = await database.custom_schedules.find(
+            {"date": {"$gte": today}},
+            {"_id": 0, "date": 1, "available_times": 1, "is_available": 1}
+        ).to_list(None)
+        
+        self.set_weekly(schedule_settings.get("schedule", DEFAULT_SCHEDULE) if schedule_settings else DEFAULT_SCHEDULE)
+        self._overrides = {
+            custom["date"]: self._compile_override(custom.get("available_times", []), custom.get("is_available", True))
+            for custom in custom_schedules
+        }
+        self.loaded = True
+    
+    async def ensure_loaded(self, database):
+        if not self.loaded:
+            await self.load(database)
+    
+    def set_weekly(self, schedule):
+        # Days missing from a stored schedule keep the built-in defaults
+        self._weekly = {
+            day_name: normalize_time_slots(schedule.get(day_name, DEFAULT_SCHEDULE[day_name]))
+            for day_name in WEEKDAY_NAMES.values()
+        }
+        self.version += 1
+    
+    def set_override(self, date, available_times, is_available):
+        self._overrides[date] = self._compile_override(available_times, is_available)
+        self.version += 1
+    
+    def remove_override(self, date):
+        self._overrides.pop(date, None)
+        self.version += 1
+    
+    def slots_for(self, day):
+        """Sorted tuple of scheduled start times for a date, before bookings"""
+        override = self._overrides.get(day.isoformat())
+        if override is not None:
+            return override
+        return self._weekly[WEEKDAY_NAMES[day.weekday()]]
+    
+    @staticmethod
+    def _compile_override(available_times, is_available):
+        # Blocked days/holidays compile to an empty slot list
+        return normalize_time_slots(available_times) if is_available else ()
+
+compiled_schedule = CompiledSchedule()
+
+# Availability works on [start, end) minute intervals within a VET day. Every
+# scheduled start time opens SCHEDULE_SLOT_MINUTES; bookings occupy their whole
+# session, held in SLOT_GRANULE_MINUTES pieces (see claim_slot).
+SCHEDULE_SLOT_MINUTES = 60
+SLOT_GRANULE_MINUTES = 30
+MINUTES_PER_DAY = 24 * 60
+
+def time_to_minutes(time_slot):
+    hours, minutes = time_slot.split(":")
+    return int(hours) * 60 + int(minutes)
+
+def minutes_to_time(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def session_minutes(session_duration):
+    # Unknown durations are booked as a standard session, like their price
+    return SESSION_OPTIONS.get(session_duration, SESSION_OPTIONS["standard"])["minutes"]
+
+def parse_duration(duration):
+    """?duration= as a session type ("plus_30min") or its length in minutes ("90")"""
+    if duration is None:
+        return SESSION_OPTIONS["standard"]["minutes"]
+    if duration in SESSION_OPTIONS:
+        return SESSION_OPTIONS[duration]["minutes"]
+    allowed = sorted(option["minutes"] for option in SESSION_OPTIONS.values())
+    if duration.isdigit() and int(duration) in allowed:
+        return int(duration)
+    raise HTTPException(
+        status_code=400,
+        detail=f"Invalid duration: use one of {', '.join(SESSION_OPTIONS)} or {', '.join(map(str, allowed))} minutes"
+    )
+
+def hold_granules(time_slot, duration_min):
+    """Granule start times covering [start, start + duration); off-grid starts round outwards"""
+    start = time_to_minutes(time_slot)
+    first = start - start % SLOT_GRANULE_MINUTES
+    return [minutes_to_time(minute) for minute in range(first, start + duration_min, SLOT_GRANULE_MINUTES)]
+
+def merge_intervals(starts, length):
+    """Sorted start minutes -> disjoint [start, end) intervals of the given length, merged"""
+    merged = []
+    for start in starts:
+        end = start + length
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+def subtract_intervals(open_intervals, busy_intervals):
+    """Parts of open_intervals not covered by busy_intervals; one sweep over both sorted lists"""
+    free = []
+    j = 0
+    for start, end in open_intervals:
+        cursor = start
+        while j < len(busy_intervals) and busy_intervals[j][1] <= cursor:
+            j += 1
+        k = j
+        # A busy interval may straddle two open ones, so j only skips finished ones
+        while k < len(busy_intervals) and busy_intervals[k][0] < end:
+            busy_start, busy_end = busy_intervals[k]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if cursor >= end:
+                break
+            k += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+class DayAvailability:
+    """A day's scheduled start times and free intervals, independent of session length.
+    
+    Cached per date; starts_for() answers any ?duration= from the same entry.
+    """
+    
+    __slots__ = ("slots", "free", "tag")
+    
+    def __init__(self, slots, free):
+        self.slots = slots
+        self.free = free
+        # Identifies the content, so every worker derives the same ETag without building a body
+        self.tag = hashlib.sha1(repr((slots, free)).encode()).hexdigest()[:16]
+    
+    @classmethod
+    def build(cls, day, held_times):
+        slots = compiled_schedule.slots_for(day)
+        open_intervals = merge_intervals([time_to_minutes(time) for time in slots], SCHEDULE_SLOT_MINUTES)
+        busy_intervals = merge_intervals(sorted(time_to_minutes(time) for time in held_times), SLOT_GRANULE_MINUTES)
+        return cls(slots, tuple(subtract_intervals(open_intervals, busy_intervals)))
+    
+    def etag(self, duration_min):
+        return f'"{self.tag}-{duration_min}"'
+    
+    def starts_for(self, duration_min):
+        """Scheduled start times whose whole session lies inside one free interval"""
+        available = []
+        i = 0
+        for time_slot in self.slots:
+            start = time_to_minutes(time_slot)
+            # Both lists are sorted, so the pointer only moves forward
+            while i < len(self.free) and self.free[i][1] <= start:
+                i += 1
+            if i == len(self.free):
+                break
+            free_start, free_end = self.free[i]
+            if free_start <= start and start + duration_min <= free_end:
+                available.append(time_slot)
+        return available
+
+class AvailabilityCache:
+    """Per-date cache of DayAvailability entries with LRU eviction.
+    
+    Writers call invalidate() after changing bookings or schedules. Readers take
+    a token() before querying MongoDB and pass it to set(), so a result computed
+    before a concurrent invalidation is never stored. Entries live for
+    ttl_seconds, or until invalidated when other workers' writes reach this one
+    through availability_events; either way no longer than their first hold.
+    """
+    
+    def __init__(self, ttl_seconds, max_dates):
+        self.ttl_seconds = ttl_seconds
+        self.max_dates = max_dates
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+    
+    def get(self, date):
+        entry = self._entries.get(date)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[date]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(date)
+        self.hits += 1
+        return entry[1]
+    
+    def token(self):
+        return self._epoch
+    
+    def set(self, date, day_availability, token, hold_expiries=()):
+        if token != self._epoch:
+            return
+        lifetime = math.inf if availability_fanout_enabled else self.ttl_seconds
+        now = datetime.now(timezone.utc)
+        for expires_at in hold_expiries:
+            if expires_at is not None:
+                # MongoDB returns naive UTC datetimes
+                lifetime = min(lifetime, (expires_at.replace(tzinfo=timezone.utc) - now).total_seconds())
+        self._entries[date] = (time.monotonic() + lifetime, day_availability)
+        self._entries.move_to_end(date)
+        while len(self._entries) > self.max_dates:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def invalidate(self, *dates):
+        self._epoch += 1
+        self.invalidations += 1
+        for date in dates:
+            self._entries.pop(date, None)
+    
+    def clear(self):
+        self._epoch += 1
+        self.invalidations += 1
+        self._entries.clear()
+    
+    def stats(self):
+        lookups = self.hits + self.misses
         return {
-            "zelle_email": settings.get("zelle_email", ZELLE_EMAIL),
-            "amount": f"${settings.get('consultation_price', 50.00):.2f}",
-            "currency": "USD"
+            "entries": len(self._entries),
+            "max_entries": self.max_dates,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions
         }
+
+availability_cache = AvailabilityCache(
+    ttl_seconds=float(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "30")),
+    max_dates=int(os.getenv("AVAILABILITY_CACHE_MAX_DATES", "512"))
+)
+
+# Settings snapshot, replaced (never mutated) on every change
+settings_snapshot = None
+
+async def load_settings_snapshot():
+    global settings_snapshot
+    settings = await db.settings.find_one({"type": "zelle_config"}, {"_id": 0})
+    settings_snapshot = SettingsSnapshot.from_document(settings)
+    return settings_snapshot
+
+async def get_settings_snapshot():
+    """Current settings snapshot; only reaches MongoDB if startup loading failed"""
+    if settings_snapshot is None:
+        return await load_settings_snapshot()
+    return settings_snapshot
+
+# Cross-worker config sync: every admin write to settings or schedules bumps
+# settings{type: "config_version"}; other workers see the bump through a change
+# stream (or by polling when change streams are unavailable) and reload.
+CONFIG_SYNC_MODE = os.getenv("CONFIG_SYNC_MODE", "auto")  # "auto", "change_stream" or "poll"
+CONFIG_POLL_SECONDS = float(os.getenv("CONFIG_POLL_SECONDS", "5"))
+known_config_version = 0
+
+async def bump_config_version():
+    global known_config_version
+    result = await db.settings.find_one_and_update(
+        {"type": "config_version"},
+        {"$inc": {"version": 1}},
+        projection={"_id": 0, "version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    known_config_version = result["version"]
+
+async def reload_config(version):
+    global known_config_version
+    known_config_version = version
+    await load_settings_snapshot()
+    await compiled_schedule.load(db)
+    availability_cache.clear()
+    availability_broker.publish({"type": "schedule_changed", "date": None, "time": None})
+
+async def read_config_version():
+    doc = await db.settings.find_one({"type": "config_version"}, {"_id": 0, "version": 1})
+    return doc["version"] if doc else 0
+
+async def watch_config_changes():
+    """Background task keeping this worker's settings and schedule in sync with the others"""
+    use_change_stream = CONFIG_SYNC_MODE != "poll"
+    while True:
+        try:
+            if use_change_stream:
+                pipeline = [{"$match": {"fullDocument.type": "config_version"}}]
+                async with db.settings.watch(pipeline, full_document="updateLookup") as stream:
+                    # Catch anything written between startup loading and opening the stream
+                    version = await read_config_version()
+                    if version != known_config_version:
+                        await reload_config(version)
+                    async for change in stream:
+                        version = change["fullDocument"]["version"]
+                        if version != known_config_version:
+                            await reload_config(version)
+            else:
+                version = await read_config_version()
+                if version != known_config_version:
+                    await reload_config(version)
+                await asyncio.sleep(CONFIG_POLL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except (OperationFailure, NotImplementedError) as e:
+            if not use_change_stream or CONFIG_SYNC_MODE == "change_stream":
+                print(f"Error watching config changes: {str(e)}")
+                await asyncio.sleep(CONFIG_POLL_SECONDS)
+            else:
+                # Standalone servers have no change streams
+                print("Change streams unavailable, polling for config changes")
+                use_change_stream = False
+        except Exception as e:
+            print(f"Error watching config changes: {str(e)}")
+            await asyncio.sleep(CONFIG_POLL_SECONDS)
+
+config_watch_task = None
+
+# Availability events pushed to open booking pages over SSE. Handlers publish to
+# an in-process broker; slot events are also written to availability_events so
+# other workers can pick them up from a change stream. Schedule edits reach the
+# other workers through the config sync above, which republishes them locally.
+AVAILABILITY_FANOUT_MODE = os.getenv("AVAILABILITY_FANOUT_MODE", "auto")  # "auto", "change_stream" or "off"
+AVAILABILITY_STREAM_HEARTBEAT_SECONDS = float(os.getenv("AVAILABILITY_STREAM_HEARTBEAT_SECONDS", "15"))
+AVAILABILITY_STREAM_QUEUE_SIZE = 100
+WORKER_ID = uuid.uuid4().hex
+
+class AvailabilitySubscriber:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.queue = asyncio.Queue(maxsize=AVAILABILITY_STREAM_QUEUE_SIZE)
+        self.overflowed = False
     
-    return {
-        "zelle_email": ZELLE_EMAIL,
-        "amount": "$50.00",
-        "currency": "USD"
-    }
+    def wants(self, date):
+        return date is None or self.start <= date <= self.end
 
-@app.get("/api/pricing-config")
-async def get_pricing_config():
-    """Get pricing configuration for all session types"""
-    settings = await db.settings.find_one({"type": "zelle_config"})
-    if settings:
-        base_price = settings.get("consultation_price", 50.00)
-        half_hour_ext = settings.get("half_hour_extension", 25.00)
-        full_hour_ext = settings.get("full_hour_extension", 45.00)
-    else:
-        base_price = 50.00
-        half_hour_ext = 25.00
-        full_hour_ext = 45.00
+class AvailabilityBroker:
+    """Fans availability events out to the SSE subscribers of this worker"""
     
-    return {
-        "standard": {
-            "duration": "1 hora",
-            "price": base_price,
-            "description": "Sesión estándar de 60 minutos"
-        },
-        "plus_30min": {
-            "duration": "1.5 horas",
-            "price": base_price + half_hour_ext,
-            "description": "Sesión estándar + 30 minutos adicionales"
+    def __init__(self):
+        self.subscribers = set()
+        self.sequence = 0
+    
+    def subscribe(self, start, end):
+        subscriber = AvailabilitySubscriber(start, end)
+        self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+    
+    def publish(self, event):
+        self.sequence += 1
+        event = {**event, "id": self.sequence}
+        for subscriber in self.subscribers:
+            if subscriber.overflowed or not subscriber.wants(event.get("date")):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A stalled client; it is told to resync instead of being sent a partial history
+                subscriber.overflowed = True
+
+availability_broker = AvailabilityBroker()
+availability_fanout_enabled = AVAILABILITY_FANOUT_MODE != "off"
+availability_watch_task = None
+
+async def publish_availability_event(event_type, date, time_slot=None):
+    """Publish slot_taken/slot_freed/schedule_changed; date=None means every date"""
+    event = {"type": event_type, "date": date, "time": time_slot}
+    availability_broker.publish(event)
+    if availability_fanout_enabled and event_type != "schedule_changed":
+        try:
+            await db.availability_events.insert_one({
+                **event,
+                "origin": WORKER_ID,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except Exception as e:
+            print(f"Error publishing availability event: {str(e)}")
+
+async def watch_availability_events():
+    """Relay slot events published by other workers to this worker's cache and subscribers"""
+    global availability_fanout_enabled
+    pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": WORKER_ID}}}]
+    while True:
+        try:
+            async with db.availability_events.watch(pipeline) as stream:
+                # Entries are kept until invalidated; events missed while disconnected are not replayed
+                availability_cache.clear()
+                async for change in stream:
+                    event = change["fullDocument"]
+                    availability_cache.invalidate(event["date"])
+                    availability_broker.publish({key: event.get(key) for key in ("type", "date", "time")})
+        except asyncio.CancelledError:
+            raise
+        except (OperationFailure, NotImplementedError) as e:
+            if AVAILABILITY_FANOUT_MODE == "change_stream":
+                print(f"Error watching availability events: {str(e)}")
+                await asyncio.sleep(5)
+            else:
+                # Standalone servers have no change streams; stop writing events nobody reads
+                print("Change streams unavailable, availability events stay within each worker")
+                availability_fanout_enabled = False
+                # Other workers' bookings can no longer invalidate entries here; fall back to the TTL
+                availability_cache.clear()
+                return
+        except Exception as e:
+            print(f"Error watching availability events: {str(e)}")
+            await asyncio.sleep(5)
+
+# Slot reservations. A booking claims its slot by inserting one active document
+# per granule of its session into slot_holds; the partial unique index on
+# (date, time) makes the claim
+# atomic, so concurrent checkouts cannot both win. Unpaid bookings hold their
+# slot until expires_at; confirmed bookings hold it permanently.
+UNPAID_STATUSES = ["pending", "awaiting_payment_proof"]
+HOLD_MINUTES = {
+    "paypal": float(os.getenv("PAYPAL_HOLD_MINUTES", "30")),
+    "zelle": float(os.getenv("ZELLE_HOLD_MINUTES", "180"))
+}
+HOLD_SWEEP_SECONDS = float(os.getenv("HOLD_SWEEP_SECONDS", "60"))
+
+class SlotUnavailable(Exception):
+    pass
+
+class SlotOutsideSchedule(SlotUnavailable):
+    """The session does not start on, or does not fit inside, the day's schedule"""
+
+def hold_expiry(payment_method):
+    return datetime.now(timezone.utc) + timedelta(minutes=HOLD_MINUTES.get(payment_method, HOLD_MINUTES["paypal"]))
+
+def active_hold_filter(now):
+    return {"active": True, "$or": [{"expires_at": {"$exists": False}}, {"expires_at": {"$gt": now}}]}
+
+async def claim_slot(date, time_slot, appointment_id, expires_at=None, duration_min=SCHEDULE_SLOT_MINUTES, within_schedule=True):
+    """Atomically reserve a session; raises SlotUnavailable if it overlaps another booking.
+    
+    One hold is inserted per SLOT_GRANULE_MINUTES granule the session covers, so
+    any two overlapping sessions collide on at least one (date, time) key.
+    expires_at=None claims the slot permanently. New bookings must start on the
+    day's schedule and end inside its block (SlotOutsideSchedule otherwise);
+    within_schedule=False re-claims existing bookings the schedule may since have dropped.
+    """
+    if time_to_minutes(time_slot) + duration_min > MINUTES_PER_DAY:
+        raise SlotUnavailable(f"{date} {time_slot} does not fit a {duration_min}-minute session")
+    if within_schedule:
+        await compiled_schedule.ensure_loaded(db)
+        day = datetime.strptime(date, "%Y-%m-%d").date()
+        if time_slot not in DayAvailability.build(day, []).starts_for(duration_min):
+            raise SlotOutsideSchedule(f"{date} {time_slot} is not a scheduled start for a {duration_min}-minute session")
+    granules = hold_granules(time_slot, duration_min)
+    # Expired holds the TTL monitor has not removed yet no longer count
+    await db.slot_holds.update_many(
+        {"date": date, "time": {"$in": granules}, "active": True, "expires_at": {"$lte": datetime.now(timezone.utc)}},
+        {"$set": {"active": False}}
+    )
+    created_at = datetime.now(timezone.utc)
+    holds = []
+    for granule in granules:
+        hold = {
+            "date": date,
+            "time": granule,
+            "appointment_id": appointment_id,
+            "active": True,
+            "created_at": created_at
+        }
+        if expires_at is not None:
+            hold["expires_at"] = expires_at
+        holds.append(hold)
+    try:
+        await db.slot_holds.insert_many(holds, ordered=True)
+    except BulkWriteError as e:
+        # Undo the granules inserted before the collision
+        await db.slot_holds.delete_many({"appointment_id": appointment_id, "date": date, "time": {"$in": granules}})
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+        raise SlotUnavailable(f"{date} {time_slot} is no longer available")
+    availability_cache.invalidate(date)
+    await publish_availability_event("slot_taken", date, time_slot)
+
+def claim_appointment_slot(appointment, expires_at=None):
+    return claim_slot(
+        appointment["appointment_date"],
+        appointment["appointment_time"],
+        appointment["id"],
+        expires_at,
+        session_minutes(appointment.get("session_duration")),
+        within_schedule=False
+    )
+
+async def make_hold_permanent(appointment):
+    """Keep an appointment's slot for good once paid; re-claims it if the hold lapsed"""
+    result = await db.slot_holds.update_many(
+        {"appointment_id": appointment["id"], **active_hold_filter(datetime.now(timezone.utc))},
+        {"$unset": {"expires_at": ""}}
+    )
+    if result.matched_count == 0:
+        await claim_appointment_slot(appointment)
+
+async def appointment_confirmed(appointment_id):
+    return await db.appointments.find_one({"id": appointment_id, "status": "confirmed"}, {"_id": 1}) is not None
+
+async def restore_hold_expiry(appointment_id, payment_method):
+    """Give an unpaid booking's holds their expiry back so an abandoned payment frees the slot"""
+    if await appointment_confirmed(appointment_id):
+        return
+    await db.slot_holds.update_many(
+        {"appointment_id": appointment_id, "active": True},
+        {"$set": {"expires_at": hold_expiry(payment_method)}}
+    )
+    # A concurrent confirmation may have landed in between; its holds stay permanent
+    if await appointment_confirmed(appointment_id):
+        await db.slot_holds.update_many({"appointment_id": appointment_id}, {"$unset": {"expires_at": ""}})
+
+async def release_slot(appointment):
+    result = await db.slot_holds.delete_many({"appointment_id": appointment["id"]})
+    availability_cache.invalidate(appointment["appointment_date"])
+    if result.deleted_count:
+        await publish_availability_event("slot_freed", appointment["appointment_date"], appointment["appointment_time"])
+
+async def expire_unpaid_bookings():
+    """Mark unpaid bookings whose hold lapsed as expired and free their slots"""
+    now = datetime.now(timezone.utc)
+    expired = 0
+    while True:
+        appointment = await db.appointments.find_one_and_update(
+            {"status": {"$in": UNPAID_STATUSES}, "hold_expires_at": {"$lte": now}},
+            {"$set": {"status": "expired", "expired_at": datetime.now(VET).isoformat()}},
+            projection={"_id": 0, "id": 1, "appointment_time": 1, **STATS_FIELDS}
+        )
+        if appointment is None:
+            return expired
+        await db.slot_holds.delete_many({"appointment_id": appointment["id"]})
+        availability_cache.invalidate(appointment["appointment_date"])
+        await publish_availability_event("slot_freed", appointment["appointment_date"], appointment["appointment_time"])
+        await record_stats_transition(appointment, {**appointment, "status": "expired"})
+        expired += 1
+
+async def sweep_expired_holds():
+    while True:
+        try:
+            await expire_unpaid_bookings()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error expiring unpaid bookings: {str(e)}")
+        await asyncio.sleep(HOLD_SWEEP_SECONDS)
+
+async def backfill_slot_holds():
+    """Create holds for upcoming bookings made before slot reservations existed"""
+    today = datetime.now(VET).date().isoformat()
+    appointments = await db.appointments.find(
+        {
+            "status": {"$in": ["confirmed"] + UNPAID_STATUSES},
+            "appointment_date": {"$gte": today},
+            "slot_held": {"$exists": False}
         },
-        "plus_60min": {
-            "duration": "2 horas", 
-            "price": base_price + full_hour_ext,
-            "description": "Sesión estándar + 60 minutos adicionales"
+        {"_id": 0, "id": 1, "appointment_date": 1, "appointment_time": 1, "session_duration": 1, "status": 1, "payment_method": 1}
+    ).to_list(None)
+    for appointment in appointments:
+        unpaid = appointment["status"] in UNPAID_STATUSES
+        expires_at = hold_expiry(appointment.get("payment_method")) if unpaid else None
+        try:
+            await claim_appointment_slot(appointment, expires_at)
+        except SlotUnavailable:
+            print(f"Warning: appointment {appointment['id']} overlaps another booking at {appointment['appointment_date']} {appointment['appointment_time']}")
+        update = {"slot_held": True}
+        if unpaid:
+            update["hold_expires_at"] = expires_at
+        await db.appointments.update_one({"id": appointment["id"]}, {"$set": update})
+
+async def backfill_hold_granules():
+    """Extend holds claimed as a single start time so they cover the whole session"""
+    today = datetime.now(VET).date().isoformat()
+    holds = await db.slot_holds.find(
+        {"date": {"$gte": today}, **active_hold_filter(datetime.now(timezone.utc))},
+        {"_id": 0, "appointment_id": 1, "time": 1, "expires_at": 1}
+    ).to_list(None)
+    held = {}
+    for hold in holds:
+        held.setdefault(hold["appointment_id"], {})[hold["time"]] = hold.get("expires_at")
+    if not held:
+        return
+    
+    appointments = await db.appointments.find(
+        {"id": {"$in": list(held)}},
+        {"_id": 0, "id": 1, "appointment_date": 1, "appointment_time": 1, "session_duration": 1}
+    ).to_list(None)
+    for appointment in appointments:
+        granules = hold_granules(appointment["appointment_time"], session_minutes(appointment.get("session_duration")))
+        existing = held[appointment["id"]]
+        expires_at = next(iter(existing.values()))
+        for granule in granules:
+            if granule in existing:
+                continue
+            hold = {
+                "date": appointment["appointment_date"],
+                "time": granule,
+                "appointment_id": appointment["id"],
+                "active": True,
+                "created_at": datetime.now(timezone.utc)
+            }
+            if expires_at is not None:
+                hold["expires_at"] = expires_at
+            try:
+                await db.slot_holds.insert_one(hold)
+            except DuplicateKeyError:
+                print(f"Warning: appointment {appointment['id']} overlaps another booking at {appointment['appointment_date']} {granule}")
+        availability_cache.invalidate(appointment["appointment_date"])
+
+hold_sweep_task = None
+
+@app.on_event("startup")
+async def load_compiled_schedule():
+    global known_config_version
+    try:
+        known_config_version = await read_config_version()
+        await load_settings_snapshot()
+        await compiled_schedule.load(db)
+    except Exception as e:
+        # Retried lazily on the first request that needs them
+        print(f"Warning: could not load settings and schedule at startup: {str(e)}")
+
+@app.on_event("startup")
+async def start_config_watcher():
+    global config_watch_task
+    config_watch_task = asyncio.create_task(watch_config_changes())
+
+@app.on_event("shutdown")
+async def stop_config_watcher():
+    if config_watch_task:
+        config_watch_task.cancel()
+
+@app.on_event("startup")
+async def start_availability_watcher():
+    global availability_watch_task
+    if availability_fanout_enabled:
+        availability_watch_task = asyncio.create_task(watch_availability_events())
+
+@app.on_event("shutdown")
+async def stop_availability_watcher():
+    if availability_watch_task:
+        availability_watch_task.cancel()
+
+@app.on_event("startup")
+async def start_hold_sweeper():
+    global hold_sweep_task
+    try:
+        await backfill_slot_holds()
+        await backfill_hold_granules()
+    except Exception as e:
+        print(f"Warning: could not backfill slot holds: {str(e)}")
+    hold_sweep_task = asyncio.create_task(sweep_expired_holds())
+
+@app.on_event("shutdown")
+async def stop_hold_sweeper():
+    if hold_sweep_task:
+        hold_sweep_task.cancel()
+
+def mongo_max_pool_size():
+    try:
+        return client.options.pool_options.max_pool_size
+    except AttributeError:
+        return 0
+
+@app.get("/api/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "event_loop_lag_ms": {
+            "current": round(loop_lag_monitor.current * 1000, 2),
+            "recent_max": round(loop_lag_monitor.recent_max * 1000, 2)
         },
-        "currency": "USD"
+        "mongo_pool": mongo_pool_metrics.snapshot(mongo_max_pool_size())
     }
 
-@app.get("/api/available-slots/{date}")
-async def get_available_slots(date: str):
-    """Get available time slots for a specific date"""
+METRICS = [
+    http_request_duration,
+    http_request_mongo_commands,
+    http_request_mongo_duration,
+    http_request_external_duration,
+    mongo_command_duration,
+    external_call_duration,
+    Gauge("event_loop_lag_seconds", "Most recent event loop wake-up delay", lambda: loop_lag_monitor.current),
+    Gauge("mongo_pool_checked_out_connections", "MongoDB connections in use", lambda: mongo_pool_metrics.snapshot(0)["checked_out"]),
+    Gauge("mongo_pool_waiting_operations", "Operations waiting for a MongoDB connection", lambda: mongo_pool_metrics.snapshot(0)["waiting"]),
+    Gauge("mongo_pool_max_size", "Maximum MongoDB connections per server", mongo_max_pool_size),
+    Gauge("availability_stream_subscribers", "Open availability SSE connections", lambda: len(availability_broker.subscribers)),
+    Gauge("admission_in_flight", "Booking and upload requests running", lambda: admission_gate.in_flight),
+    Gauge("admission_waiting", "Booking and upload requests queued for admission", lambda: admission_gate.waiting),
+]
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, MongoDB and external call metrics"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# HTTP caching for read-mostly public endpoints. Config ETags hash the response
+# body, which is built from the in-memory settings snapshot; availability ETags
+# come from the cached DayAvailability and are checked before any body is built.
+# Every worker derives the same tag and revalidation normally never reaches MongoDB.
+CONFIG_CACHE_CONTROL = (
+    f"public, max-age={int(os.getenv('CONFIG_MAX_AGE_SECONDS', '60'))}, "
+    f"stale-while-revalidate={int(os.getenv('CONFIG_STALE_WHILE_REVALIDATE_SECONDS', '300'))}"
+)
+AVAILABILITY_CACHE_CONTROL = (
+    f"public, max-age={int(os.getenv('AVAILABILITY_MAX_AGE_SECONDS', '15'))}, "
+    f"stale-while-revalidate={int(os.getenv('AVAILABILITY_STALE_WHILE_REVALIDATE_SECONDS', '30'))}"
+)
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
+
+def not_modified_response(request, etag, cache_control):
+    """A bodyless 304 when the client's copy is current, else None"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+def cacheable_json_response(request, payload, cache_control, etag=None):
+    """JSON response with an ETag (a hash of the body unless given), or a bodyless 304"""
+    body = payload.model_dump_json().encode() if isinstance(payload, BaseModel) else orjson.dumps(payload)
+    if etag is None:
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    return not_modified_response(request, etag, cache_control) or Response(
+        body, media_type="application/json", headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+@app.get("/api/zelle-config")
+async def get_zelle_config(request: Request):
+    """Get Zelle payment configuration"""
+    settings = await get_settings_snapshot()
+    return cacheable_json_response(request, {
+        "zelle_email": settings.zelle_email,
+        "amount": f"${settings.consultation_price:.2f}",
+        "currency": "USD"
+    }, CONFIG_CACHE_CONTROL)
+
+@app.get("/api/pricing-config", response_model=PricingOut)
+async def get_pricing_config(request: Request):
+    """Get pricing configuration for all session types"""
+    settings = await get_settings_snapshot()
+    pricing = PricingOut(**{
+        session_duration: SessionPricingOut(
+            duration=option["duration"],
+            price=settings.session_price(session_duration),
+            description=option["description"]
+        )
+        for session_duration, option in SESSION_OPTIONS.items()
+    })
+    return cacheable_json_response(request, pricing, CONFIG_CACHE_CONTROL)
+
+@app.get("/api/available-slots/{date}", response_model=SlotsOut)
+async def get_available_slots(date: str, request: Request, duration: Optional[str] = None):
+    """Get available start times for a specific date where a session of ?duration= fits"""
+    duration_min = parse_duration(duration)
     try:
         # Parse the date
         appointment_date = datetime.strptime(date, "%Y-%m-%d").date()
         
-        # Get day of week (0=Monday, 6=Sunday)
-        day_of_week = appointment_date.weekday()
-        day_name = WEEKDAY_NAMES[day_of_week]
-        
-        # Get default schedule for this day
-        day_schedule = DEFAULT_SCHEDULE.get(day_name, [])
-        
-        # Check for custom schedule override for this specific date
-        custom_schedule = await db.custom_schedules.find_one({"date": date})
-        if custom_schedule:
-            if not custom_schedule.get("is_available", True):
-                # Day is blocked/holiday
-                return {"available_times": []}
-            day_schedule = custom_schedule.get("available_times", day_schedule)
+        day_availability = availability_cache.get(date)
+        if day_availability is None:
+            cache_token = availability_cache.token()
+            await compiled_schedule.ensure_loaded(db)
+            
+            # Get active slot holds for this date
+            holds = await db.slot_holds.find(
+                {"date": date, **active_hold_filter(datetime.now(timezone.utc))},
+                {"_id": 0, "time": 1, "expires_at": 1}
+            ).to_list(None)
+            
+            day_availability = DayAvailability.build(appointment_date, [hold["time"] for hold in holds])
+            availability_cache.set(date, day_availability, cache_token, [hold.get("expires_at") for hold in holds])
         
-        # Get existing bookings for this date
-        existing_bookings = await db.appointments.find({
-            "appointment_date": date,
-            "status": {"$in": ["confirmed", "pending"]}
-        }).to_list(100)
+        etag = day_availability.etag(duration_min)
+        not_modified = not_modified_response(request, etag, AVAILABILITY_CACHE_CONTROL)
+        if not_modified is not None:
+            return not_modified
+        slots = SlotsOut(available_times=day_availability.starts_for(duration_min))
+        return cacheable_json_response(request, slots, AVAILABILITY_CACHE_CONTROL, etag)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+
+def parse_date_range(from_date, to_date):
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d").date()
+        end = datetime.strptime(to_date, "%Y-%m-%d").date()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+    
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (end - start).days + 1 > MAX_AVAILABILITY_RANGE_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range too large (max {MAX_AVAILABILITY_RANGE_DAYS} days)"
+        )
+    return start, end
+
+@app.get("/api/available-slots")
+async def get_available_slots_range(
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to"),
+    duration: Optional[str] = None
+):
+    """Get available start times for every day in a date range (inclusive)"""
+    start, end = parse_date_range(from_date, to_date)
+    duration_min = parse_duration(duration)
+    day_count = (end - start).days + 1
+    
+    all_days = [start + timedelta(days=offset) for offset in range(day_count)]
+    availability = {}
+    missing_days = []
+    for day in all_days:
+        cached = availability_cache.get(day.isoformat())
+        if cached is None:
+            missing_days.append(day)
+        else:
+            availability[day.isoformat()] = cached
+    
+    if missing_days:
+        cache_token = availability_cache.token()
+        await compiled_schedule.ensure_loaded(db)
+        # One query covering every uncached day
+        date_range = {"$gte": missing_days[0].isoformat(), "$lte": missing_days[-1].isoformat()}
+        holds = await db.slot_holds.find(
+            {"date": date_range, **active_hold_filter(datetime.now(timezone.utc))},
+            {"_id": 0, "date": 1, "time": 1, "expires_at": 1}
+        ).to_list(None)
         
-        booked_times = [booking["appointment_time"] for booking in existing_bookings]
-        available_times = [time for time in day_schedule if time not in booked_times]
+        held_by_date = {}
+        for hold in holds:
+            held_by_date.setdefault(hold["date"], []).append(hold)
         
-        return {"available_times": available_times}
+        for day in missing_days:
+            key = day.isoformat()
+            day_holds = held_by_date.get(key, [])
+            day_availability = DayAvailability.build(day, [hold["time"] for hold in day_holds])
+            availability_cache.set(key, day_availability, cache_token, [hold.get("expires_at") for hold in day_holds])
+            availability[key] = day_availability
+    
+    days = {day.isoformat(): availability[day.isoformat()].starts_for(duration_min) for day in all_days}
+    bitmap = "".join("1" if available_times else "0" for available_times in days.values())
+    
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "duration_minutes": duration_min,
+        "days": days,
+        # One character per day starting at "from": "1" = has availability
+        "availability_bitmap": bitmap
+    }
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def stream_availability_events(start, end):
+    subscriber = availability_broker.subscribe(start, end)
+    try:
+        # Clients that reconnect have missed events, so they refetch on "ready"
+        yield f"retry: 5000\nevent: ready\ndata: {json.dumps({'from': subscriber.start, 'to': subscriber.end})}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), AVAILABILITY_STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ": ping\n\n"
+                continue
+            yield format_sse(event)
+            if subscriber.overflowed and subscriber.queue.empty():
+                yield f"event: resync\ndata: {json.dumps({'from': subscriber.start, 'to': subscriber.end})}\n\n"
+                return
+    finally:
+        availability_broker.unsubscribe(subscriber)
+
+@app.get("/api/availability/stream")
+async def stream_availability(
+    from_date: str = Query(..., alias="from"),
+    to_date: str = Query(..., alias="to")
+):
+    """Server-sent events: slot_taken, slot_freed and schedule_changed for dates in the range"""
+    start, end = parse_date_range(from_date, to_date)
+    return StreamingResponse(
+        stream_availability_events(start.isoformat(), end.isoformat()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Admission control for the public booking and upload endpoints. Token buckets
+# keyed by client IP and by email (booking id for uploads) throttle each caller,
+# and a per-process gate caps how many of these requests run at once: a few
+# wait briefly in a bounded queue, the rest are shed. Shed requests get a 429
+# with Retry-After before any MongoDB or PayPal work. RATE_LIMIT_BACKEND="mongo"
+# shares the buckets between workers through the rate_limits collection.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory", "mongo" or "off"
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "20"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "10"))
+RATE_LIMIT_SUBJECT_PER_MINUTE = float(os.getenv("RATE_LIMIT_SUBJECT_PER_MINUTE", "4"))
+RATE_LIMIT_SUBJECT_BURST = int(os.getenv("RATE_LIMIT_SUBJECT_BURST", "5"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+# Number of proxies in front of the app that append to X-Forwarded-For (0 = use the peer address)
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "0"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "2"))
+
+if RATE_LIMIT_BACKEND not in ("memory", "mongo", "off"):
+    print(f"Warning: unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}, using 'memory'")
+    RATE_LIMIT_BACKEND = "memory"
+
+def too_many_requests(retry_after, detail):
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class TokenBuckets:
+    """In-process token buckets, one per key, dropping the least recently used keys"""
+    
+    def __init__(self, name, per_minute, burst, max_keys):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+    
+    async def take(self, key):
+        """Spend one token; returns 0 when allowed, else the seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+class MongoTokenBuckets(TokenBuckets):
+    """Token buckets shared by all workers: one atomic pipeline update per take()"""
+    
+    async def take(self, key):
+        now = datetime.now(timezone.utc)
+        elapsed_seconds = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        try:
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": f"{self.name}:{key}"},
+                [
+                    {"$set": {
+                        "tokens": {"$min": [
+                            self.burst,
+                            {"$add": [{"$ifNull": ["$tokens", self.burst]}, {"$multiply": [elapsed_seconds, self.rate]}]}
+                        ]},
+                        "updated_at": now,
+                        # A bucket left alone this long is full again, so MongoDB may drop it
+                        "expires_at": now + timedelta(seconds=self.burst / self.rate)
+                    }},
+                    {"$set": {
+                        "allowed": {"$gte": ["$tokens", 1]},
+                        "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}
+                    }}
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # Never fail a booking over the limiter; this worker's buckets still apply
+            print(f"Error updating shared rate limit, using in-process buckets: {str(e)}")
+            return await super().take(key)
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / self.rate
+
+bucket_class = MongoTokenBuckets if RATE_LIMIT_BACKEND == "mongo" else TokenBuckets
+ip_buckets = bucket_class("ip", RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST, RATE_LIMIT_MAX_KEYS)
+subject_buckets = bucket_class("subject", RATE_LIMIT_SUBJECT_PER_MINUTE, RATE_LIMIT_SUBJECT_BURST, RATE_LIMIT_MAX_KEYS)
+
+def client_ip(request):
+    if RATE_LIMIT_PROXY_HOPS:
+        # Only the entries appended by our own proxies can be trusted
+        forwarded = [part.strip() for part in request.headers.get("x-forwarded-for", "").split(",") if part.strip()]
+        if len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return forwarded[-RATE_LIMIT_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limits(request, subject):
+    """Spend a token from the caller's IP bucket and from the subject's (email or booking id)"""
+    if RATE_LIMIT_BACKEND == "off":
+        return
+    retry_after = await ip_buckets.take(client_ip(request))
+    if not retry_after:
+        retry_after = await subject_buckets.take(subject.strip().lower())
+    if retry_after:
+        raise too_many_requests(retry_after, "Too many requests, please try again shortly")
+
+class AdmissionGate:
+    """Caps concurrent expensive requests in this process; a bounded queue waits, the rest are shed"""
+    
+    def __init__(self, limit, max_queue, queue_seconds):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_seconds = queue_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max(limit, 1))
+    
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        if self.limit <= 0:
+            yield
+            return
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise too_many_requests(self.queue_seconds, "Server busy, please try again shortly")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_seconds)
+            except asyncio.TimeoutError:
+                raise too_many_requests(self.queue_seconds, "Server busy, please try again shortly")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+admission_gate = AdmissionGate(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_SECONDS)
+
+# Idempotent booking creation: a repeated Idempotency-Key returns the first
+# response instead of booking (and charging) again
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+class IdempotencyCache:
+    """In-process LRU of completed responses, so repeats skip MongoDB entirely"""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    def get(self, scoped_key):
+        entry = self._entries.get(scoped_key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(scoped_key, None)
+            return None
+        self._entries.move_to_end(scoped_key)
+        return entry[1], entry[2]
+    
+    def set(self, scoped_key, request_hash, response):
+        self._entries[scoped_key] = (time.monotonic() + IDEMPOTENCY_TTL_HOURS * 3600, request_hash, response)
+        self._entries.move_to_end(scoped_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SIZE)
+# Requests running in this worker, so a concurrent repeat can await the original
+idempotency_in_flight = {}
+
+def booking_request_hash(booking):
+    return hashlib.sha256(json.dumps(booking.model_dump(), sort_keys=True).encode()).hexdigest()
+
+def replay_response(request_hash, stored_hash, response):
+    if request_hash != stored_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return response
+
+async def claim_idempotency_key(scoped_key, request_hash):
+    """Record the key as in progress; returns the stored document if it already exists"""
+    now = datetime.now(timezone.utc)
+    lock = {
+        "_id": scoped_key,
+        "request_hash": request_hash,
+        "status": "in_progress",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    }
+    try:
+        await db.idempotency_keys.insert_one(lock)
+        return None
+    except DuplicateKeyError:
+        pass
+    # Take over a lock left behind by a worker that died mid-request
+    stale = await db.idempotency_keys.find_one_and_replace(
+        {"_id": scoped_key, "status": "in_progress", "expires_at": {"$lte": now}},
+        lock
+    )
+    if stale is not None:
+        return None
+    return await db.idempotency_keys.find_one({"_id": scoped_key}) or {"status": "in_progress", "request_hash": request_hash}
+
+async def wait_for_idempotent_response(scoped_key, request_hash):
+    """Wait for another worker to finish the original request"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.25)
+        stored = await db.idempotency_keys.find_one({"_id": scoped_key})
+        if stored is None:
+            break
+        if stored["status"] == "completed":
+            idempotency_cache.set(scoped_key, stored["request_hash"], stored["response"])
+            return replay_response(request_hash, stored["request_hash"], stored["response"])
+    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+
+def idempotency_scope(endpoint, idempotency_key):
+    if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    return f"{endpoint}:{idempotency_key}"
+
+async def local_idempotent_response(scoped_key, request_hash):
+    """Response of a request completed or still running in this worker, or None"""
+    cached = idempotency_cache.get(scoped_key)
+    if cached is not None:
+        return replay_response(request_hash, *cached)
+    in_flight = idempotency_in_flight.get(scoped_key)
+    if in_flight is not None:
+        stored_hash, future = in_flight
+        if stored_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        return await asyncio.shield(future)
+    return None
+
+async def replay_idempotent(endpoint, idempotency_key, booking):
+    """Stored response for a key whose request already completed (or is running here), else None.
+    
+    Checked before rate limiting and admission: a client retrying a booking it
+    already made gets its answer back without spending a token or a queue slot.
+    """
+    if not idempotency_key:
+        return None
+    scoped_key = idempotency_scope(endpoint, idempotency_key)
+    request_hash = booking_request_hash(booking)
+    response = await local_idempotent_response(scoped_key, request_hash)
+    if response is not None:
+        return response
+    stored = await db.idempotency_keys.find_one({"_id": scoped_key, "status": "completed"})
+    if stored is None:
+        return None
+    idempotency_cache.set(scoped_key, stored["request_hash"], stored["response"])
+    return replay_response(request_hash, stored["request_hash"], stored["response"])
+
+async def run_idempotent(endpoint, idempotency_key, booking, handler):
+    """Run handler() once per Idempotency-Key; failures are not stored, so they can be retried"""
+    if not idempotency_key:
+        return await handler()
+    
+    scoped_key = idempotency_scope(endpoint, idempotency_key)
+    request_hash = booking_request_hash(booking)
+    response = await local_idempotent_response(scoped_key, request_hash)
+    if response is not None:
+        return response
+    
+    future = asyncio.get_running_loop().create_future()
+    idempotency_in_flight[scoped_key] = (request_hash, future)
+    try:
+        stored = await claim_idempotency_key(scoped_key, request_hash)
+        if stored is not None:
+            if stored["status"] == "completed":
+                idempotency_cache.set(scoped_key, stored["request_hash"], stored["response"])
+                response = replay_response(request_hash, stored["request_hash"], stored["response"])
+            elif stored["request_hash"] != request_hash:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            else:
+                response = await wait_for_idempotent_response(scoped_key, request_hash)
+        else:
+            try:
+                response = await handler()
+            except BaseException:
+                await db.idempotency_keys.delete_one({"_id": scoped_key, "status": "in_progress"})
+                raise
+            await db.idempotency_keys.update_one(
+                {"_id": scoped_key},
+                {"$set": {
+                    "status": "completed",
+                    "response": response,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+                }}
+            )
+            idempotency_cache.set(scoped_key, request_hash, response)
+        future.set_result(response)
+        return response
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+        future.set_exception(e)
+        # Waiters re-raise the exception; this marks it as retrieved for the loop
+        future.exception()
+        raise
+    finally:
+        idempotency_in_flight.pop(scoped_key, None)
 
 @app.post("/api/create-paypal-order")
-async def create_paypal_order(booking: AppointmentBooking):
+async def create_paypal_order(booking: AppointmentBooking, request: Request, idempotency_key: Optional[str] = Header(None)):
     """Create PayPal payment order"""
+    replay = await replay_idempotent("create-paypal-order", idempotency_key, booking)
+    if replay is not None:
+        return replay
+    await enforce_rate_limits(request, booking.email)
+    async with admission_gate.admit():
+        return await run_idempotent("create-paypal-order", idempotency_key, booking, lambda: place_paypal_order(booking))
+
+async def fail_paypal_order(appointment):
+    """Free the slot of a booking PayPal refused so the client can retry it"""
+    before = await db.appointments.find_one_and_update(
+        {"id": appointment["id"], "status": "pending"},
+        {"$set": {"status": "failed", "failed_at": datetime.now(VET).isoformat()}, "$unset": {"hold_expires_at": ""}},
+        projection={"_id": 0, "id": 1, **STATS_FIELDS},
+        return_document=ReturnDocument.BEFORE
+    )
+    # None when the booking already left "pending" (e.g. the expiry sweep got there first)
+    # and whoever moved it released the slot and counted it
+    if before is None:
+        return
+    await release_slot(appointment)
+    await record_stats_transition(before, {**before, "status": "failed"})
+
+async def place_paypal_order(booking: AppointmentBooking):
     try:
-        # Get current pricing settings
-        settings = await db.settings.find_one({"type": "zelle_config"})
-        base_price = settings.get("consultation_price", 50.00) if settings else 50.00
-        half_hour_ext = settings.get("half_hour_extension", 25.00) if settings else 25.00
-        full_hour_ext = settings.get("full_hour_extension", 45.00) if settings else 45.00
-        
         # Calculate final price based on session duration
-        if booking.session_duration == "plus_30min":
-            final_price = base_price + half_hour_ext
-            session_description = "1.5 horas (60min + 30min extra)"
-        elif booking.session_duration == "plus_60min":
-            final_price = base_price + full_hour_ext
-            session_description = "2 horas (60min + 60min extra)"
-        else:
-            final_price = base_price
-            session_description = "1 hora (sesión estándar)"
+        settings = await get_settings_snapshot()
+        final_price = settings.session_price(booking.session_duration)
+        session_description = settings.session_option(booking.session_duration)["paypal_label"]
         
-        # Create appointment in database with pending status
+        try:
+            start_at = appointment_start_at(booking.appointment_date, booking.appointment_time)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid appointment date or time")
+        
+        # Reserve the slot before writing the appointment
         appointment_id = str(uuid.uuid4())
+        hold_expires_at = hold_expiry("paypal")
+        await claim_slot(
+            booking.appointment_date, booking.appointment_time, appointment_id, hold_expires_at,
+            session_minutes(booking.session_duration)
+        )
+        
+        # Create appointment in database with pending status
         appointment_data = {
             "id": appointment_id,
             "full_name": booking.full_name,
@@ -259,15 +2112,25 @@ async def create_paypal_order(booking: AppointmentBooking):
             "appointment_time": booking.appointment_time,
             "payment_method": "paypal",
             "session_duration": booking.session_duration,
+            "start_at": start_at,
+            "duration_min": session_minutes(booking.session_duration),
             "session_price": final_price,
+            "locale": email_locale(booking.locale),
             "status": "pending",
-            "created_at": datetime.now(VET).isoformat()
+            "slot_held": True,
+            "hold_expires_at": hold_expires_at,
+            "created_at": datetime.now(timezone.utc)
         }
         
-        await db.appointments.insert_one(appointment_data)
+        try:
+            await db.appointments.insert_one(appointment_data)
+        except Exception:
+            await release_slot(appointment_data)
+            raise
+        await record_stats_transition(None, appointment_data)
         
         # Create PayPal payment
-        payment = paypalrestsdk.Payment({
+        payment_data = {
             "intent": "sale",
             "payer": {
                 "payment_method": "paypal"
@@ -292,9 +2155,14 @@ async def create_paypal_order(booking: AppointmentBooking):
                 },
                 "description": f"Cita psicológica para {booking.full_name} - {booking.appointment_date} {booking.appointment_time} - {session_description}"
             }]
-        })
+        }
+        try:
+            payment = await paypal_gateway.create_payment(payment_data)
+        except Exception:
+            await fail_paypal_order(appointment_data)
+            raise
         
-        if payment.create():
+        if payment is not None:
             # Find approval URL
             approval_url = None
             for link in payment.links:
@@ -310,8 +2178,15 @@ async def create_paypal_order(booking: AppointmentBooking):
             
             return {"approval_url": approval_url, "booking_id": appointment_id}
         else:
+            await fail_paypal_order(appointment_data)
             raise HTTPException(status_code=400, detail="Error creating PayPal payment")
             
+    except SlotOutsideSchedule:
+        raise HTTPException(status_code=422, detail="This time is not offered for the selected session")
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="This time slot is no longer available")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -319,53 +2194,92 @@ async def create_paypal_order(booking: AppointmentBooking):
 async def confirm_paypal_payment(payment_id: str, payer_id: str, booking_id: str):
     """Confirm PayPal payment and complete booking"""
     try:
+        appointment = await db.appointments.find_one({"id": booking_id}, {"_id": 0, "zelle_receipt": 0})
+        if appointment is None:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        # Reloads of the success page confirm again; the booking is already paid
+        if appointment.get("status") == "confirmed":
+            return {"message": "Payment confirmed successfully"}
+        
+        # Secure the slot for good before charging; fails if the hold lapsed and was taken
+        await make_hold_permanent(appointment)
+        
         # Execute PayPal payment
-        payment = paypalrestsdk.Payment.find(payment_id)
+        try:
+            executed = await paypal_gateway.execute_payment(payment_id, payer_id)
+        except Exception:
+            await restore_hold_expiry(booking_id, "paypal")
+            raise
+        if not executed:
+            await restore_hold_expiry(booking_id, "paypal")
+            raise HTTPException(status_code=400, detail="Payment confirmation failed")
         
-        if payment.execute({"payer_id": payer_id}):
-            # Update appointment status
-            await db.appointments.update_one(
-                {"id": booking_id},
-                {"$set": {
-                    "status": "confirmed",
-                    "paypal_payer_id": payer_id,
-                    "payment_confirmed_at": datetime.now(VET).isoformat()
-                }}
-            )
-            
-            # Get appointment details
-            appointment = await db.appointments.find_one({"id": booking_id})
-            
-            # Send confirmation emails
-            await send_confirmation_emails(appointment)
-            
+        # Update appointment status
+        confirmation = {
+            "status": "confirmed",
+            "paypal_payer_id": payer_id,
+            "payment_confirmed_at": datetime.now(VET).isoformat()
+        }
+        previous = await db.appointments.find_one_and_update(
+            {"id": booking_id, "status": {"$ne": "confirmed"}},
+            {"$set": confirmation, "$unset": {"hold_expires_at": ""}},
+            projection={"_id": 0, "zelle_receipt": 0}
+        )
+        # A failed confirm racing this one may have put an expiry back on the holds, and
+        # the expiry sweep may have released them while PayPal was executing
+        try:
+            await make_hold_permanent(appointment)
+        except SlotUnavailable:
+            # The payment went through, so a lost slot is flagged for Liz rather than rejected
+            await db.appointments.update_one({"id": booking_id}, {"$set": {"slot_conflict": True}})
+        if previous is None:
             return {"message": "Payment confirmed successfully"}
-        else:
-            raise HTTPException(status_code=400, detail="Payment confirmation failed")
+        appointment = {**previous, **confirmation}
+        availability_cache.invalidate(appointment["appointment_date"])
+        await record_stats_transition(previous, appointment)
+        
+        # Queue confirmation emails
+        await enqueue_confirmation_emails(appointment)
+        
+        return {"message": "Payment confirmed successfully"}
             
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="This time slot is no longer available")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/create-zelle-booking")
-async def create_zelle_booking(booking: AppointmentBooking):
+async def create_zelle_booking(booking: AppointmentBooking, request: Request, idempotency_key: Optional[str] = Header(None)):
     """Create Zelle booking (pending payment proof)"""
+    replay = await replay_idempotent("create-zelle-booking", idempotency_key, booking)
+    if replay is not None:
+        return replay
+    await enforce_rate_limits(request, booking.email)
+    async with admission_gate.admit():
+        return await run_idempotent("create-zelle-booking", idempotency_key, booking, lambda: place_zelle_booking(booking))
+
+async def place_zelle_booking(booking: AppointmentBooking):
     try:
-        # Get current settings
-        settings = await db.settings.find_one({"type": "zelle_config"})
-        zelle_email = settings.get("zelle_email", os.getenv('ZELLE_EMAIL', 'psicolizparra@gmail.com')) if settings else os.getenv('ZELLE_EMAIL', 'psicolizparra@gmail.com')
-        base_price = settings.get("consultation_price", 50.00) if settings else 50.00
-        half_hour_ext = settings.get("half_hour_extension", 25.00) if settings else 25.00
-        full_hour_ext = settings.get("full_hour_extension", 45.00) if settings else 45.00
-        
         # Calculate final price based on session duration
-        if booking.session_duration == "plus_30min":
-            final_price = base_price + half_hour_ext
-        elif booking.session_duration == "plus_60min":
-            final_price = base_price + full_hour_ext
-        else:
-            final_price = base_price
+        settings = await get_settings_snapshot()
+        zelle_email = settings.zelle_email
+        final_price = settings.session_price(booking.session_duration)
+        
+        try:
+            start_at = appointment_start_at(booking.appointment_date, booking.appointment_time)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid appointment date or time")
         
+        # Reserve the slot before writing the appointment
         appointment_id = str(uuid.uuid4())
+        hold_expires_at = hold_expiry("zelle")
+        await claim_slot(
+            booking.appointment_date, booking.appointment_time, appointment_id, hold_expires_at,
+            session_minutes(booking.session_duration)
+        )
+        
         appointment_data = {
             "id": appointment_id,
             "full_name": booking.full_name,
@@ -375,12 +2289,22 @@ async def create_zelle_booking(booking: AppointmentBooking):
             "appointment_time": booking.appointment_time,
             "payment_method": "zelle",
             "session_duration": booking.session_duration,
+            "start_at": start_at,
+            "duration_min": session_minutes(booking.session_duration),
             "session_price": final_price,
+            "locale": email_locale(booking.locale),
             "status": "awaiting_payment_proof",
-            "created_at": datetime.now(VET).isoformat()
+            "slot_held": True,
+            "hold_expires_at": hold_expires_at,
+            "created_at": datetime.now(timezone.utc)
         }
         
-        await db.appointments.insert_one(appointment_data)
+        try:
+            await db.appointments.insert_one(appointment_data)
+        except Exception:
+            await release_slot(appointment_data)
+            raise
+        await record_stats_transition(None, appointment_data)
         
         return {
             "booking_id": appointment_id,
@@ -389,235 +2313,1627 @@ async def create_zelle_booking(booking: AppointmentBooking):
             "message": "Please send payment proof after completing Zelle transfer"
         }
         
+    except SlotOutsideSchedule:
+        raise HTTPException(status_code=422, detail="This time is not offered for the selected session")
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="This time slot is no longer available")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Zelle receipt storage
+RECEIPT_STORAGE = os.getenv("RECEIPT_STORAGE", "gridfs")  # "gridfs" or "local"
+RECEIPT_DIR = os.getenv("RECEIPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "receipts"))
+RECEIPT_CHUNK_SIZE = 255 * 1024
+
+class GridFSReceiptStore:
+    """Receipts stored as GridFS files in the "receipts" bucket"""
+    name = "gridfs"
+    
+    def _bucket(self):
+        return motor.motor_asyncio.AsyncIOMotorGridFSBucket(db, bucket_name="receipts")
+    
+    async def save(self, upload, metadata):
+        grid_in = self._bucket().open_upload_stream(
+            upload.filename or "receipt",
+            chunk_size_bytes=RECEIPT_CHUNK_SIZE,
+            metadata={**metadata, "content_type": upload.content_type}
+        )
+        size = 0
+        try:
+            while chunk := await upload.read(RECEIPT_CHUNK_SIZE):
+                await grid_in.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        return str(grid_in._id), size
+    
+    async def stream(self, receipt_id):
+        try:
+            grid_out = await self._bucket().open_download_stream(ObjectId(receipt_id))
+        except (InvalidId, gridfs.errors.NoFile):
+            return None
+        
+        async def chunks():
+            while chunk := await grid_out.readchunk():
+                yield chunk
+        return chunks()
+    
+    async def delete(self, receipt_id):
+        try:
+            await self._bucket().delete(ObjectId(receipt_id))
+        except (InvalidId, gridfs.errors.NoFile):
+            pass
+
+class LocalReceiptStore:
+    """Receipts stored as files under RECEIPT_DIR"""
+    name = "local"
+    
+    def _path(self, receipt_id):
+        # Ids are generated here as uuid hex strings; reject anything else
+        if not receipt_id or not receipt_id.isalnum():
+            return None
+        return os.path.join(RECEIPT_DIR, receipt_id)
+    
+    async def save(self, upload, metadata):
+        os.makedirs(RECEIPT_DIR, exist_ok=True)
+        receipt_id = uuid.uuid4().hex
+        path = self._path(receipt_id)
+        size = 0
+        try:
+            with open(path, "wb") as receipt_file:
+                while chunk := await upload.read(RECEIPT_CHUNK_SIZE):
+                    await asyncio.to_thread(receipt_file.write, chunk)
+                    size += len(chunk)
+        except BaseException:
+            await self.delete(receipt_id)
+            raise
+        return receipt_id, size
+    
+    async def stream(self, receipt_id):
+        path = self._path(receipt_id)
+        if not path or not os.path.isfile(path):
+            return None
+        
+        async def chunks():
+            with open(path, "rb") as receipt_file:
+                while chunk := await asyncio.to_thread(receipt_file.read, RECEIPT_CHUNK_SIZE):
+                    yield chunk
+        return chunks()
+    
+    async def delete(self, receipt_id):
+        path = self._path(receipt_id)
+        if path and os.path.isfile(path):
+            os.remove(path)
+
+receipt_stores = {store.name: store for store in (GridFSReceiptStore(), LocalReceiptStore())}
+if RECEIPT_STORAGE not in receipt_stores:
+    raise ValueError(f"RECEIPT_STORAGE must be one of {sorted(receipt_stores)}")
+receipt_store = receipt_stores[RECEIPT_STORAGE]
+
+RECEIPT_FIELDS = {
+    "zelle_receipt_id": 1, "zelle_receipt_storage": 1, "zelle_receipt_filename": 1,
+    "zelle_receipt_content_type": 1, "zelle_receipt_size": 1, "zelle_receipt_thumbnail_id": 1
+}
+
+# Receipt image processing: uploads are size-limited while read, checked by
+# their magic bytes, then downscaled and recompressed (plus a thumbnail for the
+# admin panel) in a process pool so Pillow never blocks the event loop
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", str(10 * 1024 * 1024)))
+RECEIPT_MAX_PIXELS = int(os.getenv("RECEIPT_MAX_PIXELS", "40000000"))
+RECEIPT_MAX_DIMENSION = int(os.getenv("RECEIPT_MAX_DIMENSION", "1600"))
+RECEIPT_THUMBNAIL_SIZE = int(os.getenv("RECEIPT_THUMBNAIL_SIZE", "320"))
+RECEIPT_IMAGE_FORMAT = os.getenv("RECEIPT_IMAGE_FORMAT", "webp").lower()  # "webp" or "jpeg"
+RECEIPT_IMAGE_QUALITY = int(os.getenv("RECEIPT_IMAGE_QUALITY", "80"))
+RECEIPT_PROCESS_WORKERS = int(os.getenv("RECEIPT_PROCESS_WORKERS", "2"))
+RECEIPT_WORKER_WARMUP = os.getenv("RECEIPT_WORKER_WARMUP", "true").lower() == "true"
+
+RECEIPT_OUTPUT_TYPES = {"webp": ("WEBP", "image/webp", "webp"), "jpeg": ("JPEG", "image/jpeg", "jpg")}
+if RECEIPT_IMAGE_FORMAT not in RECEIPT_OUTPUT_TYPES:
+    raise ValueError(f"RECEIPT_IMAGE_FORMAT must be one of {sorted(RECEIPT_OUTPUT_TYPES)}")
+
+def sniff_image_type(head):
+    """MIME type from the file's leading bytes; the client's content type is not trusted"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+def encode_image(image, pillow_format, quality):
+    output = io.BytesIO()
+    if pillow_format == "JPEG":
+        image.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        # method 2 encodes ~2.5x faster than the default 4 for a few percent larger files
+        image.save(output, format=pillow_format, quality=quality, method=2)
+    return output.getvalue()
+
+def process_receipt_image(path, pillow_format, quality, max_dimension, thumbnail_size, max_pixels):
+    """Runs in a worker process. Returns (image bytes, thumbnail bytes, (width, height))."""
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with warnings.catch_warnings():
+        # Pillow only warns between MAX_IMAGE_PIXELS and twice that; refuse those too
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        image = Image.open(path)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        # Flatten transparency onto white; neither output needs an alpha channel
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, "white")
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+    return encode_image(image, pillow_format, quality), encode_image(thumbnail, pillow_format, 70), image.size
+
+receipt_process_pool = None
+
+def receipt_worker_ready():
+    """A no-op job; unpickling it makes a fresh worker import this module"""
+    return os.getpid()
+
+def new_receipt_process_pool():
+    # Spawned, not forked: by the time a pool starts, Motor and the thread
+    # executors have threads whose locks a forked child could inherit held
+    return ProcessPoolExecutor(max_workers=RECEIPT_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+@app.on_event("startup")
+async def start_receipt_process_pool():
+    global receipt_process_pool
+    receipt_process_pool = new_receipt_process_pool()
+    # Spawned workers import this module before their first job; start them now, in the
+    # background, so the first uploads do not wait for that
+    if RECEIPT_WORKER_WARMUP:
+        for _ in range(RECEIPT_PROCESS_WORKERS):
+            receipt_process_pool.submit(receipt_worker_ready)
+
+async def process_receipt(path):
+    """Downscale the spooled upload at path in the process pool"""
+    global receipt_process_pool
+    if receipt_process_pool is None:
+        receipt_process_pool = new_receipt_process_pool()
+    pillow_format = RECEIPT_OUTPUT_TYPES[RECEIPT_IMAGE_FORMAT][0]
+    job = functools.partial(
+        process_receipt_image, path, pillow_format, RECEIPT_IMAGE_QUALITY,
+        RECEIPT_MAX_DIMENSION, RECEIPT_THUMBNAIL_SIZE, RECEIPT_MAX_PIXELS
+    )
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(receipt_process_pool, job)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool for the next upload
+        receipt_process_pool = None
+        raise HTTPException(status_code=503, detail="Receipt processing is temporarily unavailable, please retry")
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise HTTPException(status_code=413, detail="Receipt image resolution is too large")
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise HTTPException(status_code=400, detail="Receipt image could not be read")
+
+@contextlib.asynccontextmanager
+async def spooled_receipt_upload(upload):
+    """Copy an upload to a temporary file the process pool can open by path.
+    
+    Yields (path, size, sniffed type) and removes the file on exit; stops
+    reading as soon as the limit is passed, so at most one chunk is in memory.
+    """
+    spool = tempfile.NamedTemporaryFile(prefix="receipt-", suffix=".upload", delete=False)
+    try:
+        size = 0
+        content_type = None
+        with spool:
+            while chunk := await upload.read(RECEIPT_CHUNK_SIZE):
+                if content_type is None:
+                    content_type = sniff_image_type(bytes(chunk[:16]))
+                    if content_type is None:
+                        raise HTTPException(status_code=415, detail="Receipt must be a JPEG, PNG, WebP or GIF image")
+                size += len(chunk)
+                if size > RECEIPT_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Receipt is too large (max {RECEIPT_MAX_BYTES // (1024 * 1024)} MB)"
+                    )
+                await asyncio.to_thread(spool.write, chunk)
+        if content_type is None:
+            raise HTTPException(status_code=400, detail="Receipt file is empty")
+        yield spool.name, size, content_type
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(spool.name)
+
+def bytes_upload(data, filename, content_type):
+    return UploadFile(file=io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+
+@app.on_event("shutdown")
+async def stop_receipt_process_pool():
+    if receipt_process_pool is not None:
+        receipt_process_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.middleware("http")
+async def reject_oversized_receipts(request, call_next):
+    # Refuse by Content-Length before the multipart body is parsed and spooled
+    if request.url.path == "/api/upload-zelle-proof":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > RECEIPT_MAX_BYTES + 64 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Receipt is too large (max {RECEIPT_MAX_BYTES // (1024 * 1024)} MB)"}
+            )
+    return await call_next(request)
+
+async def open_receipt(appointment):
+    """Async iterator over an appointment's receipt bytes, or None if it has none"""
+    if appointment.get("zelle_receipt_id"):
+        store = receipt_stores.get(appointment.get("zelle_receipt_storage", "gridfs"))
+        return await store.stream(appointment["zelle_receipt_id"]) if store else None
+    if appointment.get("zelle_receipt"):
+        # Legacy receipts embedded as base64 in the appointment
+        async def legacy_chunks():
+            yield base64.b64decode(appointment["zelle_receipt"])
+        return legacy_chunks()
+    return None
+
+async def read_receipt(appointment):
+    chunks = await open_receipt(appointment)
+    if chunks is None:
+        return None
+    return b"".join([chunk async for chunk in chunks])
+
+async def delete_receipt(appointment):
+    store = receipt_stores.get(appointment.get("zelle_receipt_storage", "gridfs"))
+    if appointment.get("zelle_receipt_id") and store:
+        await store.delete(appointment["zelle_receipt_id"])
+        if appointment.get("zelle_receipt_thumbnail_id"):
+            await store.delete(appointment["zelle_receipt_thumbnail_id"])
+
 @app.post("/api/upload-zelle-proof")
 async def upload_zelle_proof(
+    request: Request,
     booking_id: str = Form(...),
     file: UploadFile = File(...)
 ):
     """Upload Zelle payment proof"""
+    await enforce_rate_limits(request, f"booking:{booking_id}")
+    async with admission_gate.admit():
+        return await store_zelle_proof(booking_id, file)
+
+async def store_zelle_proof(booking_id: str, file: UploadFile):
     try:
-        # Read file content and encode to base64
-        file_content = await file.read()
-        file_base64 = base64.b64encode(file_content).decode()
+        previous = await db.appointments.find_one(
+            {"id": booking_id},
+            {"_id": 0, "id": 1, "appointment_time": 1, "session_duration": 1, **STATS_FIELDS}
+        )
+        if previous is None:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        
+        # Validate and shrink the image before anything is written
+        async with spooled_receipt_upload(file) as (upload_path, original_size, original_content_type):
+            image_data, thumbnail_data, (width, height) = await process_receipt(upload_path)
+        _, content_type, extension = RECEIPT_OUTPUT_TYPES[RECEIPT_IMAGE_FORMAT]
+        filename = f"{os.path.splitext(file.filename or '')[0] or 'receipt'}.{extension}"
+        
+        # The transfer already happened, so a lost slot is flagged for Liz rather than rejected
+        slot_conflict = False
+        try:
+            await make_hold_permanent(previous)
+        except SlotUnavailable:
+            slot_conflict = True
         
-        # Update appointment with receipt
-        result = await db.appointments.update_one(
+        receipt_id, receipt_size = await receipt_store.save(
+            bytes_upload(image_data, filename, content_type), {"booking_id": booking_id}
+        )
+        thumbnail_id, _ = await receipt_store.save(
+            bytes_upload(thumbnail_data, f"thumbnail_{filename}", content_type),
+            {"booking_id": booking_id, "kind": "thumbnail"}
+        )
+        
+        # Update appointment with a reference to the receipt
+        receipt = {
+            "status": "confirmed",
+            "zelle_receipt_id": receipt_id,
+            "zelle_receipt_thumbnail_id": thumbnail_id,
+            "zelle_receipt_storage": receipt_store.name,
+            "zelle_receipt_filename": filename,
+            "zelle_receipt_content_type": content_type,
+            "zelle_receipt_size": receipt_size,
+            "zelle_receipt_width": width,
+            "zelle_receipt_height": height,
+            "zelle_receipt_original_content_type": original_content_type,
+            "zelle_receipt_original_size": original_size,
+            "slot_conflict": slot_conflict,
+            "payment_confirmed_at": datetime.now(VET).isoformat()
+        }
+        # The document as it was just before this write is what the stats transition and
+        # receipt cleanup start from; a racing upload or admin confirm is already in it
+        before = await db.appointments.find_one_and_update(
             {"id": booking_id},
-            {"$set": {
-                "status": "confirmed",
-                "zelle_receipt": file_base64,
-                "zelle_receipt_filename": file.filename,
-                "payment_confirmed_at": datetime.now(VET).isoformat()
-            }}
+            {"$set": receipt, "$unset": {"zelle_receipt": "", "hold_expires_at": ""}},
+            projection={"_id": 0, "zelle_receipt": 0},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.modified_count == 0:
+        if before is None:
+            await receipt_store.delete(receipt_id)
+            await receipt_store.delete(thumbnail_id)
             raise HTTPException(status_code=404, detail="Booking not found")
+        appointment = {**before, **receipt}
+        appointment.pop("hold_expires_at", None)
+        availability_cache.invalidate(appointment["appointment_date"])
+        await record_stats_transition(before, appointment)
+        await delete_receipt(before)
         
-        # Get appointment details
-        appointment = await db.appointments.find_one({"id": booking_id})
-        
-        # Send confirmation emails with attachment
-        await send_confirmation_emails(appointment)
+        # Queue confirmation emails with attachment
+        await enqueue_confirmation_emails(appointment)
         
         return {"message": "Payment proof uploaded successfully"}
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def find_appointment_including_archive(appointment_id, projection):
+    appointment = await db.appointments.find_one({"id": appointment_id}, projection)
+    if appointment is None:
+        appointment = await db.appointments_archive.find_one({"id": appointment_id}, projection)
+    return appointment
+
+@app.get("/api/admin/appointments/{appointment_id}/receipt")
+async def get_appointment_receipt(appointment_id: str, admin: str = Depends(get_admin_user)):
+    """Stream the Zelle receipt of an appointment"""
+    appointment = await find_appointment_including_archive(
+        appointment_id,
+        {"_id": 0, "zelle_receipt": 1, **RECEIPT_FIELDS}
+    )
+    if appointment is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    
+    chunks = await open_receipt(appointment)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    filename = (appointment.get("zelle_receipt_filename") or "receipt").replace('"', "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if appointment.get("zelle_receipt_size") is not None:
+        headers["Content-Length"] = str(appointment["zelle_receipt_size"])
+    return StreamingResponse(
+        chunks,
+        media_type=appointment.get("zelle_receipt_content_type") or "application/octet-stream",
+        headers=headers
+    )
+
+@app.get("/api/admin/appointments/{appointment_id}/receipt/thumbnail")
+async def get_appointment_receipt_thumbnail(appointment_id: str, admin: str = Depends(get_admin_user)):
+    """Stream the small preview of an appointment's Zelle receipt"""
+    appointment = await find_appointment_including_archive(
+        appointment_id,
+        {"_id": 0, "zelle_receipt_thumbnail_id": 1, "zelle_receipt_storage": 1, "zelle_receipt_content_type": 1}
+    )
+    if appointment is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    
+    store = receipt_stores.get(appointment.get("zelle_receipt_storage", "gridfs"))
+    chunks = None
+    if appointment.get("zelle_receipt_thumbnail_id") and store:
+        chunks = await store.stream(appointment["zelle_receipt_thumbnail_id"])
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    
+    # A thumbnail id is never reused, so browsers may keep it
+    return StreamingResponse(
+        chunks,
+        media_type=appointment.get("zelle_receipt_content_type") or "application/octet-stream",
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+
+@app.post("/api/admin/maintenance/migrate-receipts")
+async def migrate_embedded_receipts(batch_size: int = 50, admin: str = Depends(get_admin_user)):
+    """Move receipts still embedded as base64 in appointments into the receipt store"""
+    migrated = 0
+    while True:
+        batch = await db.appointments.find(
+            {"zelle_receipt": {"$exists": True}},
+            {"_id": 0, "id": 1, "zelle_receipt": 1, "zelle_receipt_filename": 1}
+        ).to_list(batch_size)
+        if not batch:
+            break
+        for appointment in batch:
+            upload = UploadFile(
+                file=io.BytesIO(base64.b64decode(appointment["zelle_receipt"])),
+                filename=appointment.get("zelle_receipt_filename") or "receipt"
+            )
+            receipt_id, receipt_size = await receipt_store.save(upload, {"booking_id": appointment["id"]})
+            await db.appointments.update_one(
+                {"id": appointment["id"]},
+                {
+                    "$set": {
+                        "zelle_receipt_id": receipt_id,
+                        "zelle_receipt_storage": receipt_store.name,
+                        "zelle_receipt_size": receipt_size
+                    },
+                    "$unset": {"zelle_receipt": ""}
+                }
+            )
+            migrated += 1
+    return {"message": f"Migrated {migrated} receipts", "migrated": migrated}
+
+# Email delivery: handlers enqueue messages into the email_outbox collection and
+# return; EmailOutboxWorker delivers them in the background over one reused SMTP
+# session, retrying with exponential backoff until EMAIL_MAX_ATTEMPTS, after
+# which a message is parked in the "dead" state.
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "15"))
+EMAIL_CLAIM_TIMEOUT_SECONDS = float(os.getenv("EMAIL_CLAIM_TIMEOUT_SECONDS", "300"))
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
+
+# Email templates: Jinja2 files in email_templates/, named <kind>.<locale>.<html|txt>,
+# compiled once at import. HTML is autoescaped; every message also gets a text part.
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "email_templates")
+EMAIL_KINDS = ["user_confirmation", "liz_notification", "reminder"]
+EMAIL_LOCALES = ["es", "en"]
+DEFAULT_EMAIL_LOCALE = "es"
+LIZA_LOCALE = os.getenv("LIZA_LOCALE", DEFAULT_EMAIL_LOCALE)
+EMAIL_SUBJECTS = {
+    ("user_confirmation", "es"): "Confirmación de Cita - Liz Parra Psicóloga",
+    ("user_confirmation", "en"): "Appointment Confirmation - Liz Parra Psychologist",
+    ("liz_notification", "es"): "Nueva Cita - {{ appointment.full_name }} - {{ appointment.appointment_date }}",
+    ("liz_notification", "en"): "New Appointment - {{ appointment.full_name }} - {{ appointment.appointment_date }}",
+    ("reminder", "es"): "Recordatorio: tu cita de mañana a las {{ appointment.appointment_time }} - Liz Parra",
+    ("reminder", "en"): "Reminder: your appointment tomorrow at {{ appointment.appointment_time }} - Liz Parra",
+}
+
+email_environment = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(EMAIL_TEMPLATE_DIR),
+    autoescape=jinja2.select_autoescape(enabled_extensions=("html",), default_for_string=False),
+    undefined=jinja2.StrictUndefined,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+def compile_email_templates():
+    """(kind, locale) -> compiled subject, html and text templates; a missing file fails at startup"""
+    return {
+        (kind, locale): {
+            # Subjects are header text, never HTML, so they are not escaped
+            "subject": email_environment.from_string(EMAIL_SUBJECTS[(kind, locale)]),
+            "html": email_environment.get_template(f"{kind}.{locale}.html"),
+            "text": email_environment.get_template(f"{kind}.{locale}.txt")
+        }
+        for kind in EMAIL_KINDS
+        for locale in EMAIL_LOCALES
+    }
+
+email_templates = compile_email_templates()
+
+def email_locale(locale):
+    return locale if locale in EMAIL_LOCALES else DEFAULT_EMAIL_LOCALE
+
+def render_email(kind, locale, to, appointment, attachment_appointment_id=None):
+    """One outbox entry rendered from the compiled templates"""
+    templates = email_templates[(kind, email_locale(locale))]
+    context = {"appointment": appointment}
+    return {
+        "kind": kind,
+        "to": to,
+        # Header injection guard: a subject must stay on one line
+        "subject": " ".join(templates["subject"].render(context).split()),
+        "html": templates["html"].render(context),
+        "text": templates["text"].render(context),
+        "attachment_appointment_id": attachment_appointment_id
+    }
+
+def render_email_batch(kind, appointments):
+    """Render one message per appointment (e.g. a day's reminders) with the same templates"""
+    return [
+        render_email(kind, appointment.get("locale"), appointment["email"], appointment)
+        for appointment in appointments
+    ]
+
+def build_confirmation_messages(appointment):
+    """Outbox entries for the user confirmation and Liz's notification"""
+    has_receipt = bool(appointment.get("zelle_receipt_id") or appointment.get("zelle_receipt"))
+    return [
+        render_email("user_confirmation", appointment.get("locale"), appointment["email"], appointment),
+        # Zelle receipt is read from the receipt store at send time
+        render_email(
+            "liz_notification", LIZA_LOCALE, LIZA_EMAIL, appointment,
+            attachment_appointment_id=appointment["id"] if has_receipt else None
+        )
+    ]
+
+async def enqueue_emails(messages):
+    now = datetime.now(timezone.utc)
+    await db.email_outbox.insert_many([
+        {**message, "status": "pending", "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for message in messages
+    ])
+    email_worker.wake()
+
+async def enqueue_confirmation_emails(appointment):
+    """Queue confirmation emails to user and Liz; delivery happens in the background"""
+    try:
+        await enqueue_emails(build_confirmation_messages(appointment))
+    except Exception as e:
+        print(f"Error queueing emails: {str(e)}")
+
+# Reminders for the next day's confirmed appointments, rendered and queued in bulk
+REMINDER_HOUR = os.getenv("REMINDER_HOUR")  # VET hour to queue tomorrow's reminders; unset = only the admin trigger
+REMINDER_BATCH_SIZE = 200
+REMINDER_FIELDS = {
+    "_id": 0, "id": 1, "full_name": 1, "email": 1, "whatsapp": 1,
+    "appointment_date": 1, "appointment_time": 1, "locale": 1
+}
+
+async def enqueue_reminders(day):
+    """Queue a reminder for every confirmed appointment on day that has not had one"""
+    batch_id = uuid.uuid4().hex
+    # Claim first, so concurrent runs (other workers, the admin trigger) never remind twice
+    await db.appointments.update_many(
+        {"appointment_date": day, "status": "confirmed", "reminder_queued_at": {"$exists": False}},
+        {"$set": {"reminder_queued_at": datetime.now(timezone.utc), "reminder_batch": batch_id}}
+    )
+    cursor = db.appointments.find(
+        {"appointment_date": day, "reminder_batch": batch_id}, REMINDER_FIELDS
+    ).sort("appointment_time", ASCENDING)
+    queued = 0
+    while batch := await cursor.to_list(REMINDER_BATCH_SIZE):
+        await enqueue_emails(render_email_batch("reminder", batch))
+        queued += len(batch)
+    return queued
+
+async def run_reminder_schedule():
+    """Queue tomorrow's reminders daily at REMINDER_HOUR; catches up if started after that hour"""
+    while True:
+        now = datetime.now(VET)
+        run_at = now.replace(hour=int(REMINDER_HOUR), minute=0, second=0, microsecond=0)
+        if now >= run_at:
+            try:
+                await enqueue_reminders((now.date() + timedelta(days=1)).isoformat())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error queueing reminders: {str(e)}")
+            run_at += timedelta(days=1)
+        await asyncio.sleep((run_at - datetime.now(VET)).total_seconds())
+
+reminder_task = None
+
+@app.on_event("startup")
+async def start_reminder_schedule():
+    global reminder_task
+    if REMINDER_HOUR:
+        reminder_task = asyncio.create_task(run_reminder_schedule())
+
+@app.on_event("shutdown")
+async def stop_reminder_schedule():
+    if reminder_task:
+        reminder_task.cancel()
+
+@app.post("/api/admin/reminders/send")
+async def send_reminders(date: Optional[str] = None, admin: str = Depends(get_admin_user)):
+    """Queue reminder emails for a day's confirmed appointments (default: tomorrow)"""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date() if date else datetime.now(VET).date() + timedelta(days=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    try:
+        queued = await enqueue_reminders(day.isoformat())
+        return {"message": f"Queued {queued} reminders for {day.isoformat()}", "queued": queued}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-async def send_confirmation_emails(appointment):
-    """Send confirmation emails to user and Liz using SMTP"""
-    try:
-        # User confirmation email
-        user_msg = MIMEMultipart('alternative')
-        user_msg['Subject'] = 'Confirmación de Cita - Liz Parra Psicóloga'
-        user_msg['From'] = FROM_EMAIL
-        user_msg['To'] = appointment['email']
-        
-        user_html = f'''
-        <h2>¡Tu cita ha sido confirmada!</h2>
-        <p>Hola {appointment['full_name']},</p>
-        <p>Tu cita psicológica ha sido confirmada para:</p>
-        <ul>
-            <li><strong>Fecha:</strong> {appointment['appointment_date']}</li>
-            <li><strong>Hora:</strong> {appointment['appointment_time']}</li>
-            <li><strong>Método de pago:</strong> {appointment['payment_method']}</li>
-        </ul>
-        <p><strong>Importante:</strong> Liz se contactará contigo por WhatsApp en la hora de tu cita.</p>
-        <p>¡Nos vemos pronto!</p>
-        <p>Saludos,<br>Liz Parra<br>Psicóloga</p>
-        '''
-        
-        user_html_part = MIMEText(user_html, 'html')
-        user_msg.attach(user_html_part)
-        
-        # Liz notification email
-        liz_msg = MIMEMultipart('mixed')
-        liz_msg['Subject'] = f'Nueva Cita - {appointment["full_name"]} - {appointment["appointment_date"]}'
-        liz_msg['From'] = FROM_EMAIL
-        liz_msg['To'] = os.getenv('LIZA_EMAIL')
-        
-        liz_html = f'''
-        <h2>Nueva Cita Reservada</h2>
-        <p><strong>Cliente:</strong> {appointment['full_name']}</p>
-        <p><strong>WhatsApp:</strong> {appointment['whatsapp']}</p>
-        <p><strong>Email:</strong> {appointment['email']}</p>
-        <p><strong>Fecha:</strong> {appointment['appointment_date']}</p>
-        <p><strong>Hora:</strong> {appointment['appointment_time']}</p>
-        <p><strong>Método de pago:</strong> {appointment['payment_method']}</p>
-        '''
-        
-        liz_html_part = MIMEText(liz_html, 'html')
-        liz_msg.attach(liz_html_part)
-        
-        # Add Zelle receipt attachment if exists
-        if appointment.get('zelle_receipt'):
-            attachment_data = base64.b64decode(appointment['zelle_receipt'])
-            attachment = MIMEBase('application', 'octet-stream')
-            attachment.set_payload(attachment_data)
-            encoders.encode_base64(attachment)
-            attachment.add_header(
-                'Content-Disposition',
-                f'attachment; filename={appointment.get("zelle_receipt_filename", "receipt.jpg")}'
+class AttachmentCache:
+    """Base64-encoded receipt attachments keyed by receipt, so retries skip the read and encode"""
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def set(self, key, entry):
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key)["payload"])
+        self._entries[key] = entry
+        self._size += len(entry["payload"])
+        while self._size > self.max_bytes and self._entries:
+            self._size -= len(self._entries.popitem(last=False)[1]["payload"])
+
+attachment_cache = AttachmentCache(int(os.getenv("EMAIL_ATTACHMENT_CACHE_BYTES", str(32 * 1024 * 1024))))
+
+async def load_receipt_attachment(appointment_id):
+    appointment = await db.appointments.find_one(
+        {"id": appointment_id},
+        {"_id": 0, "zelle_receipt": 1, **RECEIPT_FIELDS}
+    )
+    if appointment is None:
+        return None
+    key = appointment.get("zelle_receipt_id") or f"legacy:{appointment_id}"
+    cached = attachment_cache.get(key)
+    if cached is not None:
+        return cached
+    attachment_data = await read_receipt(appointment)
+    if attachment_data is None:
+        return None
+    entry = {
+        "content_type": appointment.get("zelle_receipt_content_type") or "application/octet-stream",
+        "filename": appointment.get("zelle_receipt_filename") or "receipt.jpg",
+        "payload": base64.encodebytes(attachment_data).decode("ascii")
+    }
+    attachment_cache.set(key, entry)
+    return entry
+
+async def build_mime_message(message):
+    body = MIMEMultipart("alternative")
+    # Entries queued before text parts existed only have HTML
+    if message.get("text"):
+        body.attach(MIMEText(message["text"], "plain", "utf-8"))
+    body.attach(MIMEText(message["html"], "html", "utf-8"))
+    
+    attachment = None
+    if message.get("attachment_appointment_id"):
+        attachment = await load_receipt_attachment(message["attachment_appointment_id"])
+    if attachment is not None:
+        mime_message = MIMEMultipart("mixed")
+        mime_message.attach(body)
+        main_type, _, sub_type = attachment["content_type"].partition("/")
+        part = MIMEBase(main_type, sub_type or "octet-stream")
+        part.set_payload(attachment["payload"])
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=attachment["filename"])
+        mime_message.attach(part)
+    else:
+        mime_message = body
+    mime_message["Subject"] = message["subject"]
+    mime_message["From"] = FROM_EMAIL
+    mime_message["To"] = message["to"]
+    return mime_message
+
+class SMTPSession:
+    """A kept-alive SMTP connection; all methods block and run in a worker thread"""
+    
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+    
+    def _connect(self):
+        self.close()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+            if SMTP_USE_TLS:
+                server.starttls()
+            if SMTP_LOGIN:
+                server.login(SMTP_LOGIN, SMTP_PASSWORD)
+            outcome = "ok"
+        finally:
+            observe_external_call("smtp", "connect", started, outcome)
+        self._server = server
+    
+    def _ensure_connected(self):
+        if self._server is None:
+            self._connect()
+        elif time.monotonic() - self._last_used > SMTP_IDLE_CHECK_SECONDS:
+            # Servers drop idle connections; check before reusing
+            try:
+                if self._server.noop()[0] != 250:
+                    self._connect()
+            except smtplib.SMTPException:
+                self._connect()
+    
+    def send_batch(self, mime_messages):
+        """Send each message, reconnecting once on a dropped connection.
+        
+        Returns one error string (or None on success) per message.
+        """
+        results = []
+        for mime_message in mime_messages:
+            for attempt in range(2):
+                try:
+                    self._ensure_connected()
+                    started = time.perf_counter()
+                    try:
+                        self._server.send_message(mime_message)
+                    except Exception:
+                        observe_external_call("smtp", "send_message", started, "error")
+                        raise
+                    observe_external_call("smtp", "send_message", started, "ok")
+                    self._last_used = time.monotonic()
+                    results.append(None)
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    self._server = None
+                    if attempt == 1:
+                        results.append(str(e))
+                except Exception as e:
+                    results.append(str(e))
+                    break
+        return results
+    
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+class EmailOutboxWorker:
+    def __init__(self):
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._smtp = SMTPSession()
+    
+    def wake(self):
+        self._wakeup.set()
+    
+    def start(self):
+        if not SMTP_SERVER:
+            print("Warning: SMTP_SERVER not set, queued emails will not be delivered")
+            return
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self._smtp.close)
+    
+    async def _run(self):
+        while True:
+            try:
+                await self._release_stale_claims()
+                delivered = await self.deliver_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error delivering emails: {str(e)}")
+                delivered = 0
+            if delivered < EMAIL_BATCH_SIZE:
+                # Nothing more due right now; sleep until woken or the next poll
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+    
+    async def _release_stale_claims(self):
+        # Messages claimed by a worker that died mid-send go back to the queue; a claim
+        # counts as an attempt, so one that keeps crashing its worker ends up dead too
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS)
+        stale = {"status": "sending", "claimed_at": {"$lt": cutoff}}
+        await db.email_outbox.update_many(
+            {**stale, "attempts": {"$gte": EMAIL_MAX_ATTEMPTS - 1}},
+            {"$set": {"status": "dead", "last_error": "Delivery claim timed out"}, "$inc": {"attempts": 1}}
+        )
+        await db.email_outbox.update_many(stale, {"$set": {"status": "pending"}, "$inc": {"attempts": 1}})
+    
+    async def _claim_batch(self):
+        batch = []
+        now = datetime.now(timezone.utc)
+        while len(batch) < EMAIL_BATCH_SIZE:
+            message = await db.email_outbox.find_one_and_update(
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"$set": {"status": "sending", "claimed_at": now}},
+                sort=[("next_attempt_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
             )
-            liz_msg.attach(attachment)
+            if message is None:
+                break
+            batch.append(message)
+        return batch
+    
+    async def deliver_batch(self):
+        """Claim due messages and send them over the shared SMTP session"""
+        batch = await self._claim_batch()
+        if not batch:
+            return 0
         
-        # Send emails using SMTP
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_LOGIN, SMTP_PASSWORD)
-            
-            # Send user email
-            server.send_message(user_msg)
-            
-            # Send Liz email
-            server.send_message(liz_msg)
+        # A message that cannot be built (e.g. its receipt attachment is unreadable)
+        # fails on its own through the retry path; the rest of the batch still goes out
+        results = []
+        sendable = []
+        mime_messages = []
+        for message in batch:
+            try:
+                mime_messages.append(await build_mime_message(message))
+                sendable.append(message)
+            except Exception as e:
+                results.append((message, f"Could not build message: {str(e)}"))
+        if mime_messages:
+            errors = await asyncio.to_thread(self._smtp.send_batch, mime_messages)
+            results += list(zip(sendable, errors))
+        
+        now = datetime.now(timezone.utc)
+        for message, error in results:
+            if error is None:
+                update = {"$set": {"status": "sent", "sent_at": now}, "$inc": {"attempts": 1}}
+            else:
+                attempts = message.get("attempts", 0) + 1
+                if attempts >= EMAIL_MAX_ATTEMPTS:
+                    update = {"$set": {"status": "dead", "last_error": error, "attempts": attempts}}
+                else:
+                    retry_at = now + timedelta(seconds=EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+                    update = {"$set": {"status": "pending", "next_attempt_at": retry_at, "last_error": error, "attempts": attempts}}
+                print(f"Error sending email {message['_id']}: {error}")
+            await db.email_outbox.update_one({"_id": message["_id"]}, update)
+        return len(batch)
+
+email_worker = EmailOutboxWorker()
+
+@app.on_event("startup")
+async def start_email_worker():
+    email_worker.start()
+
+@app.on_event("shutdown")
+async def stop_email_worker():
+    await email_worker.stop()
+
+# Typed appointment time fields. Besides the VET date/time strings, appointments
+# carry start_at (UTC datetime), duration_min and a datetime created_at, so date
+# filters run as indexed ranges. Older documents are converted in batches by
+# migrate_appointment_time_fields(); its progress lives in the migrations
+# collection, so an interrupted run resumes after the last converted _id.
+APPOINTMENT_TIME_MIGRATION = "appointment_time_fields"
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+MIGRATION_PROJECTION = {
+    "appointment_date": 1, "appointment_time": 1, "session_duration": 1,
+    "start_at": 1, "duration_min": 1, "created_at": 1, "id": 1
+}
+
+# Filters keep using the date strings until every appointment has start_at
+appointment_time_fields_ready = False
+appointment_migration_task = None
+
+def appointment_start_at(appointment_date, appointment_time):
+    """UTC start of a session booked as a VET date and "HH:MM" time"""
+    local = datetime.strptime(f"{appointment_date} {appointment_time}", "%Y-%m-%d %H:%M")
+    return VET.localize(local).astimezone(timezone.utc)
+
+def vet_day_start(date, days=0):
+    """UTC instant at which a VET calendar date (plus days) begins"""
+    local = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=days)
+    return VET.localize(local).astimezone(timezone.utc)
+
+def parse_created_at(value):
+    # Written by datetime.now(VET).isoformat(), so normally offset-aware
+    created_at = datetime.fromisoformat(value)
+    if created_at.tzinfo is None:
+        created_at = VET.localize(created_at)
+    return created_at.astimezone(timezone.utc)
+
+def typed_time_fields(appointment):
+    """$set converting one appointment's legacy fields; empty when already converted"""
+    update = {}
+    if "start_at" not in appointment:
+        update["start_at"] = appointment_start_at(appointment["appointment_date"], appointment["appointment_time"])
+    if "duration_min" not in appointment:
+        update["duration_min"] = session_minutes(appointment.get("session_duration"))
+    if isinstance(appointment.get("created_at"), str):
+        update["created_at"] = parse_created_at(appointment["created_at"])
+    return update
+
+async def migrate_appointment_time_fields(batch_size=MIGRATION_BATCH_SIZE, log=print):
+    """Backfill start_at/duration_min/created_at in _id order, one bulk_write per batch"""
+    global appointment_time_fields_ready
+    progress = await db.migrations.find_one({"_id": APPOINTMENT_TIME_MIGRATION}) or {}
+    if progress.get("status") == "complete":
+        appointment_time_fields_ready = True
+        return progress
+    
+    now = datetime.now(timezone.utc)
+    await db.migrations.update_one(
+        {"_id": APPOINTMENT_TIME_MIGRATION},
+        {
+            "$set": {"status": "running", "updated_at": now},
+            "$setOnInsert": {"started_at": now, "converted": 0, "skipped": 0}
+        },
+        upsert=True
+    )
+    last_id = progress.get("last_id")
+    if last_id is not None:
+        log(f"Resuming {APPOINTMENT_TIME_MIGRATION} after _id {last_id}")
+    
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db.appointments.find(query, MIGRATION_PROJECTION).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+        
+        updates = []
+        skipped = []
+        for appointment in batch:
+            try:
+                update = typed_time_fields(appointment)
+            except (KeyError, TypeError, ValueError):
+                # Unparseable legacy date/time: left for Liz to fix by hand
+                skipped.append(appointment.get("id") or str(appointment["_id"]))
+                continue
+            if update:
+                updates.append(UpdateOne({"_id": appointment["_id"]}, {"$set": update}))
+        if updates:
+            await db.appointments.bulk_write(updates, ordered=False)
         
+        last_id = batch[-1]["_id"]
+        progress_update = {
+            "$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)},
+            "$inc": {"converted": len(updates), "skipped": len(skipped)}
+        }
+        if skipped:
+            progress_update["$push"] = {"skipped_ids": {"$each": skipped, "$slice": -100}}
+        await db.migrations.update_one({"_id": APPOINTMENT_TIME_MIGRATION}, progress_update)
+        log(f"{APPOINTMENT_TIME_MIGRATION}: converted {len(updates)}, skipped {len(skipped)} up to _id {last_id}")
+    
+    progress = await db.migrations.find_one_and_update(
+        {"_id": APPOINTMENT_TIME_MIGRATION},
+        {"$set": {"status": "complete", "completed_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    appointment_time_fields_ready = True
+    return progress
+
+async def run_appointment_time_migration():
+    try:
+        await migrate_appointment_time_fields()
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        print(f"Error sending emails: {str(e)}")
+        # Resumes from the recorded progress on the next start
+        print(f"Warning: appointment time migration failed: {str(e)}")
 
-@app.get("/api/appointments")
-async def get_appointments():
-    """Get all appointments (for admin panel)"""
-    appointments = await db.appointments.find().to_list(1000)
-    # Convert ObjectId to string for JSON serialization
-    for appointment in appointments:
-        if '_id' in appointment:
-            appointment['_id'] = str(appointment['_id'])
+@app.on_event("startup")
+async def start_appointment_time_migration():
+    global appointment_migration_task
+    appointment_migration_task = asyncio.create_task(run_appointment_time_migration())
+
+@app.on_event("shutdown")
+async def stop_appointment_time_migration():
+    if appointment_migration_task:
+        appointment_migration_task.cancel()
+
+# Appointment listing: keyset pagination on (created_at, id), newest first
+# Only the AppointmentOut fields are loaded; never _id or legacy inline receipts
+APPOINTMENT_LIST_PROJECTION = {"_id": 0, **{field: 1 for field in AppointmentOut.model_fields}}
+APPOINTMENT_SORT = [("created_at", -1), ("id", -1)]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_appointment_cursor(appointment):
+    # Extended JSON keeps datetime created_at values typed through the round trip
+    raw = json_util.dumps([appointment.get("created_at"), appointment.get("id")])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_appointment_cursor(cursor):
+    try:
+        created_at, appointment_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return created_at, appointment_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def appointment_date_filter(date_from=None, date_to=None):
+    """Inclusive VET date range, as a start_at range once the migration has finished"""
+    date_range = {}
+    if date_from:
+        date_range["$gte"] = date_from
+    if date_to:
+        date_range["$lte"] = date_to
+    if not appointment_time_fields_ready:
+        return {"appointment_date": date_range}
+    
+    start_at = {}
+    try:
+        if date_from:
+            start_at["$gte"] = vet_day_start(date_from)
+        if date_to:
+            start_at["$lt"] = vet_day_start(date_to, days=1)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+    # Appointments the migration skipped (unparseable date or time) have no start_at and
+    # are matched by their date string; start_at null is one bound of the start_at index
+    return {"$or": [{"start_at": start_at}, {"start_at": None, "appointment_date": date_range}]}
+
+def build_appointment_filter(status=None, payment_method=None, date_from=None, date_to=None):
+    """Mongo filter for the admin list/export filters; status accepts a comma-separated list"""
+    query = {}
+    if status:
+        query["status"] = {"$in": status.split(",")}
+    if payment_method:
+        query["payment_method"] = payment_method
+    if date_from or date_to:
+        query.update(appointment_date_filter(date_from, date_to))
+    return query
+
+def appointment_sort_key(appointment):
+    """(created_at, id) in MongoDB's order for APPOINTMENT_SORT: datetimes rank above strings"""
+    created_at = appointment.get("created_at")
+    if isinstance(created_at, datetime):
+        return (2, created_at, appointment.get("id") or "")
+    if isinstance(created_at, str):
+        return (1, created_at, appointment.get("id") or "")
+    return (0, "", appointment.get("id") or "")
+
+def appointment_collections(include_archived):
+    return [db.appointments, db.appointments_archive] if include_archived else [db.appointments]
+
+async def next_or_none(cursor):
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def merge_appointment_cursors(cursors):
+    """Merge cursors that are each sorted by APPOINTMENT_SORT into one newest-first stream"""
+    heads = [await next_or_none(cursor) for cursor in cursors]
+    while True:
+        candidates = [index for index, head in enumerate(heads) if head is not None]
+        if not candidates:
+            return
+        newest = max(candidates, key=lambda index: appointment_sort_key(heads[index]))
+        yield heads[newest]
+        heads[newest] = await next_or_none(cursors[newest])
+
+async def list_appointments_page(query, limit, cursor=None, include_archived=False):
+    """One page of appointments plus the cursor of the next page (None on the last page)"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        created_at, appointment_id = decode_appointment_cursor(cursor)
+        after_cursor = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": appointment_id}}
+        ]
+        if isinstance(created_at, datetime):
+            # Unconverted string created_at values sort after every datetime
+            after_cursor.append({"created_at": {"$type": "string"}})
+        query = {"$and": [query, {"$or": after_cursor}]}
+    
+    # Fetch one extra row to learn whether another page exists
+    pages = await asyncio.gather(*[
+        collection.find(query, APPOINTMENT_LIST_PROJECTION).sort(APPOINTMENT_SORT).to_list(limit + 1)
+        for collection in appointment_collections(include_archived)
+    ])
+    appointments = pages[0]
+    if include_archived:
+        appointments = sorted(pages[0] + pages[1], key=appointment_sort_key, reverse=True)[:limit + 1]
+    next_cursor = encode_appointment_cursor(appointments[limit - 1]) if len(appointments) > limit else None
+    return appointments[:limit], next_cursor
+
+@app.get("/api/appointments", response_model=List[AppointmentOut], response_model_exclude_none=True)
+async def get_appointments(
+    response: Response,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+):
+    """Get appointments one page at a time; the next page cursor is in X-Next-Cursor"""
+    appointments, next_cursor = await list_appointments_page({}, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return appointments
 
-@app.get("/api/admin/appointments")
-async def get_admin_appointments(admin: str = Depends(get_admin_user)):
-    """Get all appointments with admin authentication"""
-    appointments = await db.appointments.find().sort("created_at", -1).to_list(1000)
-    # Convert ObjectId to string for JSON serialization
-    for appointment in appointments:
-        if '_id' in appointment:
-            appointment['_id'] = str(appointment['_id'])
+@app.get("/api/admin/appointments", response_model=List[AppointmentOut], response_model_exclude_none=True)
+async def get_admin_appointments(
+    response: Response,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    include_archived: bool = False,
+    admin: str = Depends(get_admin_user)
+):
+    """Get appointments with admin authentication, newest first, one page at a time.
+    
+    Filters apply server-side; pass the X-Next-Cursor response header back as
+    ?cursor= to fetch the following page. include_archived=true also lists
+    appointments moved to appointments_archive.
+    """
+    query = build_appointment_filter(status, payment_method, date_from, date_to)
+    appointments, next_cursor = await list_appointments_page(query, limit, cursor, include_archived)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return appointments
 
 @app.put("/api/admin/appointments/{appointment_id}/confirm-zelle")
 async def confirm_zelle_payment(appointment_id: str, admin: str = Depends(get_admin_user)):
     """Confirm Zelle payment for an appointment"""
     try:
-        result = await db.appointments.update_one(
+        previous = await db.appointments.find_one(
             {"id": appointment_id},
-            {"$set": {
-                "status": "confirmed",
-                "admin_confirmed_at": datetime.now(VET).isoformat(),
-                "admin_confirmed_by": admin
-            }}
+            {"_id": 0, "id": 1, "appointment_time": 1, "session_duration": 1, **STATS_FIELDS}
         )
-        
-        if result.modified_count == 0:
+        if previous is None:
             raise HTTPException(status_code=404, detail="Appointment not found")
         
+        await make_hold_permanent(previous)
+        before = await db.appointments.find_one_and_update(
+            {"id": appointment_id, "status": {"$ne": "confirmed"}},
+            {
+                "$set": {
+                    "status": "confirmed",
+                    "admin_confirmed_at": datetime.now(VET).isoformat(),
+                    "admin_confirmed_by": admin
+                },
+                "$unset": {"hold_expires_at": ""}
+            },
+            projection={"_id": 0, "id": 1, **STATS_FIELDS},
+            return_document=ReturnDocument.BEFORE
+        )
+        availability_cache.invalidate(previous["appointment_date"])
+        # None when an upload or another confirm got there first and already counted it
+        if before is not None:
+            await record_stats_transition(before, {**before, "status": "confirmed"})
+        
         return {"message": "Zelle payment confirmed successfully"}
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="This time slot has been taken by another booking")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/admin/appointments/{appointment_id}")
 async def delete_appointment(appointment_id: str, admin: str = Depends(get_admin_user)):
-    """Delete an appointment"""
+    """Delete an appointment, archived or not"""
     try:
-        result = await db.appointments.delete_one({"id": appointment_id})
+        projection = {"_id": 0, "id": 1, "appointment_time": 1, **STATS_FIELDS, **RECEIPT_FIELDS}
+        appointment = await db.appointments.find_one_and_delete({"id": appointment_id}, projection=projection)
+        archived = appointment is None
+        if archived:
+            appointment = await db.appointments_archive.find_one_and_delete({"id": appointment_id}, projection=projection)
         
-        if result.deleted_count == 0:
+        if appointment is None:
             raise HTTPException(status_code=404, detail="Appointment not found")
+        await release_slot(appointment)
+        await record_stats_transition(appointment, None)
+        if archived:
+            await record_archived_stats([appointment], -1)
+        await delete_receipt(appointment)
         
         return {"message": "Appointment deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Appointment export
+EXPORT_COLUMNS = [
+    ("Date", "appointment_date"), ("Time", "appointment_time"), ("Name", "full_name"),
+    ("Email", "email"), ("WhatsApp", "whatsapp"), ("Payment Method", "payment_method"),
+    ("Status", "status"), ("Created At", "created_at")
+]
+EXPORT_BATCH_SIZE = 500
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def stream_appointments_csv(cursor):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    rows = 0
+    async for apt in cursor:
+        writer.writerow([export_value(apt.get(field, "")) for _, field in EXPORT_COLUMNS])
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+async def stream_appointments_ndjson(cursor):
+    lines = []
+    async for apt in cursor:
+        lines.append(json.dumps(apt, ensure_ascii=False, default=lambda value: str(export_value(value))))
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
 @app.get("/api/admin/appointments/export")
-async def export_appointments(admin: str = Depends(get_admin_user)):
-    """Export appointments as CSV data"""
-    appointments = await db.appointments.find().sort("created_at", -1).to_list(1000)
+async def export_appointments(
+    export_format: str = Query("csv", alias="format"),
+    status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    include_archived: bool = False,
+    admin: str = Depends(get_admin_user)
+):
+    """Stream appointments as a CSV or NDJSON download, optionally with archived ones"""
+    if export_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    
+    query = build_appointment_filter(status, payment_method, date_from, date_to)
+    if export_format == "csv":
+        projection = {"_id": 0, **{field: 1 for _, field in EXPORT_COLUMNS}}
+    else:
+        projection = {"_id": 0, "zelle_receipt": 0}
+    cursors = [
+        collection.find(query, projection).sort(APPOINTMENT_SORT).batch_size(EXPORT_BATCH_SIZE)
+        for collection in appointment_collections(include_archived)
+    ]
+    cursor = merge_appointment_cursors(cursors) if include_archived else cursors[0]
+    
+    filename = f"citas_{datetime.now(VET).date().isoformat()}.{export_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if export_format == "csv":
+        return StreamingResponse(stream_appointments_csv(cursor), media_type="text/csv", headers=headers)
+    return StreamingResponse(stream_appointments_ndjson(cursor), media_type="application/x-ndjson", headers=headers)
+
+# Appointment statistics. STATS_MODE="aggregate" computes them with one aggregation
+# per request; "counters" keeps them materialized in stats_counters, updated by the
+# booking handlers, so the dashboard never rescans appointments.
+STATS_MODE = os.getenv("STATS_MODE", "aggregate")
+STATS_FIELDS = {"appointment_date": 1, "status": 1, "payment_method": 1, "session_price": 1}
+PENDING_STATUSES = ["pending", "awaiting_payment_proof"]
+
+def stats_increments(appointment, sign):
+    """$inc fields adding (sign=1) or removing (sign=-1) one appointment's contribution"""
+    increments = {
+        "total": sign,
+        f"status.{appointment.get('status')}": sign,
+        f"payment_method.{appointment.get('payment_method')}": sign
+    }
+    if appointment.get("status") == "confirmed":
+        increments["revenue"] = sign * float(appointment.get("session_price") or 0)
+    return increments
+
+async def record_stats_transition(before, after):
+    """Move an appointment's contribution in the materialized counters from before to after.
     
-    csv_data = "Date,Time,Name,Email,WhatsApp,Payment Method,Status,Created At\n"
-    for apt in appointments:
-        csv_data += f"{apt.get('appointment_date', '')},{apt.get('appointment_time', '')},{apt.get('full_name', '')},{apt.get('email', '')},{apt.get('whatsapp', '')},{apt.get('payment_method', '')},{apt.get('status', '')},{apt.get('created_at', '')}\n"
+    Either side may be None for inserts and deletes.
+    """
+    if STATS_MODE != "counters":
+        return
+    totals = {}
+    by_day = {}
+    for appointment, sign in ((before, -1), (after, 1)):
+        if appointment is None:
+            continue
+        day_increments = by_day.setdefault(appointment.get("appointment_date"), {})
+        for field, value in stats_increments(appointment, sign).items():
+            totals[field] = totals.get(field, 0) + value
+            day_increments[field] = day_increments.get(field, 0) + value
     
-    return {"csv_data": csv_data}
+    try:
+        totals = {field: value for field, value in totals.items() if value}
+        if totals:
+            await db.stats_counters.update_one({"_id": "totals"}, {"$inc": totals}, upsert=True)
+        for date, increments in by_day.items():
+            increments = {field: value for field, value in increments.items() if value}
+            if increments:
+                await db.stats_counters.update_one(
+                    {"_id": f"day:{date}"},
+                    {"$inc": increments, "$set": {"date": date}},
+                    upsert=True
+                )
+    except Exception as e:
+        # Counters can be rebuilt; never fail a booking over them
+        print(f"Error updating stats counters: {str(e)}")
+
+def stats_from_counters(counters):
+    status = counters.get("status", {})
+    payment_method = counters.get("payment_method", {})
+    return {
+        "total_appointments": counters.get("total", 0),
+        "confirmed_appointments": status.get("confirmed", 0),
+        "pending_appointments": sum(status.get(name, 0) for name in PENDING_STATUSES),
+        "paypal_appointments": payment_method.get("paypal", 0),
+        "zelle_appointments": payment_method.get("zelle", 0),
+        "confirmed_revenue": round(counters.get("revenue", 0), 2)
+    }
+
+def empty_stats_counters(counter_id, date=None):
+    counters = {"_id": counter_id, "total": 0, "status": {}, "payment_method": {}, "revenue": 0.0}
+    if date is not None:
+        counters["date"] = date
+    return counters
+
+def add_stats_group(counters, group):
+    key = group["_id"]
+    counters["total"] += group["count"]
+    counters["status"][str(key.get("status"))] = counters["status"].get(str(key.get("status")), 0) + group["count"]
+    counters["payment_method"][str(key.get("payment_method"))] = counters["payment_method"].get(str(key.get("payment_method")), 0) + group["count"]
+    counters["revenue"] += group["revenue"]
+
+async def stats_groups(collection):
+    return await collection.aggregate([
+        {"$group": {
+            "_id": {"date": "$appointment_date", "status": "$status", "payment_method": "$payment_method"},
+            "count": {"$sum": 1},
+            "revenue": {"$sum": {"$cond": [{"$eq": ["$status", "confirmed"]}, {"$ifNull": ["$session_price", 0]}, 0]}}
+        }}
+    ]).to_list(None)
+
+async def rebuild_stats_counters():
+    """Recompute stats_counters from the appointments and appointments_archive collections"""
+    hot_groups, archived_groups = await asyncio.gather(
+        stats_groups(db.appointments), stats_groups(db.appointments_archive)
+    )
+    
+    counters = {"totals": empty_stats_counters("totals"), "archived": empty_stats_counters("archived")}
+    for group in hot_groups + archived_groups:
+        date = group["_id"].get("date")
+        day = counters.setdefault(f"day:{date}", empty_stats_counters(f"day:{date}", date))
+        for doc in (counters["totals"], day):
+            add_stats_group(doc, group)
+    # Archived appointments also get their own totals, which aggregate mode adds to its live counts
+    for group in archived_groups:
+        date = group["_id"].get("date")
+        day = counters.setdefault(f"archived_day:{date}", empty_stats_counters(f"archived_day:{date}", date))
+        for doc in (counters["archived"], day):
+            add_stats_group(doc, group)
+    
+    await db.stats_counters.delete_many({})
+    await db.stats_counters.insert_many(list(counters.values()))
+    return counters["totals"]
+
+def counter_days_query(prefix, date_from, date_to):
+    query = {"_id": {"$regex": f"^{prefix}:"}}
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lte"] = date_to
+    return query
+
+async def revenue_series(date_from, date_to):
+    """Daily appointment counts and confirmed revenue keyed by appointment date"""
+    if STATS_MODE == "counters":
+        query = counter_days_query("day", date_from, date_to)
+        days = await db.stats_counters.find(query, {"_id": 0, "date": 1, "total": 1, "revenue": 1}).sort("date", 1).to_list(None)
+        return [{"date": day["date"], "appointments": day.get("total", 0), "revenue": round(day.get("revenue", 0), 2)} for day in days]
+    
+    pipeline = []
+    if date_from or date_to:
+        pipeline.append({"$match": appointment_date_filter(date_from, date_to)})
+    pipeline += [
+        {"$group": {
+            "_id": "$appointment_date",
+            "appointments": {"$sum": 1},
+            "revenue": {"$sum": {"$cond": [{"$eq": ["$status", "confirmed"]}, {"$ifNull": ["$session_price", 0]}, 0]}}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    days = {day["_id"]: day for day in await db.appointments.aggregate(pipeline).to_list(None)}
+    # Archived appointments no longer match the pipeline; their per-day counters stand in
+    archived_days = await db.stats_counters.find(
+        counter_days_query("archived_day", date_from, date_to), {"_id": 0, "date": 1, "total": 1, "revenue": 1}
+    ).to_list(None)
+    for archived in archived_days:
+        day = days.setdefault(archived["date"], {"_id": archived["date"], "appointments": 0, "revenue": 0.0})
+        day["appointments"] += archived.get("total", 0)
+        day["revenue"] += archived.get("revenue", 0)
+    return [
+        {"date": date, "appointments": day["appointments"], "revenue": round(day["revenue"], 2)}
+        for date, day in sorted(days.items())
+    ]
+
+@app.on_event("startup")
+async def ensure_stats_counters():
+    if STATS_MODE != "counters":
+        return
+    try:
+        if await db.stats_counters.find_one({"_id": "totals"}, {"_id": 1}) is None:
+            await rebuild_stats_counters()
+    except Exception as e:
+        print(f"Warning: could not initialize stats counters: {str(e)}")
 
 @app.get("/api/admin/stats")
-async def get_admin_stats(admin: str = Depends(get_admin_user)):
-    """Get appointment statistics"""
+async def get_admin_stats(
+    series: bool = False,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    admin: str = Depends(get_admin_user)
+):
+    """Get appointment statistics, optionally with a per-day revenue series"""
+    try:
+        if STATS_MODE == "counters":
+            counters = await db.stats_counters.find_one({"_id": "totals"}) or await rebuild_stats_counters()
+            stats = stats_from_counters(counters)
+        else:
+            # All counts in a single pass over the collection
+            result = await db.appointments.aggregate([
+                {"$group": {
+                    "_id": None,
+                    "total_appointments": {"$sum": 1},
+                    "confirmed_appointments": {"$sum": {"$cond": [{"$eq": ["$status", "confirmed"]}, 1, 0]}},
+                    "pending_appointments": {"$sum": {"$cond": [{"$in": ["$status", PENDING_STATUSES]}, 1, 0]}},
+                    "paypal_appointments": {"$sum": {"$cond": [{"$eq": ["$payment_method", "paypal"]}, 1, 0]}},
+                    "zelle_appointments": {"$sum": {"$cond": [{"$eq": ["$payment_method", "zelle"]}, 1, 0]}},
+                    "confirmed_revenue": {"$sum": {"$cond": [{"$eq": ["$status", "confirmed"]}, {"$ifNull": ["$session_price", 0]}, 0]}}
+                }},
+                {"$project": {"_id": 0}}
+            ]).to_list(1)
+            stats = result[0] if result else stats_from_counters({})
+            archived = await db.stats_counters.find_one({"_id": "archived"})
+            if archived:
+                for field, value in stats_from_counters(archived).items():
+                    stats[field] += value
+            stats["confirmed_revenue"] = round(stats["confirmed_revenue"], 2)
+        
+        if series:
+            stats["revenue_by_day"] = await revenue_series(date_from, date_to)
+        return stats
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/stats/rebuild")
+async def rebuild_admin_stats(admin: str = Depends(get_admin_user)):
+    """Recompute the materialized stats counters from scratch"""
     try:
-        total_appointments = await db.appointments.count_documents({})
-        confirmed_appointments = await db.appointments.count_documents({"status": "confirmed"})
-        pending_appointments = await db.appointments.count_documents({"status": {"$in": ["pending", "awaiting_payment_proof"]}})
-        paypal_appointments = await db.appointments.count_documents({"payment_method": "paypal"})
-        zelle_appointments = await db.appointments.count_documents({"payment_method": "zelle"})
+        totals = await rebuild_stats_counters()
+        return {"message": "Stats counters rebuilt", **stats_from_counters(totals)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Archiving: past, finalized appointments older than ARCHIVE_AFTER_DAYS move to
+# appointments_archive in batches, keeping the hot collection (and every scan
+# of it) bounded. Each batch is copied, counted into the "archived" stats
+# counters, then deleted; a copy left by an interrupted run is skipped as a
+# duplicate, so nothing is archived or counted twice. Their slot holds are
+# deleted. Receipt files stay in the receipt store; the archived document keeps
+# the references.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "120"))  # 0 disables the schedule
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVABLE_STATUSES = ["confirmed", "expired", "failed"]
+
+async def record_archived_stats(appointments, sign=1):
+    """Add (sign=1) or remove (sign=-1) appointments in the archived totals and per-day counters"""
+    totals = {}
+    by_day = {}
+    for appointment in appointments:
+        day_increments = by_day.setdefault(appointment.get("appointment_date"), {})
+        for field, value in stats_increments(appointment, sign).items():
+            totals[field] = totals.get(field, 0) + value
+            day_increments[field] = day_increments.get(field, 0) + value
+    if totals:
+        await db.stats_counters.update_one({"_id": "archived"}, {"$inc": totals}, upsert=True)
+    for date, increments in by_day.items():
+        await db.stats_counters.update_one(
+            {"_id": f"archived_day:{date}"},
+            {"$inc": increments, "$set": {"date": date}},
+            upsert=True
+        )
+
+async def archive_appointments(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move finalized appointments dated older_than_days or more ago into appointments_archive"""
+    cutoff = (datetime.now(VET).date() - timedelta(days=older_than_days)).isoformat()
+    query = {"status": {"$in": ARCHIVABLE_STATUSES}, **appointment_date_filter(date_to=cutoff)}
+    archived = 0
+    while True:
+        batch = await db.appointments.find(query).limit(batch_size).to_list(None)
+        if not batch:
+            break
         
+        archived_at = datetime.now(timezone.utc)
+        for appointment in batch:
+            appointment["archived_at"] = archived_at
+            try:
+                # Keeps include_archived date filters working for documents the migration missed
+                appointment.update(typed_time_fields(appointment))
+            except (KeyError, TypeError, ValueError):
+                pass
+        
+        inserted = batch
+        try:
+            await db.appointments_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # Already copied (and counted) by an interrupted or concurrent run
+            duplicates = {error["index"] for error in errors}
+            inserted = [appointment for index, appointment in enumerate(batch) if index not in duplicates]
+        await record_archived_stats(inserted)
+        await db.appointments.delete_many({"_id": {"$in": [appointment["_id"] for appointment in batch]}})
+        # Holds of paid bookings never expire; the session is long past, so drop them here
+        await db.slot_holds.delete_many({"appointment_id": {"$in": [appointment["id"] for appointment in batch]}})
+        archived += len(inserted)
+        if len(batch) < batch_size:
+            break
+    return {"archived": archived, "cutoff": cutoff}
+
+async def run_archive_schedule():
+    while True:
+        try:
+            result = await archive_appointments()
+            if result["archived"]:
+                print(f"Archived {result['archived']} appointments dated on or before {result['cutoff']}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error archiving appointments: {str(e)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+archive_task = None
+
+@app.on_event("startup")
+async def start_archive_schedule():
+    global archive_task
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive_task = asyncio.create_task(run_archive_schedule())
+
+@app.on_event("shutdown")
+async def stop_archive_schedule():
+    if archive_task:
+        archive_task.cancel()
+
+@app.post("/api/admin/archive/run")
+async def run_archive(older_than_days: Optional[int] = None, admin: str = Depends(get_admin_user)):
+    """Archive finalized appointments dated older_than_days (default ARCHIVE_AFTER_DAYS) or more ago, now"""
+    if older_than_days is None:
+        older_than_days = ARCHIVE_AFTER_DAYS
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+    try:
+        result = await archive_appointments(older_than_days)
         return {
-            "total_appointments": total_appointments,
-            "confirmed_appointments": confirmed_appointments,
-            "pending_appointments": pending_appointments,
-            "paypal_appointments": paypal_appointments,
-            "zelle_appointments": zelle_appointments
+            "message": f"Archived {result['archived']} appointments dated on or before {result['cutoff']}",
+            **result,
+            "hot_appointments": await db.appointments.estimated_document_count(),
+            "archived_appointments": await db.appointments_archive.estimated_document_count()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/cache-stats")
+async def get_cache_stats(admin: str = Depends(get_admin_user)):
+    """Get in-process availability cache counters"""
+    return {"availability": availability_cache.stats()}
+
 @app.get("/api/admin/settings")
 async def get_admin_settings(admin: str = Depends(get_admin_user)):
     """Get admin settings"""
     try:
-        settings = await db.settings.find_one({"type": "zelle_config"})
-        if not settings:
+        settings = await get_settings_snapshot()
+        if not settings.stored:
             # Create default settings if none exist
             default_settings = {
-                "type": "zelle_config",
-                "zelle_email": os.getenv('ZELLE_EMAIL', 'psicolizparra@gmail.com'),
-                "consultation_price": 50.00,
-                "half_hour_extension": 25.00,
-                "full_hour_extension": 45.00,
+                "version": 0,
+                **settings.public_fields(),
                 "created_at": datetime.now(VET).isoformat()
             }
-            await db.settings.insert_one(default_settings)
-            return {
-                "zelle_email": default_settings["zelle_email"],
-                "consultation_price": default_settings["consultation_price"],
-                "half_hour_extension": default_settings["half_hour_extension"],
-                "full_hour_extension": default_settings["full_hour_extension"]
-            }
+            await db.settings.update_one(
+                {"type": "zelle_config"},
+                {"$setOnInsert": default_settings},
+                upsert=True
+            )
+            settings = await load_settings_snapshot()
         
-        return {
-            "zelle_email": settings.get("zelle_email", os.getenv('ZELLE_EMAIL', 'psicolizparra@gmail.com')),
-            "consultation_price": settings.get("consultation_price", 50.00),
-            "half_hour_extension": settings.get("half_hour_extension", 25.00),
-            "full_hour_extension": settings.get("full_hour_extension", 45.00)
-        }
+        return settings.public_fields()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/admin/settings")
 async def update_admin_settings(settings_update: SettingsUpdate, admin: str = Depends(get_admin_user)):
     """Update admin settings"""
+    global settings_snapshot
     try:
         # Validate email format
         if "@" not in settings_update.zelle_email or "." not in settings_update.zelle_email:
@@ -632,57 +3948,60 @@ async def update_admin_settings(settings_update: SettingsUpdate, admin: str = De
             raise HTTPException(status_code=400, detail="Full hour extension price cannot be negative")
         
         # Update or create settings
-        result = await db.settings.update_one(
+        settings = await db.settings.find_one_and_update(
             {"type": "zelle_config"},
-            {"$set": {
-                "zelle_email": settings_update.zelle_email,
-                "consultation_price": settings_update.consultation_price,
-                "half_hour_extension": settings_update.half_hour_extension,
-                "full_hour_extension": settings_update.full_hour_extension,
-                "updated_at": datetime.now(VET).isoformat(),
-                "updated_by": admin
-            }},
-            upsert=True
+            {
+                "$set": {
+                    "zelle_email": settings_update.zelle_email,
+                    "consultation_price": settings_update.consultation_price,
+                    "half_hour_extension": settings_update.half_hour_extension,
+                    "full_hour_extension": settings_update.full_hour_extension,
+                    "updated_at": datetime.now(VET).isoformat(),
+                    "updated_by": admin
+                },
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
         
+        # Swap in the new snapshot in one assignment, then tell the other workers
+        settings_snapshot = SettingsSnapshot.from_document(settings)
+        await bump_config_version()
+        
         return {
             "message": "Settings updated successfully",
-            "zelle_email": settings_update.zelle_email,
-            "consultation_price": settings_update.consultation_price,
-            "half_hour_extension": settings_update.half_hour_extension,
-            "full_hour_extension": settings_update.full_hour_extension
+            **settings_snapshot.public_fields()
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/admin/schedule")
+@app.get("/api/admin/schedule", response_model=AdminScheduleOut)
 async def get_admin_schedule(admin: str = Depends(get_admin_user)):
     """Get current weekly schedule and custom overrides"""
     try:
-        # Get current default schedule
-        schedule_settings = await db.settings.find_one({"type": "weekly_schedule"})
-        
-        if not schedule_settings:
-            # Create default schedule if none exists
-            default_schedule_settings = {
-                "type": "weekly_schedule",
-                "schedule": DEFAULT_SCHEDULE,
-                "created_at": datetime.now(VET).isoformat()
-            }
-            await db.settings.insert_one(default_schedule_settings)
-            current_schedule = DEFAULT_SCHEDULE
-        else:
-            current_schedule = schedule_settings.get("schedule", DEFAULT_SCHEDULE)
+        # Get current default schedule, creating it if none exists; an upsert, so two
+        # first visits racing on the unique settings.type index both succeed
+        schedule_settings = await db.settings.find_one_and_update(
+            {"type": "weekly_schedule"},
+            {"$setOnInsert": {"schedule": DEFAULT_SCHEDULE, "created_at": datetime.now(VET).isoformat()}},
+            projection={"_id": 0, "schedule": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        current_schedule = schedule_settings.get("schedule", DEFAULT_SCHEDULE)
         
         # Get custom schedule overrides for the next 60 days
         today = datetime.now(VET).date()
         end_date = today + timedelta(days=60)
         
-        custom_schedules = await db.custom_schedules.find({
-            "date": {"$gte": today.isoformat(), "$lte": end_date.isoformat()}
-        }).to_list(100)
+        custom_schedules = await db.custom_schedules.find(
+            {"date": {"$gte": today.isoformat(), "$lte": end_date.isoformat()}},
+            {"_id": 0}
+        ).to_list(100)
         
         return {
             "weekly_schedule": current_schedule,
@@ -718,6 +4037,10 @@ async def update_weekly_schedule(schedule_update: dict, admin: str = Depends(get
             }},
             upsert=True
         )
+        compiled_schedule.set_weekly(schedule_update)
+        availability_cache.clear()
+        await bump_config_version()
+        await publish_availability_event("schedule_changed", None)
         
         return {"message": "Weekly schedule updated successfully"}
     except HTTPException:
@@ -754,6 +4077,10 @@ async def update_custom_schedule(custom_schedule: CustomSchedule, admin: str = D
             }},
             upsert=True
         )
+        compiled_schedule.set_override(custom_schedule.date, custom_schedule.available_times, custom_schedule.is_available)
+        availability_cache.invalidate(custom_schedule.date)
+        await bump_config_version()
+        await publish_availability_event("schedule_changed", custom_schedule.date)
         
         return {"message": f"Custom schedule updated for {custom_schedule.date}"}
     except HTTPException:
@@ -769,6 +4096,10 @@ async def delete_custom_schedule(date: str, admin: str = Depends(get_admin_user)
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Custom schedule not found for this date")
+        compiled_schedule.remove_override(date)
+        availability_cache.invalidate(date)
+        await bump_config_version()
+        await publish_availability_event("schedule_changed", date)
         
         return {"message": f"Custom schedule deleted for {date}. Reverted to weekly default."}
     except HTTPException:
@@ -776,6 +4107,68 @@ async def delete_custom_schedule(date: str, admin: str = Depends(get_admin_user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/email-outbox")
+async def get_email_outbox(admin: str = Depends(get_admin_user)):
+    """Get email outbox counts per status and the most recent dead messages"""
+    try:
+        counts = await db.email_outbox.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        dead = await db.email_outbox.find(
+            {"status": "dead"},
+            {"_id": 0, "html": 0}
+        ).sort("created_at", -1).to_list(20)
+        return {"counts": {entry["_id"]: entry["count"] for entry in counts}, "dead": dead}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/email-outbox/retry-dead")
+async def retry_dead_emails(admin: str = Depends(get_admin_user)):
+    """Requeue every dead message for another round of delivery attempts"""
+    try:
+        result = await db.email_outbox.update_many(
+            {"status": "dead"},
+            {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}}
+        )
+        email_worker.wake()
+        return {"message": f"Requeued {result.modified_count} emails"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/admin/diagnostics/query-plans")
+async def get_query_plans(admin: str = Depends(get_admin_user)):
+    """Explain the hot queries and report any that fall back to a collection scan"""
+    try:
+        report = await explain_hot_queries()
+        return {"collscans": sum(1 for entry in report if entry["collscan"]), "queries": report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def run_cli_command(command):
+    if command == "ensure-indexes":
+        await ensure_indexes()
+        print("Indexes ensured")
+        return 0
+    if command == "explain-queries":
+        report = await explain_hot_queries()
+        for entry in report:
+            marker = "COLLSCAN" if entry["collscan"] else "ok"
+            print(f"[{marker}] {entry['collection']}: {entry['query']} -> {' > '.join(entry['stages'])}")
+        return 1 if any(entry["collscan"] for entry in report) else 0
+    if command == "migrate-appointment-times":
+        await ensure_indexes()
+        progress = await migrate_appointment_time_fields()
+        print(f"Migration {progress['status']}: {progress.get('converted', 0)} converted, {progress.get('skipped', 0)} skipped")
+        return 1 if progress.get("skipped") else 0
+    raise ValueError(f"Unknown command: {command}")
+
+CLI_COMMANDS = ["ensure-indexes", "explain-queries", "migrate-appointment-times"]
+
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        # e.g. `python server.py explain-queries`; exits non-zero on any COLLSCAN
+        sys.exit(asyncio.run(run_cli_command(sys.argv[1])))
+    
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
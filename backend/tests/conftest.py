@@ -0,0 +1,94 @@
+"""Fixtures running the API against an in-memory MongoDB (mongomock-motor).
+
+Run from backend/ with: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# Set before server is imported so .env never points the tests at real services
+os.environ.update({
+    "MONGO_URL": "mongodb://localhost:27017",
+    "SMTP_SERVER": "",
+    "RECEIPT_STORAGE": "local",
+    "RECEIPT_DIR": tempfile.mkdtemp(prefix="psicoliz-receipts-"),
+    "RATE_LIMIT_BACKEND": "off",
+    "CONFIG_SYNC_MODE": "poll",
+    "AVAILABILITY_FANOUT_MODE": "off",
+    "ARCHIVE_AFTER_DAYS": "0",
+    "HOLD_SWEEP_SECONDS": "3600",
+    # Each test starts the app; only the receipt tests need a worker process
+    "RECEIPT_WORKER_WARMUP": "false",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+AUTH = ("liz", "psico2024")
+BOOKING_DATE = "2030-01-07"  # a Monday, open 09:00-12:00 and 14:00-17:00 by default
+
+def booking(**overrides):
+    return {
+        "full_name": "Ana Pérez",
+        "email": "ana@example.com",
+        "whatsapp": "+58 412-000-0000",
+        "appointment_date": BOOKING_DATE,
+        "appointment_time": "09:00",
+        "payment_method": "zelle",
+        **overrides
+    }
+
+class FakePayPal:
+    """Stands in for PayPalGateway; set create_result/execute_result to a value or an exception"""
+
+    def __init__(self):
+        self.create_result = None
+        self.execute_result = True
+        self.created = 0
+
+    async def create_payment(self, payment_data):
+        if isinstance(self.create_result, Exception):
+            raise self.create_result
+        if self.create_result is not None:
+            return self.create_result
+        self.created += 1
+        payment_id = f"PAY-{self.created}"
+        return SimpleNamespace(
+            id=payment_id,
+            links=[SimpleNamespace(rel="approval_url", href=f"https://paypal.test/approve/{payment_id}")]
+        )
+
+    async def execute_payment(self, payment_id, payer_id):
+        if isinstance(self.execute_result, Exception):
+            raise self.execute_result
+        return self.execute_result
+
+@pytest.fixture
+def paypal(monkeypatch):
+    fake = FakePayPal()
+    monkeypatch.setattr(server.paypal_gateway, "create_payment", fake.create_payment)
+    monkeypatch.setattr(server.paypal_gateway, "execute_payment", fake.execute_payment)
+    return fake
+
+@pytest.fixture
+def client(monkeypatch):
+    mongo = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", mongo)
+    monkeypatch.setattr(server, "db", mongo.psicoliz)
+    monkeypatch.setattr(server, "settings_snapshot", None)
+    monkeypatch.setattr(server, "compiled_schedule", server.CompiledSchedule())
+    monkeypatch.setattr(server, "idempotency_cache", server.IdempotencyCache(server.IDEMPOTENCY_CACHE_SIZE))
+    server.availability_cache.clear()
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop, e.g. run(server.expire_unpaid_bookings)"""
+    return client.portal.call
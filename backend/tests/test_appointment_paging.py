@@ -0,0 +1,97 @@
+"""Keyset-cursor paging of the appointment lists"""
+from datetime import datetime, timedelta
+
+import server
+from conftest import AUTH
+
+def appointment(index, created_at, status="confirmed"):
+    return {
+        "id": f"appt-{index:02d}",
+        "full_name": f"Client {index}",
+        "email": f"client{index}@example.com",
+        "whatsapp": "+58 412-000-0000",
+        "appointment_date": "2030-01-07",
+        "appointment_time": "09:00",
+        "payment_method": "zelle",
+        "session_price": 50.0,
+        "status": status,
+        "created_at": created_at
+    }
+
+def seed(run, appointments):
+    run(lambda: server.db.appointments.insert_many(appointments))
+
+def collect_pages(client, url, limit, **params):
+    ids = []
+    pages = 0
+    cursor = None
+    while True:
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        response = client.get(url, params=query, auth=AUTH)
+        assert response.status_code == 200
+        ids += [row["id"] for row in response.json()]
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return ids, pages
+
+def test_pages_cover_every_appointment_once_newest_first(client, run):
+    base = datetime(2030, 1, 1, 12)
+    seed(run, [appointment(index, base + timedelta(minutes=index)) for index in range(10)])
+
+    ids, pages = collect_pages(client, "/api/admin/appointments", 3)
+    assert ids == [f"appt-{index:02d}" for index in reversed(range(10))]
+    assert pages == 4
+
+def test_ties_on_created_at_are_broken_by_id(client, run):
+    same_time = datetime(2030, 1, 1, 12)
+    seed(run, [appointment(index, same_time) for index in range(7)])
+
+    ids, _ = collect_pages(client, "/api/admin/appointments", 2)
+    assert ids == [f"appt-{index:02d}" for index in reversed(range(7))]
+
+def test_unmigrated_string_created_at_pages_after_datetimes(client, run):
+    # Legacy rows still carry created_at as a VET ISO string
+    base = datetime(2030, 1, 1, 12)
+    converted = [appointment(index, base + timedelta(minutes=index)) for index in range(5)]
+    legacy = [appointment(index, f"2029-12-0{index - 4}T10:00:00-04:00") for index in range(5, 9)]
+    seed(run, converted + legacy)
+
+    ids, _ = collect_pages(client, "/api/admin/appointments", 3)
+    expected = [f"appt-{index:02d}" for index in reversed(range(5))] + [f"appt-{index:02d}" for index in reversed(range(5, 9))]
+    assert ids == expected
+
+    public_ids, _ = collect_pages(client, "/api/appointments", 4)
+    assert public_ids == expected
+
+def test_filters_apply_on_every_page(client, run):
+    base = datetime(2030, 1, 1, 12)
+    seed(run, [
+        appointment(index, base + timedelta(minutes=index), "confirmed" if index % 2 else "pending")
+        for index in range(12)
+    ])
+
+    ids, _ = collect_pages(client, "/api/admin/appointments", 2, status="confirmed")
+    assert ids == [f"appt-{index:02d}" for index in reversed(range(1, 12, 2))]
+
+def test_last_page_has_no_cursor_and_bad_cursors_are_rejected(client, run):
+    seed(run, [appointment(index, datetime(2030, 1, 1, 12, index)) for index in range(3)])
+
+    response = client.get("/api/admin/appointments", params={"limit": 3}, auth=AUTH)
+    assert len(response.json()) == 3
+    assert "x-next-cursor" not in response.headers
+    assert client.get("/api/admin/appointments", params={"cursor": "not-a-cursor"}, auth=AUTH).status_code == 400
+
+def test_date_filters_keep_appointments_the_migration_skipped(client, run):
+    base = datetime(2030, 1, 1, 12)
+    unparseable = {**appointment(1, base + timedelta(minutes=1)), "appointment_time": "9 am"}
+    seed(run, [appointment(0, base), unparseable, {**appointment(2, base), "appointment_date": "2030-02-04"}])
+
+    # The startup run already finished on the empty database; run it again over the seeded rows
+    run(lambda: server.db.migrations.delete_many({}))
+    progress = run(lambda: server.migrate_appointment_time_fields(log=lambda message: None))
+    assert (progress["converted"], progress["skipped_ids"]) == (2, ["appt-01"])
+    assert server.appointment_time_fields_ready
+
+    ids, _ = collect_pages(client, "/api/admin/appointments", 1, date_from="2030-01-07", date_to="2030-01-07")
+    assert ids == ["appt-01", "appt-00"]
@@ -0,0 +1,122 @@
+"""Duration-aware availability: free intervals, ?duration= and the edges of the schedule"""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from conftest import AUTH, BOOKING_DATE, booking
+
+MONDAY = date(2030, 1, 7)  # default schedule: 09:00-12:00 and 14:00-17:00
+
+def starts(held_times, duration_min):
+    return server.DayAvailability.build(MONDAY, held_times).starts_for(duration_min)
+
+def test_sessions_must_end_inside_a_schedule_block():
+    assert starts([], 60) == ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"]
+    # 11:00 and 16:00 would run past the end of their block
+    assert starts([], 90) == ["09:00", "10:00", "14:00", "15:00"]
+    assert starts([], 120) == ["09:00", "10:00", "14:00", "15:00"]
+
+def test_held_granules_cut_free_intervals():
+    # A standard session booked at 10:00 holds 10:00 and 10:30
+    assert starts(["10:00", "10:30"], 60) == ["09:00", "11:00", "14:00", "15:00", "16:00"]
+    assert starts(["10:00", "10:30"], 90) == ["14:00", "15:00"]
+    # Only the second half hour taken still blocks a session starting at 10:00
+    assert starts(["10:30"], 60) == ["09:00", "11:00", "14:00", "15:00", "16:00"]
+
+def test_holds_at_block_edges():
+    assert starts(["09:00"], 60) == ["10:00", "11:00", "14:00", "15:00", "16:00"]
+    assert starts(["16:30"], 60) == ["09:00", "10:00", "11:00", "14:00", "15:00"]
+    # A hold in the lunch gap does not touch either block
+    assert starts(["12:30"], 120) == ["09:00", "10:00", "14:00", "15:00"]
+
+def test_subtract_intervals_handles_busy_spans_across_blocks():
+    open_intervals = [(540, 720), (840, 1020)]
+    assert server.subtract_intervals(open_intervals, [(700, 860)]) == [(540, 700), (860, 1020)]
+    assert server.subtract_intervals(open_intervals, [(500, 1100)]) == []
+    assert server.subtract_intervals(open_intervals, []) == open_intervals
+
+def test_hold_granules_round_off_grid_starts_outwards():
+    assert server.hold_granules("09:00", 60) == ["09:00", "09:30"]
+    assert server.hold_granules("09:15", 60) == ["09:00", "09:30", "10:00"]
+    assert server.hold_granules("23:00", 60) == ["23:00", "23:30"]
+
+def test_parse_duration():
+    assert server.parse_duration(None) == 60
+    assert server.parse_duration("plus_30min") == 90
+    assert server.parse_duration("120") == 120
+    for invalid in ("45", "abc", "-60"):
+        with pytest.raises(HTTPException) as error:
+            server.parse_duration(invalid)
+        assert error.value.status_code == 400
+
+def test_claim_rejects_sessions_past_midnight(client, run):
+    with pytest.raises(server.SlotUnavailable):
+        run(lambda: server.claim_slot(BOOKING_DATE, "23:30", "late", duration_min=60))
+    assert run(lambda: server.db.slot_holds.count_documents({})) == 0
+
+def test_endpoints_answer_for_the_requested_duration(client):
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="10:00")).status_code == 200
+
+    day = client.get(f"/api/available-slots/{BOOKING_DATE}", params={"duration": "plus_30min"})
+    assert day.json()["available_times"] == ["14:00", "15:00"]
+
+    week = client.get("/api/available-slots", params={"from": BOOKING_DATE, "to": BOOKING_DATE, "duration": "60"}).json()
+    assert week["duration_minutes"] == 60
+    assert week["days"][BOOKING_DATE] == ["09:00", "11:00", "14:00", "15:00", "16:00"]
+    assert client.get(f"/api/available-slots/{BOOKING_DATE}", params={"duration": "45"}).status_code == 400
+
+def test_revalidation_is_answered_from_the_cache(client, monkeypatch):
+    # With cross-worker invalidation on, entries outlive the TTL
+    monkeypatch.setattr(server, "availability_fanout_enabled", True)
+    monkeypatch.setattr(server.availability_cache, "ttl_seconds", 0)
+    url = f"/api/available-slots/{BOOKING_DATE}"
+    first = client.get(url)
+    etag = first.headers["etag"]
+
+    misses = server.availability_cache.misses
+    revalidated = client.get(url, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert server.availability_cache.misses == misses
+    assert client.get(url, params={"duration": "90"}, headers={"If-None-Match": etag}).status_code == 200
+
+    assert client.post("/api/create-zelle-booking", json=booking()).status_code == 200
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert "09:00" not in changed.json()["available_times"]
+
+def test_cache_entries_end_when_a_hold_lapses(monkeypatch):
+    monkeypatch.setattr(server, "availability_fanout_enabled", True)
+    cache = server.AvailabilityCache(ttl_seconds=30, max_dates=8)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    day = server.DayAvailability.build(MONDAY, ["09:00", "09:30"])
+
+    cache.set(BOOKING_DATE, day, cache.token(), [now + timedelta(hours=1)])
+    assert cache.get(BOOKING_DATE) is day
+    cache.set(BOOKING_DATE, day, cache.token(), [now - timedelta(seconds=1)])
+    assert cache.get(BOOKING_DATE) is None
+
+def test_bookings_must_start_on_the_schedule_and_fit_it(client, run):
+    # 11:00 opens a slot, but a 120-minute session would run past 12:00
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="11:00", session_duration="plus_60min")).status_code == 422
+    # Off the schedule's grid, and inside the lunch gap
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="09:30")).status_code == 422
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="12:00")).status_code == 422
+    assert run(lambda: server.db.slot_holds.count_documents({})) == 0
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="11:00")).status_code == 200
+
+def test_first_schedule_visit_creates_the_default_once(client, run):
+    for _ in range(2):
+        response = client.get("/api/admin/schedule", auth=AUTH)
+        assert response.status_code == 200
+        assert response.json()["weekly_schedule"] == server.DEFAULT_SCHEDULE
+    assert run(lambda: server.db.settings.count_documents({"type": "weekly_schedule"})) == 1
+
+def test_schedule_stored_by_another_worker_is_kept(client, run):
+    stored = {**server.DEFAULT_SCHEDULE, "sunday": ["10:00"]}
+    run(lambda: server.db.settings.insert_one({"type": "weekly_schedule", "schedule": stored}))
+
+    assert client.get("/api/admin/schedule", auth=AUTH).json()["weekly_schedule"] == stored
+    assert run(lambda: server.db.settings.count_documents({"type": "weekly_schedule"})) == 1
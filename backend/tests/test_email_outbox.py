@@ -0,0 +1,93 @@
+"""Email outbox delivery: retries with backoff, dead letters and stale claims"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+class FakeSMTP:
+    """Stands in for SMTPSession; errors holds one entry per send, None meaning delivered"""
+
+    def __init__(self):
+        self.errors = []
+        self.sent = []
+
+    def send_batch(self, mime_messages):
+        self.sent += [mime_message["To"] for mime_message in mime_messages]
+        return [self.errors.pop(0) if self.errors else None for _ in mime_messages]
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def worker(client, monkeypatch):
+    outbox_worker = server.EmailOutboxWorker()
+    monkeypatch.setattr(outbox_worker, "_smtp", FakeSMTP())
+    return outbox_worker
+
+def queue_message(run, to="ana@example.com"):
+    run(lambda: server.enqueue_emails([{"kind": "reminder", "to": to, "subject": "Recordatorio", "html": "<p>Hola</p>", "text": "Hola"}]))
+
+def outbox(run):
+    return run(lambda: server.db.email_outbox.find_one({}))
+
+def make_due(run):
+    run(lambda: server.db.email_outbox.update_many({}, {"$set": {"next_attempt_at": datetime.now(timezone.utc)}}))
+
+def test_delivered_message_is_marked_sent(run, worker):
+    queue_message(run)
+    assert run(worker.deliver_batch) == 1
+
+    message = outbox(run)
+    assert (message["status"], message["attempts"]) == ("sent", 1)
+    assert worker._smtp.sent == ["ana@example.com"]
+
+def test_failed_sends_back_off_exponentially(run, worker, monkeypatch):
+    monkeypatch.setattr(server, "EMAIL_RETRY_BASE_SECONDS", 30)
+    worker._smtp.errors = ["421 try later", "421 try later"]
+    queue_message(run)
+
+    delays = []
+    for _ in range(2):
+        started = datetime.now(timezone.utc).replace(tzinfo=None)
+        assert run(worker.deliver_batch) == 1
+        message = outbox(run)
+        assert message["status"] == "pending"
+        delays.append(round((message["next_attempt_at"] - started).total_seconds()))
+        # Not due yet, so nothing is claimed
+        assert run(worker.deliver_batch) == 0
+        make_due(run)
+    assert delays == [30, 60]
+    assert message["last_error"] == "421 try later"
+
+    assert run(worker.deliver_batch) == 1
+    assert outbox(run)["status"] == "sent"
+
+def test_message_is_dead_after_the_last_attempt(run, worker, monkeypatch):
+    monkeypatch.setattr(server, "EMAIL_MAX_ATTEMPTS", 3)
+    worker._smtp.errors = ["550 mailbox unavailable"] * 3
+    queue_message(run)
+
+    for _ in range(3):
+        assert run(worker.deliver_batch) == 1
+        make_due(run)
+    message = outbox(run)
+    assert (message["status"], message["attempts"]) == ("dead", 3)
+    assert run(worker.deliver_batch) == 0
+
+def test_stale_claims_are_requeued_until_the_last_attempt(run, worker, monkeypatch):
+    monkeypatch.setattr(server, "EMAIL_MAX_ATTEMPTS", 3)
+    queue_message(run)
+    long_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    def crash_mid_send():
+        # As left by a worker that claimed the message and died before recording the outcome
+        run(lambda: server.db.email_outbox.update_many({}, {"$set": {"status": "sending", "claimed_at": long_ago}}))
+        run(worker._release_stale_claims)
+        return outbox(run)
+
+    assert (crash_mid_send()["status"], outbox(run)["attempts"]) == ("pending", 1)
+    assert crash_mid_send()["status"] == "pending"
+    message = crash_mid_send()
+    assert (message["status"], message["attempts"]) == ("dead", 3)
+    assert message["last_error"] == "Delivery claim timed out"
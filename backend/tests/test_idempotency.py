@@ -0,0 +1,119 @@
+"""Idempotency-Key replay on booking creation, sequential and concurrent"""
+import asyncio
+
+import httpx
+
+import server
+from conftest import AUTH, booking
+
+def count_appointments(run):
+    return run(lambda: server.db.appointments.count_documents({}))
+
+def post_concurrently(run, requests):
+    async def send():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*[http.post(url, json=body, headers=headers) for url, body, headers in requests])
+    return run(send)
+
+def test_repeated_key_replays_the_first_booking(client, run):
+    headers = {"Idempotency-Key": "booking-1"}
+    first = client.post("/api/create-zelle-booking", json=booking(), headers=headers)
+    second = client.post("/api/create-zelle-booking", json=booking(), headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert count_appointments(run) == 1
+
+def test_replay_survives_another_worker(client, run, monkeypatch):
+    headers = {"Idempotency-Key": "booking-1"}
+    first = client.post("/api/create-zelle-booking", json=booking(), headers=headers).json()
+    # A worker that never saw the request only has the stored response
+    monkeypatch.setattr(server, "idempotency_cache", server.IdempotencyCache(server.IDEMPOTENCY_CACHE_SIZE))
+
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).json() == first
+    assert count_appointments(run) == 1
+
+def test_key_reused_with_a_different_request_is_rejected(client, run):
+    headers = {"Idempotency-Key": "booking-1"}
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).status_code == 200
+
+    response = client.post("/api/create-zelle-booking", json=booking(appointment_time="10:00"), headers=headers)
+    assert response.status_code == 422
+    assert count_appointments(run) == 1
+
+def test_keys_are_scoped_per_endpoint(client, run, paypal):
+    headers = {"Idempotency-Key": "booking-1"}
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).status_code == 200
+
+    response = client.post("/api/create-paypal-order", json=booking(appointment_time="10:00", payment_method="paypal"), headers=headers)
+    assert response.status_code == 200
+    assert count_appointments(run) == 2
+
+def test_concurrent_requests_with_one_key_book_once(client, run):
+    request = ("/api/create-zelle-booking", booking(), {"Idempotency-Key": "booking-1"})
+    responses = post_concurrently(run, [request] * 5)
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert len({response.json()["booking_id"] for response in responses}) == 1
+    assert count_appointments(run) == 1
+
+def test_concurrent_requests_without_a_key_book_the_slot_once(client, run):
+    request = ("/api/create-zelle-booking", booking(), {})
+    responses = post_concurrently(run, [request] * 5)
+
+    assert sorted(response.status_code for response in responses) == [200, 409, 409, 409, 409]
+    assert count_appointments(run) == 1
+
+def test_failed_request_can_be_retried_with_its_key(client, run):
+    taken = client.post("/api/create-zelle-booking", json=booking()).json()["booking_id"]
+    headers = {"Idempotency-Key": "booking-1"}
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).status_code == 409
+
+    assert client.delete(f"/api/admin/appointments/{taken}", auth=AUTH).status_code == 200
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).status_code == 200
+
+def test_waits_for_a_request_in_progress_on_another_worker(client, run):
+    scoped_key = "create-zelle-booking:booking-1"
+    stored = {"booking_id": "from-another-worker", "zelle_email": "liz@example.com"}
+
+    async def other_worker():
+        request_hash = server.booking_request_hash(server.AppointmentBooking(**booking()))
+        assert await server.claim_idempotency_key(scoped_key, request_hash) is None
+        await asyncio.sleep(0.3)
+        await server.db.idempotency_keys.update_one(
+            {"_id": scoped_key}, {"$set": {"status": "completed", "response": stored}}
+        )
+
+    async def race():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            worker = asyncio.create_task(other_worker())
+            await asyncio.sleep(0.05)
+            response = await http.post("/api/create-zelle-booking", json=booking(), headers={"Idempotency-Key": "booking-1"})
+            await worker
+            return response
+
+    response = run(race)
+    assert response.status_code == 200
+    assert response.json() == stored
+    assert count_appointments(run) == 0
+
+def test_replays_skip_rate_limiting(client, run, monkeypatch):
+    headers = {"Idempotency-Key": "booking-1"}
+    rate_limited = []
+    async def count_rate_limited(request, subject):
+        rate_limited.append(subject)
+    monkeypatch.setattr(server, "enforce_rate_limits", count_rate_limited)
+
+    first = client.post("/api/create-zelle-booking", json=booking(), headers=headers).json()
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).json() == first
+    # Only the stored response on this worker: still a replay, still not charged
+    monkeypatch.setattr(server, "idempotency_cache", server.IdempotencyCache(server.IDEMPOTENCY_CACHE_SIZE))
+    assert client.post("/api/create-zelle-booking", json=booking(), headers=headers).json() == first
+    assert rate_limited == ["ana@example.com"]
+
+    # A key reused with a different request is still refused, before any token is spent
+    response = client.post("/api/create-zelle-booking", json=booking(appointment_time="10:00"), headers=headers)
+    assert response.status_code == 422
+    assert rate_limited == ["ana@example.com"]
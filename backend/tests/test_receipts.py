@@ -0,0 +1,42 @@
+"""Zelle receipt uploads: spooled to disk, processed in the process pool"""
+import glob
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+import server
+from conftest import booking
+
+def png_bytes(size=(2400, 1200)):
+    output = io.BytesIO()
+    Image.new("RGB", size, "teal").save(output, format="PNG")
+    return output.getvalue()
+
+def spooled_files():
+    return glob.glob(os.path.join(tempfile.gettempdir(), "receipt-*.upload"))
+
+def upload(client, booking_id, data):
+    return client.post("/api/upload-zelle-proof", data={"booking_id": booking_id}, files={"file": ("receipt.png", data, "image/png")})
+
+def test_receipt_is_downscaled_and_the_spool_removed(client, run):
+    booking_id = client.post("/api/create-zelle-booking", json=booking()).json()["booking_id"]
+    spooled_before = spooled_files()
+    data = png_bytes()
+
+    assert upload(client, booking_id, data).status_code == 200
+    appointment = run(lambda: server.db.appointments.find_one({"id": booking_id}))
+    assert appointment["status"] == "confirmed"
+    assert appointment["zelle_receipt_original_size"] == len(data)
+    assert max(appointment["zelle_receipt_width"], appointment["zelle_receipt_height"]) == server.RECEIPT_MAX_DIMENSION
+    assert spooled_files() == spooled_before
+
+def test_oversized_and_non_image_uploads_are_refused(client, monkeypatch):
+    booking_id = client.post("/api/create-zelle-booking", json=booking()).json()["booking_id"]
+    spooled_before = spooled_files()
+
+    assert upload(client, booking_id, b"%PDF-1.7 not an image").status_code == 415
+    monkeypatch.setattr(server, "RECEIPT_MAX_BYTES", 1024)
+    assert upload(client, booking_id, png_bytes() + b"\0" * 2048).status_code == 413
+    assert spooled_files() == spooled_before
@@ -0,0 +1,160 @@
+"""Slot hold lifecycle: claim, overlap, permanent holds, expiry and PayPal failures"""
+from datetime import datetime, timedelta, timezone
+
+import server
+from conftest import AUTH, BOOKING_DATE, booking
+
+def holds_of(run, appointment_id):
+    async def find():
+        return await server.db.slot_holds.find({"appointment_id": appointment_id}, {"_id": 0}).to_list(None)
+    return run(find)
+
+def status_of(run, appointment_id):
+    async def find():
+        return (await server.db.appointments.find_one({"id": appointment_id}, {"status": 1}))["status"]
+    return run(find)
+
+def lapse_holds(run):
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    async def update():
+        await server.db.slot_holds.update_many({"expires_at": {"$exists": True}}, {"$set": {"expires_at": past}})
+        await server.db.appointments.update_many({}, {"$set": {"hold_expires_at": past}})
+    run(update)
+
+def available_times(client, duration=None):
+    params = {"duration": duration} if duration else {}
+    return client.get(f"/api/available-slots/{BOOKING_DATE}", params=params).json()["available_times"]
+
+def test_claim_holds_every_granule_of_the_session(client, run):
+    response = client.post("/api/create-zelle-booking", json=booking(session_duration="plus_60min"))
+    assert response.status_code == 200
+
+    holds = holds_of(run, response.json()["booking_id"])
+    assert sorted(hold["time"] for hold in holds) == ["09:00", "09:30", "10:00", "10:30"]
+    assert all("expires_at" in hold for hold in holds)
+    assert "09:00" not in available_times(client)
+    assert "10:00" not in available_times(client)
+
+def test_overlapping_booking_is_rejected(client, run):
+    assert client.post("/api/create-zelle-booking", json=booking(session_duration="plus_30min")).status_code == 200
+
+    assert client.post("/api/create-zelle-booking", json=booking()).status_code == 409
+    # 10:00 overlaps the last half hour of the 90-minute session
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="10:00")).status_code == 409
+    assert client.post("/api/create-zelle-booking", json=booking(appointment_time="11:00")).status_code == 200
+
+def test_expiry_sweep_frees_unpaid_slot(client, run):
+    appointment_id = client.post("/api/create-zelle-booking", json=booking()).json()["booking_id"]
+    lapse_holds(run)
+
+    assert run(server.expire_unpaid_bookings) == 1
+    assert status_of(run, appointment_id) == "expired"
+    assert holds_of(run, appointment_id) == []
+    assert "09:00" in available_times(client)
+    assert client.post("/api/create-zelle-booking", json=booking()).status_code == 200
+
+def test_confirmed_hold_is_permanent(client, run, paypal):
+    appointment_id = client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).json()["booking_id"]
+
+    response = client.post("/api/confirm-paypal-payment", params={"payment_id": "PAY-1", "payer_id": "P", "booking_id": appointment_id})
+    assert response.status_code == 200
+    assert status_of(run, appointment_id) == "confirmed"
+    assert holds_of(run, appointment_id) and all("expires_at" not in hold for hold in holds_of(run, appointment_id))
+
+    lapse_holds(run)
+    assert run(server.expire_unpaid_bookings) == 0
+    assert client.post("/api/create-zelle-booking", json=booking()).status_code == 409
+
+def test_repeated_confirm_keeps_hold_permanent(client, run, paypal):
+    appointment_id = client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).json()["booking_id"]
+    params = {"payment_id": "PAY-1", "payer_id": "P", "booking_id": appointment_id}
+    assert client.post("/api/confirm-paypal-payment", params=params).status_code == 200
+
+    # PayPal refuses to execute a payment twice; a reload must not unsettle the booking
+    paypal.execute_result = False
+    assert client.post("/api/confirm-paypal-payment", params=params).status_code == 200
+    assert status_of(run, appointment_id) == "confirmed"
+    assert all("expires_at" not in hold for hold in holds_of(run, appointment_id))
+
+def test_failed_confirm_lets_the_hold_expire(client, run, paypal):
+    appointment_id = client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).json()["booking_id"]
+
+    paypal.execute_result = RuntimeError("PayPal timed out")
+    response = client.post("/api/confirm-paypal-payment", params={"payment_id": "bogus", "payer_id": "P", "booking_id": appointment_id})
+    assert response.status_code == 500
+    assert all("expires_at" in hold for hold in holds_of(run, appointment_id))
+
+    lapse_holds(run)
+    assert run(server.expire_unpaid_bookings) == 1
+    assert holds_of(run, appointment_id) == []
+    assert client.post("/api/create-zelle-booking", json=booking()).status_code == 200
+
+def test_expiry_sweep_drops_holds_left_permanent(client, run):
+    appointment_id = client.post("/api/create-zelle-booking", json=booking()).json()["booking_id"]
+    # As left by a confirm that secured the slot and then crashed before charging
+    async def make_permanent():
+        await server.db.slot_holds.update_many({"appointment_id": appointment_id}, {"$unset": {"expires_at": ""}})
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        await server.db.appointments.update_one({"id": appointment_id}, {"$set": {"hold_expires_at": past}})
+    run(make_permanent)
+
+    assert run(server.expire_unpaid_bookings) == 1
+    assert holds_of(run, appointment_id) == []
+
+def test_rejected_paypal_order_releases_slot(client, run, paypal):
+    paypal.create_result = RuntimeError("PayPal unavailable")
+    assert client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).status_code == 500
+
+    async def find_failed():
+        return await server.db.appointments.find({}, {"_id": 0, "status": 1}).to_list(None)
+    assert run(find_failed) == [{"status": "failed"}]
+    assert run(lambda: server.db.slot_holds.count_documents({})) == 0
+
+    paypal.create_result = None
+    assert client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).status_code == 200
+
+def test_archiving_and_deleting_drop_holds(client, run, paypal):
+    appointment_id = client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).json()["booking_id"]
+    client.post("/api/confirm-paypal-payment", params={"payment_id": "PAY-1", "payer_id": "P", "booking_id": appointment_id})
+    other_id = client.post("/api/create-zelle-booking", json=booking(appointment_time="14:00")).json()["booking_id"]
+
+    # Pretend the session is long past
+    async def backdate():
+        await server.db.appointments.update_one(
+            {"id": appointment_id},
+            {"$set": {"appointment_date": "2020-01-06", "start_at": server.appointment_start_at("2020-01-06", "09:00")}}
+        )
+    run(backdate)
+    assert run(lambda: server.archive_appointments(1))["archived"] == 1
+    assert holds_of(run, appointment_id) == []
+
+    assert client.delete(f"/api/admin/appointments/{other_id}", auth=AUTH).status_code == 200
+    assert holds_of(run, other_id) == []
+
+def stats_totals(run):
+    return run(lambda: server.db.stats_counters.find_one({"_id": "totals"}, {"_id": 0}))
+
+def test_rejected_paypal_order_moves_counters_to_failed(client, run, paypal, monkeypatch):
+    monkeypatch.setattr(server, "STATS_MODE", "counters")
+    paypal.create_result = RuntimeError("PayPal unavailable")
+    assert client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).status_code == 500
+
+    totals = stats_totals(run)
+    assert totals["total"] == 1
+    assert totals["status"] == {"pending": 0, "failed": 1}
+
+def test_failing_an_order_that_left_pending_changes_nothing(client, run, paypal, monkeypatch):
+    monkeypatch.setattr(server, "STATS_MODE", "counters")
+    appointment_id = client.post("/api/create-paypal-order", json=booking(payment_method="paypal")).json()["booking_id"]
+    lapse_holds(run)
+    assert run(server.expire_unpaid_bookings) == 1
+    before = stats_totals(run)
+
+    async def fail_late():
+        appointment = await server.db.appointments.find_one({"id": appointment_id}, {"_id": 0})
+        await server.fail_paypal_order({**appointment, "status": "pending"})
+    run(fail_late)
+
+    assert status_of(run, appointment_id) == "expired"
+    assert stats_totals(run) == before
+    assert before["status"] == {"pending": 0, "expired": 1}
@@ -0,0 +1,21 @@
+"""Startup: a worker that cannot reach MongoDB must not come up"""
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+def test_failed_warm_up_aborts_startup(client, monkeypatch):
+    async def unreachable():
+        raise ConnectionError("no MongoDB")
+
+    monkeypatch.setattr(server, "warm_up_mongo", unreachable)
+    hooks_ran = []
+    monkeypatch.setattr(server.app.router, "on_startup", [lambda: hooks_ran.append(True)])
+
+    with pytest.raises(ConnectionError):
+        with TestClient(server.app):
+            pass
+    assert hooks_ran == []
+
+def test_startup_hooks_run_after_warm_up(client):
+    assert server.hold_sweep_task is not None and not server.hold_sweep_task.done()
@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark harness for the booking API
+
+Boots backend/server.py under uvicorn against a local MongoDB stand-in
+(mongomock-motor by default, or a real mongod with --mongo-url) with fake
+PayPal and SMTP servers, drives concurrent load with an async client and
+reports p50/p95/p99 latency, requests/sec and Mongo operations per request.
+
+Usage:
+    pip install httpx mongomock-motor
+    python backend_benchmark.py --requests 200 --concurrency 20
+    python backend_benchmark.py --mongo-url mongodb://localhost:27017 --output run.json
+    python backend_benchmark.py --compare previous.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+ADMIN_AUTH = ("liz", "psico2024")
+
+# ---------------------------------------------------------------------------
+# Fake external services
+# ---------------------------------------------------------------------------
+
+class FakePayPalHandler(BaseHTTPRequestHandler):
+    """Answers the handful of REST calls paypalrestsdk makes"""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _consume_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+    def do_POST(self):
+        self._consume_body()
+        time.sleep(self.latency)
+        if self.path == "/v1/oauth2/token":
+            return self._reply(200, {"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600})
+        if self.path == "/v1/payments/payment":
+            payment_id = f"PAY-{uuid.uuid4().hex[:12]}"
+            return self._reply(201, {
+                "id": payment_id,
+                "state": "created",
+                "links": [{"rel": "approval_url", "href": f"http://fake-paypal/approve/{payment_id}", "method": "REDIRECT"}]
+            })
+        if self.path.endswith("/execute"):
+            return self._reply(200, {"id": self.path.split("/")[-2], "state": "approved"})
+        self._reply(404, {"name": "NOT_FOUND"})
+
+    def do_GET(self):
+        self._consume_body()
+        time.sleep(self.latency)
+        payment_id = self.path.rstrip("/").split("/")[-1]
+        self._reply(200, {"id": payment_id, "state": "created", "links": []})
+
+
+def start_fake_paypal(port, latency):
+    FakePayPalHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakePayPalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SMTPStub:
+    """Minimal SMTP server accepting every message"""
+
+    def __init__(self):
+        self.messages = 0
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 smtp-stub ready\r\n")
+        in_data = False
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    self.messages += 1
+                    writer.write(b"250 queued\r\n")
+                    await writer.drain()
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                writer.write(b"250-smtp-stub\r\n250 8BITMIME\r\n")
+            elif command == b"DATA":
+                in_data = True
+                writer.write(b"354 end with .\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def start(self, port):
+        return await asyncio.start_server(self.handle, "127.0.0.1", port)
+
+# ---------------------------------------------------------------------------
+# Mongo operation counting
+# ---------------------------------------------------------------------------
+
+class MongoOpCounter:
+    def __init__(self):
+        self.count = 0
+
+
+class CountingCollection:
+    """Wraps a mongomock-motor collection and counts every operation call"""
+    OPERATIONS = {
+        "find", "find_one", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+        "insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many",
+        "replace_one", "count_documents", "aggregate", "bulk_write", "create_indexes", "distinct"
+    }
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name in self.OPERATIONS:
+            def counted(*args, **kwargs):
+                self._counter.count += 1
+                return attribute(*args, **kwargs)
+            return counted
+        return attribute
+
+
+class CountingDatabase:
+    def __init__(self, database, counter):
+        self._database = database
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self._counter)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+
+def make_command_listener(counter):
+    from pymongo import monitoring
+
+    class CommandCounter(monitoring.CommandListener):
+        def started(self, event):
+            counter.count += 1
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    return CommandCounter()
+
+# ---------------------------------------------------------------------------
+# Server bootstrap
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_server(args, paypal_port, smtp_port, receipt_dir):
+    os.environ.update({
+        "MONGO_URL": args.mongo_url or "mongodb://localhost:27017",
+        "PAYPAL_CLIENT_ID": "bench",
+        "PAYPAL_CLIENT_SECRET": "bench",
+        "PAYPAL_API_BASE": f"http://127.0.0.1:{paypal_port}",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USE_TLS": "false",
+        "SMTP_LOGIN": "",
+        "SMTP_PASSWORD": "",
+        "FROM_EMAIL": "bench@example.com",
+        "LIZA_EMAIL": "liz@example.com",
+        "RECEIPT_STORAGE": "gridfs" if args.mongo_url else "local",
+        "RECEIPT_DIR": receipt_dir,
+        "CONFIG_SYNC_MODE": "poll",
+        # mongomock has no change streams
+        "AVAILABILITY_FANOUT_MODE": "auto" if args.mongo_url else "off",
+        "EMAIL_POLL_SECONDS": "1",
+        # Every simulated client shares one IP and a handful of emails
+        "RATE_LIMIT_BACKEND": "off",
+        # Seeded appointments are dated in the past; keep them in the hot collection
+        "ARCHIVE_AFTER_DAYS": "0",
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+
+def attach_database(server, args, counter):
+    if args.mongo_url:
+        import motor.motor_asyncio
+        server.client = motor.motor_asyncio.AsyncIOMotorClient(
+            args.mongo_url, event_listeners=[make_command_listener(counter)]
+        )
+        server.db = server.client[args.database]
+    else:
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("mongomock-motor is required without --mongo-url: pip install mongomock-motor")
+        server.client = mongomock_motor.AsyncMongoMockClient()
+        server.db = CountingDatabase(server.client[args.database], counter)
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def bookable_slots(server, start_date):
+    """Endless (date, time) pairs from the compiled weekly schedule"""
+    day = start_date
+    while True:
+        for time_slot in server.compiled_schedule.slots_for(day):
+            yield day.isoformat(), time_slot
+        day += timedelta(days=1)
+
+
+def booking_payload(slot, payment_method):
+    appointment_date, appointment_time = slot
+    return {
+        "full_name": "Bench, User",
+        "email": "bench@example.com",
+        "whatsapp": "+58 412-000-0000",
+        "appointment_date": appointment_date,
+        "appointment_time": appointment_time,
+        "payment_method": payment_method,
+        "session_duration": "standard"
+    }
+
+
+async def run_scenario(name, make_request, total, concurrency, counter):
+    """Run `total` requests with `concurrency` in flight; returns the scenario summary"""
+    latencies = []
+    errors = 0
+    statuses = {}
+    queue = asyncio.Queue()
+    for index in range(total):
+        queue.put_nowait(index)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                status = await make_request(index)
+            except Exception:
+                status = "exception"
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == "exception" or status >= 400:
+                errors += 1
+
+    ops_before = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    ops = counter.count - ops_before
+
+    latencies.sort()
+    summary = {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 4),
+        "requests_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0
+        },
+        "mongo_ops_per_request": round(ops / total, 2) if total else 0.0
+    }
+    print(
+        f"  {name:<28} {summary['requests_per_second']:>9.1f} req/s  "
+        f"p50 {summary['latency_ms']['p50']:>8.2f} ms  p95 {summary['latency_ms']['p95']:>8.2f} ms  "
+        f"p99 {summary['latency_ms']['p99']:>8.2f} ms  mongo/req {summary['mongo_ops_per_request']:>6.2f}  "
+        f"errors {errors}"
+    )
+    return summary
+
+
+def make_receipt_image(size):
+    """A screenshot-like JPEG: flat background, blocks of "text" and a photo-ish header"""
+    from PIL import Image, ImageDraw
+    import random
+    width, height = (int(part) for part in size.lower().split("x"))
+    image = Image.new("RGB", (width, height), "white")
+    image.paste(Image.effect_noise((width, height // 5), 40).convert("RGB"), (0, 0))
+    draw = ImageDraw.Draw(image)
+    generator = random.Random(42)
+    for top in range(height // 5 + 40, height - 40, 48):
+        left = 40
+        while left < width - 120:
+            word = generator.randint(30, 140)
+            draw.rectangle([left, top, left + word, top + 24], fill=(40, 40, 40))
+            left += word + 18
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+async def seed_appointments(server, count):
+    """Insert historical appointments so list/export/stats have work to do"""
+    base = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    documents = []
+    for index in range(count):
+        created = base + timedelta(minutes=index * 37)
+        appointment_date = (created.date() + timedelta(days=3)).isoformat()
+        documents.append({
+            "id": str(uuid.uuid4()),
+            "full_name": f"Seed User {index}",
+            "email": f"seed{index}@example.com",
+            "whatsapp": "+58 412-000-0000",
+            "appointment_date": appointment_date,
+            "appointment_time": "09:00",
+            "start_at": server.appointment_start_at(appointment_date, "09:00"),
+            "duration_min": 60,
+            "payment_method": "paypal" if index % 2 else "zelle",
+            "session_duration": "standard",
+            "session_price": 50.0,
+            "status": "confirmed" if index % 3 else "expired",
+            "created_at": created
+        })
+    for start in range(0, len(documents), 1000):
+        await server.db.appointments.insert_many(documents[start:start + 1000])
+
+
+async def run_benchmark(args):
+    try:
+        import httpx
+        import uvicorn
+    except ImportError:
+        sys.exit("httpx and uvicorn are required: pip install httpx uvicorn")
+
+    receipt_image = make_receipt_image(args.receipt_size)
+    paypal_port = free_port()
+    smtp_port = free_port()
+    api_port = free_port()
+    receipt_dir = tempfile.mkdtemp(prefix="psicoliz-bench-receipts-")
+
+    start_fake_paypal(paypal_port, args.paypal_latency)
+    smtp_stub = SMTPStub()
+    smtp_server = await smtp_stub.start(smtp_port)
+
+    counter = MongoOpCounter()
+    server = import_server(args, paypal_port, smtp_port, receipt_dir)
+    attach_database(server, args, counter)
+    if args.mongo_url:
+        await server.client.drop_database(args.database)
+
+    await seed_appointments(server, args.seed)
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=api_port, log_level="warning", lifespan="on")
+    api_server = uvicorn.Server(config)
+    api_task = asyncio.create_task(api_server.serve())
+    while not api_server.started:
+        await asyncio.sleep(0.05)
+    # Receipt workers are spawned at startup and import server.py before their first job;
+    # let them finish so the upload scenario measures processing, not process start-up
+    await asyncio.to_thread(concurrent.futures.wait, [
+        server.receipt_process_pool.submit(server.receipt_worker_ready) for _ in range(server.RECEIPT_PROCESS_WORKERS)
+    ])
+
+    print(f"🏋️ Benchmarking server.py ({'mongod ' + args.mongo_url if args.mongo_url else 'mongomock-motor'})")
+    print(f"   {args.requests} requests per scenario, concurrency {args.concurrency}, {args.seed} seeded appointments")
+    print("=" * 60)
+
+    slots = bookable_slots(server, date.today() + timedelta(days=400))
+    zelle_bookings = []
+    paypal_bookings = []
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits, timeout=60) as http:
+        sample_day = (date.today() + timedelta(days=7)).isoformat()
+        range_end = (date.today() + timedelta(days=67)).isoformat()
+
+        async def available_slots(index):
+            return (await http.get(f"/api/available-slots/{sample_day}")).status_code
+
+        async def available_slots_range(index):
+            response = await http.get("/api/available-slots", params={"from": sample_day, "to": range_end})
+            return response.status_code
+
+        async def pricing_config(index):
+            return (await http.get("/api/pricing-config")).status_code
+
+        async def zelle_booking(index):
+            response = await http.post("/api/create-zelle-booking", json=booking_payload(next(slots), "zelle"))
+            if response.status_code == 200:
+                zelle_bookings.append(response.json()["booking_id"])
+            return response.status_code
+
+        async def zelle_upload(index):
+            files = {"file": ("receipt.jpg", receipt_image, "image/jpeg")}
+            response = await http.post("/api/upload-zelle-proof", data={"booking_id": zelle_bookings[index]}, files=files)
+            return response.status_code
+
+        async def paypal_order(index):
+            response = await http.post("/api/create-paypal-order", json=booking_payload(next(slots), "paypal"))
+            if response.status_code == 200:
+                paypal_bookings.append(response.json()["booking_id"])
+            return response.status_code
+
+        async def paypal_confirm(index):
+            response = await http.post("/api/confirm-paypal-payment", params={
+                "payment_id": f"PAY-{index}", "payer_id": "BENCHPAYER", "booking_id": paypal_bookings[index]
+            })
+            return response.status_code
+
+        async def admin_list(index):
+            return (await http.get("/api/admin/appointments", params={"limit": 50}, auth=ADMIN_AUTH)).status_code
+
+        async def admin_export(index):
+            response = await http.get("/api/admin/appointments/export", auth=ADMIN_AUTH)
+            return response.status_code
+
+        async def admin_stats(index):
+            return (await http.get("/api/admin/stats", auth=ADMIN_AUTH)).status_code
+
+        scenarios = [
+            ("available_slots", available_slots, args.requests),
+            ("available_slots_range", available_slots_range, args.requests),
+            ("pricing_config", pricing_config, args.requests),
+            ("create_zelle_booking", zelle_booking, args.requests),
+            ("upload_zelle_proof", zelle_upload, None),
+            ("create_paypal_order", paypal_order, args.requests),
+            ("confirm_paypal_payment", paypal_confirm, None),
+            ("admin_appointments", admin_list, args.requests),
+            ("admin_export", admin_export, max(1, args.requests // 10)),
+            ("admin_stats", admin_stats, args.requests),
+        ]
+        for name, make_request, total in scenarios:
+            if total is None:
+                # Follow-up steps run once per booking created by the previous scenario
+                total = len(zelle_bookings) if name == "upload_zelle_proof" else len(paypal_bookings)
+            if total:
+                results[name] = await run_scenario(name, make_request, total, args.concurrency, counter)
+
+    micro = {}
+    print("\n🔬 Micro-benchmarks")
+    print("=" * 60)
+    micro.update(await benchmark_email_rendering(server, args.render_messages))
+    micro.update(benchmark_serialization(server))
+
+    # Give the email worker a moment to drain the outbox before shutting down
+    await asyncio.sleep(1.5)
+    api_server.should_exit = True
+    await api_task
+    smtp_server.close()
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "backend": "mongod" if args.mongo_url else "mongomock-motor",
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "paypal_latency_seconds": args.paypal_latency,
+            "receipt_size": args.receipt_size,
+            "receipt_bytes": len(receipt_image)
+        },
+        "emails_delivered": smtp_stub.messages,
+        "smtp_connections": smtp_stub.connections,
+        "scenarios": results,
+        "micro": micro
+    }
+
+
+def time_per_item(fn, items, rounds=3):
+    """Best-of-rounds wall time per item in microseconds"""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(items)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(items) * 1_000_000, 2)
+
+
+def report_micro(name, microseconds, unit="message"):
+    print(f"  {name:<28} {microseconds:>10.2f} µs/{unit}")
+    return {f"microseconds_per_{unit}": microseconds}
+
+
+async def benchmark_email_rendering(server, count):
+    """Render cost of the compiled email templates and of building the MIME message"""
+    appointments = [
+        {
+            "id": str(uuid.uuid4()),
+            "full_name": f"Usuaria <{index}> & Cía",
+            "email": f"user{index}@example.com",
+            "whatsapp": "+58 412-000-0000",
+            "appointment_date": "2031-01-07",
+            "appointment_time": f"{9 + index % 8:02d}:00",
+            "payment_method": "zelle",
+            "locale": "en" if index % 4 == 0 else "es"
+        }
+        for index in range(count)
+    ]
+    results = {
+        "email_render_reminder_batch": report_micro(
+            "email_render_reminder_batch",
+            time_per_item(lambda batch: server.render_email_batch("reminder", batch), appointments)
+        ),
+        "email_render_confirmation": report_micro(
+            "email_render_confirmation",
+            time_per_item(lambda batch: [server.build_confirmation_messages(a) for a in batch], appointments)
+        )
+    }
+    messages = server.render_email_batch("reminder", appointments)
+    started = time.perf_counter()
+    for message in messages:
+        (await server.build_mime_message(message)).as_bytes()
+    results["email_build_mime"] = report_micro(
+        "email_build_mime", round((time.perf_counter() - started) / count * 1_000_000, 2)
+    )
+    return results
+
+
+def benchmark_serialization(server, count=1000):
+    """Cost of turning 1k listed appointments into a response body, before and after response models"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import ORJSONResponse
+    from pydantic import TypeAdapter
+    from starlette.responses import JSONResponse
+
+    created = datetime(2026, 1, 1)
+    # Shaped like documents read with APPOINTMENT_LIST_PROJECTION (naive UTC datetimes)
+    appointments = [
+        {
+            "id": str(uuid.uuid4()),
+            "full_name": f"Seed User {index}",
+            "email": f"seed{index}@example.com",
+            "whatsapp": "+58 412-000-0000",
+            "appointment_date": "2031-01-07",
+            "appointment_time": f"{9 + index % 8:02d}:00",
+            "start_at": datetime(2031, 1, 7, 13 + index % 8),
+            "duration_min": 60,
+            "session_duration": "standard",
+            "session_price": 50.0,
+            "payment_method": "zelle" if index % 2 else "paypal",
+            "status": "confirmed",
+            "locale": "es",
+            "created_at": created + timedelta(minutes=index),
+            "payment_confirmed_at": "2026-01-01T10:00:00-04:00",
+            "zelle_receipt_id": uuid.uuid4().hex if index % 2 else None,
+            "zelle_receipt_filename": "receipt.webp" if index % 2 else None
+        }
+        for index in range(count)
+    ]
+    adapter = TypeAdapter(list[server.AppointmentOut])
+
+    def legacy(batch):
+        # No response_model: jsonable_encoder walk, then the stdlib json encoder
+        return JSONResponse(jsonable_encoder(batch)).body
+
+    def response_model(batch):
+        # What FastAPI does with response_model=List[AppointmentOut] and ORJSONResponse
+        validated = adapter.validate_python(batch)
+        return ORJSONResponse(adapter.dump_python(validated, mode="json", exclude_none=True)).body
+
+    return {
+        name: report_micro(name, round(time_per_item(fn, appointments) * 1000, 2), unit="1k_appointments")
+        for name, fn in (
+            ("serialize_appointments_legacy", legacy),
+            ("serialize_appointments_model", response_model)
+        )
+    }
+
+
+def git_commit():
+    try:
+        # The commit being measured, not whatever repository the benchmark is run from
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def compare_runs(previous, current):
+    print("\n📊 Compared with previous run")
+    print("=" * 60)
+    for name, summary in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        def change(new, old):
+            return f"{((new - old) / old * 100):+.1f}%" if old else "n/a"
+        print(
+            f"  {name:<28} req/s {change(summary['requests_per_second'], before['requests_per_second']):>8}  "
+            f"p95 {change(summary['latency_ms']['p95'], before['latency_ms']['p95']):>8}  "
+            f"mongo/req {before['mongo_ops_per_request']} -> {summary['mongo_ops_per_request']}"
+        )
+    for name, summary in current.get("micro", {}).items():
+        before = previous.get("micro", {}).get(name, {})
+        for metric, value in summary.items():
+            if metric in before:
+                unit = metric.replace("microseconds_per_", "")
+                print(f"  {name:<28} µs/{unit} {before[metric]} -> {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the booking API against a local Mongo stand-in")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight")
+    parser.add_argument("--seed", type=int, default=2000, help="historical appointments to insert first")
+    parser.add_argument("--mongo-url", help="benchmark against this mongod instead of mongomock-motor")
+    parser.add_argument("--database", default="psicoliz_benchmark", help="database name (dropped first with --mongo-url)")
+    parser.add_argument("--paypal-latency", type=float, default=0.05, help="seconds the fake PayPal waits per call")
+    parser.add_argument("--receipt-size", default="1170x2532", help="WxH of each uploaded Zelle receipt (a phone screenshot by default)")
+    parser.add_argument("--render-messages", type=int, default=2000, help="messages rendered by the email micro-benchmark")
+    parser.add_argument("--output", default=f"benchmark_results/benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument("--compare", help="previous results JSON to diff against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare_runs(json.load(previous), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,52 @@ import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { getApiUrl, API_ENDPOINTS } from '../config/api';
 
+// Small receipt preview; fetched as a blob because the endpoint needs the admin credentials
+const ReceiptThumbnail = ({ appointment, onClick }) => {
+  const [src, setSrc] = useState(null);
+
+  useEffect(() => {
+    let objectUrl = null;
+    let cancelled = false;
+    const auth = localStorage.getItem('adminAuth');
+    axios.get(getApiUrl(`${API_ENDPOINTS.ADMIN.APPOINTMENTS}/${appointment.id}/receipt/thumbnail`), {
+      headers: { 'Authorization': `Basic ${auth}` },
+      responseType: 'blob'
+    })
+      .then((response) => {
+        if (!cancelled) {
+          objectUrl = window.URL.createObjectURL(response.data);
+          setSrc(objectUrl);
+        }
+      })
+      .catch((error) => console.error('Error loading receipt thumbnail:', error));
+    return () => {
+      cancelled = true;
+      if (objectUrl) {
+        window.URL.revokeObjectURL(objectUrl);
+      }
+    };
+  }, [appointment.id]);
+
+  if (!src) {
+    return null;
+  }
+  return (
+    <img
+      src={src}
+      alt="Comprobante"
+      onClick={onClick}
+      className="w-8 h-8 object-cover rounded cursor-pointer border border-gray-200"
+      title="Descargar comprobante"
+    />
+  );
+};
+
 const AdminPanel = () => {
   const navigate = useNavigate();
   const [appointments, setAppointments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [includeArchived, setIncludeArchived] = useState(false);
   const [stats, setStats] = useState({});
   const [settings, setSettings] = useState({ 
     zelle_email: '', 
@@ -60,7 +103,8 @@ const AdminPanel = () => {
 
       const [appointmentsRes, statsRes, settingsRes, scheduleRes] = await Promise.all([
         axios.get(getApiUrl(API_ENDPOINTS.ADMIN.APPOINTMENTS), {
-          headers: { 'Authorization': `Basic ${auth}` }
+          headers: { 'Authorization': `Basic ${auth}` },
+          params: { include_archived: includeArchived }
         }),
         axios.get(getApiUrl(API_ENDPOINTS.ADMIN.STATS), {
           headers: { 'Authorization': `Basic ${auth}` }
@@ -74,6 +118,7 @@ const AdminPanel = () => {
       ]);
 
       setAppointments(appointmentsRes.data);
+      setNextCursor(appointmentsRes.headers['x-next-cursor'] || null);
       setStats(statsRes.data);
       setSettings(settingsRes.data);
       setSchedule(scheduleRes.data);
@@ -88,6 +133,22 @@ const AdminPanel = () => {
     }
   };
 
+  const loadMoreAppointments = async () => {
+    try {
+      const auth = localStorage.getItem('adminAuth');
+      const response = await axios.get(getApiUrl(API_ENDPOINTS.ADMIN.APPOINTMENTS), {
+        headers: { 'Authorization': `Basic ${auth}` },
+        params: { cursor: nextCursor, include_archived: includeArchived }
+      });
+      
+      setAppointments((current) => [...current, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error loading more appointments:', error);
+      alert('Error al cargar más citas');
+    }
+  };
+
   const confirmZellePayment = async (appointmentId) => {
     try {
       const auth = localStorage.getItem('adminAuth');
@@ -126,12 +187,12 @@ const AdminPanel = () => {
     try {
       const auth = localStorage.getItem('adminAuth');
       const response = await axios.get(getApiUrl(`${API_ENDPOINTS.ADMIN.APPOINTMENTS}/export`), {
-        headers: { 'Authorization': `Basic ${auth}` }
+        headers: { 'Authorization': `Basic ${auth}` },
+        params: { format: 'csv', include_archived: includeArchived },
+        responseType: 'blob'
       });
       
-      const csvData = response.data.csv_data;
-      const blob = new Blob([csvData], { type: 'text/csv' });
-      const url = window.URL.createObjectURL(blob);
+      const url = window.URL.createObjectURL(response.data);
       const a = document.createElement('a');
       a.href = url;
       a.download = `citas_${new Date().toISOString().split('T')[0]}.csv`;
@@ -143,6 +204,26 @@ const AdminPanel = () => {
     }
   };
 
+  const downloadReceipt = async (appointment) => {
+    try {
+      const auth = localStorage.getItem('adminAuth');
+      const response = await axios.get(getApiUrl(`${API_ENDPOINTS.ADMIN.APPOINTMENTS}/${appointment.id}/receipt`), {
+        headers: { 'Authorization': `Basic ${auth}` },
+        responseType: 'blob'
+      });
+      
+      const url = window.URL.createObjectURL(response.data);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = appointment.zelle_receipt_filename || `comprobante_${appointment.id}.jpg`;
+      a.click();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error('Error downloading receipt:', error);
+      alert('Error al descargar el comprobante');
+    }
+  };
+
   const updateSettings = async () => {
     try {
       setSettingsLoading(true);
@@ -254,12 +335,20 @@ const AdminPanel = () => {
     }
   }, []);
 
+  useEffect(() => {
+    if (authenticated) {
+      loadData();
+    }
+  }, [includeArchived]);
+
   const getStatusBadge = (status) => {
     const badges = {
       'confirmed': 'bg-green-100 text-green-800',
       'pending': 'bg-yellow-100 text-yellow-800',
       'awaiting_payment_proof': 'bg-blue-100 text-blue-800',
-      'cancelled': 'bg-red-100 text-red-800'
+      'cancelled': 'bg-red-100 text-red-800',
+      'expired': 'bg-gray-100 text-gray-500',
+      'failed': 'bg-red-100 text-red-800'
     };
     return badges[status] || 'bg-gray-100 text-gray-800';
   };
@@ -269,7 +358,9 @@ const AdminPanel = () => {
       'confirmed': 'Confirmada',
       'pending': 'Pendiente',
       'awaiting_payment_proof': 'Esperando comprobante',
-      'cancelled': 'Cancelada'
+      'cancelled': 'Cancelada',
+      'expired': 'Expirada',
+      'failed': 'Pago fallido'
     };
     return texts[status] || status;
   };
@@ -375,6 +466,14 @@ const AdminPanel = () => {
               </div>
             </div>
             <div className="flex space-x-4">
+              <label className="flex items-center space-x-2 text-gray-700">
+                <input
+                  type="checkbox"
+                  checked={includeArchived}
+                  onChange={(e) => setIncludeArchived(e.target.checked)}
+                />
+                <span>Incluir archivadas</span>
+              </label>
               <button
                 onClick={exportAppointments}
                 className="bg-green-500 text-white px-4 py-2 rounded-lg hover:bg-green-600"
@@ -523,14 +622,15 @@ const AdminPanel = () => {
                                 ✓
                               </button>
                             )}
-                            {appointment.zelle_receipt && (
+                            {appointment.zelle_receipt_thumbnail_id && (
+                              <ReceiptThumbnail
+                                appointment={appointment}
+                                onClick={() => downloadReceipt(appointment)}
+                              />
+                            )}
+                            {appointment.zelle_receipt_filename && !appointment.zelle_receipt_thumbnail_id && (
                               <button
-                                onClick={() => {
-                                  const link = document.createElement('a');
-                                  link.href = `data:image/jpeg;base64,${appointment.zelle_receipt}`;
-                                  link.download = `comprobante_${appointment.id}.jpg`;
-                                  link.click();
-                                }}
+                                onClick={() => downloadReceipt(appointment)}
                                 className="bg-blue-500 text-white px-2 py-1 rounded text-xs hover:bg-blue-600"
                                 title="Descargar comprobante"
                               >
@@ -550,6 +650,16 @@ const AdminPanel = () => {
                     ))}
                   </tbody>
                 </table>
+                {nextCursor && (
+                  <div className="text-center mt-6">
+                    <button
+                      onClick={loadMoreAppointments}
+                      className="bg-golden-brown text-white px-4 py-2 rounded-lg hover:bg-opacity-90"
+                    >
+                      Cargar más citas
+                    </button>
+                  </div>
+                )}
               </div>
             )}
           </div>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import DatePicker from 'react-datepicker';
 import 'react-datepicker/dist/react-datepicker.css';
@@ -20,13 +20,53 @@ const BookingFlow = () => {
     whatsapp: '',
     payment_method: ''
   });
+  // Reused across retries of the same submission so the backend books only once
+  const idempotencyKeyRef = useRef(null);
 
-  // Load available times when date changes
+  const newIdempotencyKey = () => (
+    window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+  );
+
+  // Load available times when date or session length changes
   useEffect(() => {
     if (selectedDate) {
       loadAvailableSlots();
     }
-  }, [selectedDate]);
+  }, [selectedDate, selectedDuration]);
+
+  // Follow slot changes for the selected date while the page is open
+  useEffect(() => {
+    if (!selectedDate || typeof EventSource === 'undefined') {
+      return undefined;
+    }
+    const dateStr = selectedDate.toISOString().split('T')[0];
+    const source = new EventSource(
+      `${getApiUrl(API_ENDPOINTS.AVAILABILITY_STREAM)}?from=${dateStr}&to=${dateStr}`
+    );
+    let connected = false;
+
+    source.addEventListener('ready', () => {
+      // Events may have been missed while reconnecting
+      if (connected) {
+        loadAvailableSlots({ fresh: true });
+      }
+      connected = true;
+    });
+    source.addEventListener('slot_taken', (event) => {
+      const { time } = JSON.parse(event.data);
+      setAvailableTimes((times) => times.filter((t) => t !== time));
+      setSelectedTime((current) => (current === time ? '' : current));
+      // A longer session also blocks the start times it runs into
+      loadAvailableSlots({ fresh: true });
+    });
+    ['slot_freed', 'schedule_changed', 'resync'].forEach((type) => {
+      source.addEventListener(type, () => loadAvailableSlots({ fresh: true }));
+    });
+
+    return () => source.close();
+  }, [selectedDate, selectedDuration]);
 
   // Load pricing configuration
   useEffect(() => {
@@ -41,12 +81,17 @@ const BookingFlow = () => {
     loadPricing();
   }, []);
 
-  const loadAvailableSlots = async () => {
+  // fresh: revalidate with the server; an event means the browser's cached copy is out of date
+  const loadAvailableSlots = async ({ fresh = false } = {}) => {
     try {
       setLoading(true);
       const dateStr = selectedDate.toISOString().split('T')[0];
-      const response = await axios.get(getApiUrl(`${API_ENDPOINTS.AVAILABLE_SLOTS}/${dateStr}`));
+      const response = await axios.get(getApiUrl(`${API_ENDPOINTS.AVAILABLE_SLOTS}/${dateStr}`), {
+        params: { duration: selectedDuration },
+        headers: fresh ? { 'Cache-Control': 'no-cache' } : {}
+      });
       setAvailableTimes(response.data.available_times);
+      setSelectedTime((current) => (response.data.available_times.includes(current) ? current : ''));
       console.log('Available times loaded:', response.data.available_times);
     } catch (error) {
       console.error('Error loading available slots:', error);
@@ -90,18 +135,33 @@ const BookingFlow = () => {
         session_duration: selectedDuration
       };
 
+      if (!idempotencyKeyRef.current) {
+        idempotencyKeyRef.current = newIdempotencyKey();
+      }
+      const requestConfig = { headers: { 'Idempotency-Key': idempotencyKeyRef.current } };
+
       if (formData.payment_method === 'paypal') {
         // Create PayPal order
-        const response = await axios.post(getApiUrl(API_ENDPOINTS.CREATE_PAYPAL_ORDER), bookingData);
+        const response = await axios.post(getApiUrl(API_ENDPOINTS.CREATE_PAYPAL_ORDER), bookingData, requestConfig);
         window.location.href = response.data.approval_url;
       } else if (formData.payment_method === 'zelle') {
         // Create Zelle booking
-        const response = await axios.post(getApiUrl(API_ENDPOINTS.CREATE_ZELLE_BOOKING), bookingData);
+        const response = await axios.post(getApiUrl(API_ENDPOINTS.CREATE_ZELLE_BOOKING), bookingData, requestConfig);
         navigate(`/zelle-instructions/${response.data.booking_id}`);
       }
     } catch (error) {
+      // Keep the key after network errors/timeouts (the booking may exist);
+      // a server answer means the next attempt is a new request
+      if (error.response) {
+        idempotencyKeyRef.current = null;
+      }
       console.error('Error creating booking:', error);
-      alert('Error al crear la reserva. Por favor intenta nuevamente.');
+      if (error.response?.status === 429) {
+        const retryAfter = error.response.headers['retry-after'];
+        alert(`Demasiados intentos. Por favor intenta nuevamente en ${retryAfter || 'unos'} segundos.`);
+      } else {
+        alert('Error al crear la reserva. Por favor intenta nuevamente.');
+      }
     } finally {
       setLoading(false);
     }
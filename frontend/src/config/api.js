@@ -21,6 +21,7 @@ export { API_BASE_URL };
 export const API_ENDPOINTS = {
   HEALTH: 'health',
   AVAILABLE_SLOTS: 'available-slots',
+  AVAILABILITY_STREAM: 'availability/stream',
   PRICING_CONFIG: 'pricing-config',
   ZELLE_CONFIG: 'zelle-config',
   CREATE_PAYPAL_ORDER: 'create-paypal-order',